@@ -2,7 +2,7 @@ import spidev
 import pigpio
 import time
 import logging
-from main import pigpio_instance
+from hal import get_pi
 class MFRC522:
     MAX_LEN = 16
 
@@ -113,7 +113,7 @@ class MFRC522:
         level = logging.getLevelName(debugLevel)
         self.logger.setLevel(level)
 
-        self.pi = pi if pi else pigpio_instance
+        self.pi = pi if pi else get_pi()
 
         if pin_rst != -1:
             self.pi.set_mode(pin_rst, pigpio.OUTPUT)
@@ -132,8 +132,7 @@ class MFRC522:
         return val[1]
 
     def Close_MFRC522(self):
-        self.spi.close()
-        self.pi.stop()  # Properly stop pigpio connection
+        self.spi.close()  # The pigpio connection is shared and closed by hal.cleanup()
 
     def SetBitMask(self, reg, mask):
         tmp = self.Read_MFRC522(reg)
@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import time
+
+from smart_charging import parse_time
+
+AUTH_CACHE_FILE = "auth_cache.json"
+MAX_ENTRIES = 1000  # Least recently presented tags are dropped beyond this
+# Seconds to wait for Authorize.conf before the CSMS counts as unreachable
+AUTHORIZE_TIMEOUT = 5
+# Shorter wait for a tag the cache accepts, which is allowed offline anyway under LocalAuthorizeOffline
+CACHED_AUTHORIZE_TIMEOUT = 1.5
+# Upper bound on the growing wait between StartTransaction attempts for a locally started session
+MAX_START_RETRY_INTERVAL = 300
+
+
+class AuthorizationCache:
+    """
+    OCPP 1.6 Authorization Cache: the latest idTagInfo the CSMS returned for
+    each idTag in Authorize.conf and StartTransaction.conf, kept in
+    AUTH_CACHE_FILE so tags are still known after a restart and while the CSMS
+    cannot be reached. An entry past its expiryDate counts as unknown.
+    """
+
+    def __init__(self, path=AUTH_CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = self.load()  # id_tag: {"status", "expiry" (epoch seconds or None), "seen"}
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                entries = json.load(file)
+            return {str(id_tag): entry for id_tag, entry in entries.items() if isinstance(entry, dict) and "status" in entry}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            logging.warning(f"Ignoring unreadable authorization cache {self.path}: {e}")
+            return {}
+
+    def status(self, id_tag, now=None):
+        """Cached authorization status of `id_tag`, or None if it is unknown or its entry has expired."""
+        entry = self.entries.get(id_tag)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        if entry.get("expiry") is not None and entry["expiry"] <= now:
+            return None
+        entry["seen"] = now
+        return entry["status"]
+
+    def accepted(self, id_tag, now=None):
+        return self.status(id_tag, now) == 'Accepted'
+
+    def update(self, id_tag, id_tag_info, now=None):
+        """Store the idTagInfo of a confirmation; the file is only rewritten when status or expiry change."""
+        if not id_tag or not id_tag_info or not id_tag_info.get('status'):
+            return
+        try:
+            expiry = parse_time(id_tag_info['expiry_date']) if id_tag_info.get('expiry_date') else None
+        except (TypeError, ValueError):
+            expiry = None
+        now = time.time() if now is None else now
+        entry = {"status": str(id_tag_info['status']), "expiry": expiry, "seen": now}
+        previous = self.entries.get(id_tag)
+        self.entries[id_tag] = entry
+        if previous is not None and (previous["status"], previous.get("expiry")) == (entry["status"], expiry):
+            return
+        if len(self.entries) > self.max_entries:
+            for stale in sorted(self.entries, key=lambda tag: self.entries[tag].get("seen", 0))[:len(self.entries) - self.max_entries]:
+                del self.entries[stale]
+        self.save()
+
+    def clear(self):
+        self.entries = {}
+        self.save()
+
+    def save(self):
+        temp_file = f"{self.path}.tmp"
+        try:
+            with open(temp_file, 'w') as file:
+                json.dump(self.entries, file, separators=(',', ':'))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file, self.path)
+        except OSError as e:
+            logging.error(f"Failed to write authorization cache {self.path}: {e}")
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def benchmark(delay=1.0):
+    """
+    Tap-to-relay latency of main.ChargePoint.start_transaction against a CSMS
+    stand-in that answers every Call `delay` seconds late, or not at all.
+    """
+    import asyncio
+    import contextlib
+    import io
+    import shutil
+    import tempfile
+
+    import websockets
+
+    source = os.path.dirname(os.path.abspath(__file__))
+    settings = {"delay": delay, "silent": False, "rejected": set()}
+    stops = []
+    lines = []  # Printed at the end, as the simulated LCD writes to stdout
+
+    async def csms(ws):
+        transaction_id = 1000
+        async for message in ws:
+            message_type, unique_id, action, payload = json.loads(message)[:4]
+            if message_type != 2 or settings["silent"]:
+                continue
+            await asyncio.sleep(settings["delay"])
+            status = 'Invalid' if payload.get("idTag") in settings["rejected"] else 'Accepted'
+            if action == "Authorize":
+                result = {"idTagInfo": {"status": status}}
+            elif action == "StartTransaction":
+                transaction_id += 1
+                result = {"transactionId": transaction_id, "idTagInfo": {"status": status}}
+            elif action == "StopTransaction":
+                stops.append(payload.get("reason"))
+                result = {}
+            elif action in ("BootNotification", "Heartbeat"):
+                result = {"status": "Accepted", "currentTime": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), "interval": 300}
+            else:
+                result = {}
+            await ws.send(json.dumps([3, unique_id, result]))
+
+    async def tap(cp, connector_id, id_tag):
+        started = time.perf_counter()
+        await cp.start_transaction(connector_id, id_tag)
+        elapsed = time.perf_counter() - started
+        return elapsed if cp.connectors[connector_id].relay.relay_state == 1 else None
+
+    async def run():
+        import main
+
+        async with websockets.serve(csms, "127.0.0.1", 0, subprotocols=["ocpp1.6j"]) as server:
+            port = server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}/CP", subprotocols=["ocpp1.6j"]) as ws:
+                cp = main.ChargePoint("CP", ws, hardware=main.Hardware(main.get_config_store().snapshot))
+                reader = asyncio.create_task(cp.start())
+                store = cp.config_store
+
+                def report(label, elapsed):
+                    lines.append(f"  {label:52s} {'no relay' if elapsed is None else f'{elapsed * 1e3:7.1f} ms'}")
+
+                async def settle():
+                    """Let the StatusNotifications of the previous step through, so each step starts with an idle link."""
+                    idle_since = time.monotonic()
+                    while time.monotonic() - idle_since < 0.2:
+                        await asyncio.sleep(0.02)
+                        if cp._call_lock.locked():
+                            idle_since = time.monotonic()
+
+                async def stop_all():
+                    for connector in cp.connectors.with_transaction():
+                        await cp.stop_transaction(connector.connector_id, 'Local')
+                    await settle()
+
+                lines.append(f"CSMS answering after {delay * 1e3:.0f} ms")
+                await settle()
+                started = time.perf_counter()  # The previous start_transaction, up to the relay
+                cp.update_connector_status(3, status='Preparing')
+                await cp.authorize("TAG1")
+                await cp.call(main.call.StartTransactionPayload(connector_id=3, id_tag="TAG1", meter_start=0,
+                                                                timestamp=main.datetime.utcnow().isoformat()))
+                report("before: Authorize, then StartTransaction.conf", time.perf_counter() - started)
+                cp.update_connector_status(3, status='Available')
+                await settle()
+
+                store.set("LocalPreAuthorize", "false")
+                report("unknown tag, Authorize.conf then relay", await tap(cp, 1, "TAG2"))
+                await settle()
+                store.set("LocalPreAuthorize", "true")
+                report("cached tag, LocalPreAuthorize", await tap(cp, 2, "TAG1"))
+                await stop_all()
+
+                settings["rejected"].add("TAG3")
+                cp.auth_cache.update("TAG3", {"status": "Accepted"})
+                for stop_on_invalid in ("true", "false"):
+                    store.set("StopTransactionOnInvalidId", stop_on_invalid)
+                    report("revoked tag, energised from the cache", await tap(cp, 1, "TAG3"))
+                    started = time.perf_counter()
+                    while cp.connectors[1].relay.relay_state == 1:
+                        await asyncio.sleep(0.01)
+                    connector = cp.connectors[1]
+                    report(f"  de-energised, StopTransactionOnInvalidId={stop_on_invalid}", time.perf_counter() - started)
+                    await settle()
+                    lines.append(f"    status {connector.status}, transaction kept: {connector.transaction is not None}")
+                    await stop_all()
+                    cp.auth_cache.update("TAG3", {"status": "Accepted"})
+                lines.append(f"  StopTransaction reasons sent: {stops}")
+
+                settings["silent"] = True
+                store.set("LocalPreAuthorize", "false")
+                report("CSMS silent, cached tag, LocalAuthorizeOffline", await tap(cp, 3, "TAG1"))
+                report("CSMS silent, unknown tag", await tap(cp, 2, "TAG9"))
+                reader.cancel()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        shutil.copy(os.path.join(source, "config.json"), directory)
+        os.chdir(directory)
+        logging.disable(logging.ERROR)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(run())
+        finally:
+            logging.disable(logging.NOTSET)
+            os.chdir(cwd)
+    print("\n".join(lines))
+
+
+if __name__ == '__main__':
+    benchmark()
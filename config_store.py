@@ -0,0 +1,371 @@
+import atexit
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from types import MappingProxyType
+
+SAVE_DELAY = 2.0  # Seconds to coalesce bursts of ChangeConfiguration before writing
+POLL_INTERVAL = 2.0  # Fallback file check interval when inotify is not available
+
+MEASURANDS = {
+    "Current.Export", "Current.Import", "Current.Offered", "Energy.Active.Export.Register",
+    "Energy.Active.Import.Register", "Energy.Reactive.Export.Register", "Energy.Reactive.Import.Register",
+    "Energy.Active.Export.Interval", "Energy.Active.Import.Interval", "Energy.Reactive.Export.Interval",
+    "Energy.Reactive.Import.Interval", "Frequency", "Power.Active.Export", "Power.Active.Import",
+    "Power.Factor", "Power.Offered", "Power.Reactive.Export", "Power.Reactive.Import", "RPM", "SoC",
+    "Temperature", "Voltage",
+}
+
+# key: (type, default, readonly, minimum). Keys not listed here are kept as-is.
+CONFIG_SCHEMA = {
+    "HeartbeatInterval": (int, 30, False, 0),
+    "MeterValueSampleInterval": (int, 60, False, 0),
+    "ClockAlignedDataInterval": (int, 900, False, 0),
+    "MeterValuesMaxBatch": (int, 1, False, 1),
+    "MeterValuesMaxBatchLatency": (int, 0, False, 0),
+    "AdaptiveSampling": (bool, False, False, None),
+    "AdaptiveSampleMinInterval": (int, 10, False, 1),
+    "AdaptiveSampleMaxInterval": (int, 300, False, 1),
+    "AdaptivePowerChangeThreshold": (float, 0.1, False, 0),
+    "NumberOfConnectors": (int, 2, True, 1),
+    "BootNotificationRetryInterval": (int, 10, False, 1),
+    "MaxBootNotificationRetries": (int, 5, False, 0),
+    "Model": (str, "", True, None),
+    "Vendor": (str, "", True, None),
+    "ChargePointSerialNumber": (str, "", True, None),
+    "FirmwareVersion": (str, "", True, None),
+    "ConnectionTimeout": (int, 120, False, 0),
+    "MeterValuesAlignedData": ("measurands", [], False, None),
+    "MeterValuesSampledData": ("measurands", [], False, None),
+    "StopTxnAlignedData": ("measurands", [], False, None),
+    "StopTxnSampledData": ("measurands", [], False, None),
+    "TransactionMessageAttempts": (int, 3, False, 0),
+    "TransactionMessageRetryInterval": (int, 5, False, 0),
+    "TransactionResumeWindow": (int, 120, False, 0),
+    "AuthorizationCacheEnabled": (bool, True, False, None),
+    "LocalPreAuthorize": (bool, False, False, None),
+    "LocalAuthorizeOffline": (bool, True, False, None),
+    "AllowOfflineTxForUnknownId": (bool, False, False, None),
+    "StopTransactionOnInvalidId": (bool, True, False, None),
+    "ReadOnlyParameters": (list, [], True, None),
+    "VoltageRestrictions_max": (float, 250.0, False, 0),
+    "VoltageRestrictions_min": (float, 210.0, False, 0),
+    "CurrentRestrictions_max": (float, 32.0, False, 0),
+    "CurrentRestrictions_min": (float, 0.3, False, 0),
+    "CurrentTimingRestrictions_duration_minutes": (float, 1.0, False, 0),
+    "RelayPins": (dict, {}, True, None),
+    "PilotPins": (dict, {}, True, None),
+    "MeterProcess": (bool, False, True, None),
+    "MeterProcessCpu": (int, -1, True, None),
+    "MeterLinkBaud": (int, 115200, True, 9600),
+    "MeterBackend": (str, "mcu", True, None),
+    "ModbusMeters": (dict, {}, True, None),
+    "ModbusPort": (str, "/dev/ttyUSB0", True, None),
+    "ModbusBaud": (int, 9600, True, 1200),
+    "ModbusPollInterval": (float, 1.0, True, 0.1),
+    "MeterHistoryResolution": (float, 1.0, True, 0.1),
+    "MeterHistoryFlushInterval": (int, 60, True, 1),
+    "MeterHistoryRawDays": (int, 7, True, 1),
+    "MeterHistoryRollupDays": (int, 180, True, 1),
+    "LogRingSize": (int, 2000, True, 100),
+    "LogFileMaxBytes": (int, 1048576, True, 65536),
+    "LogFileCount": (int, 10, True, 1),
+    "LogSampleBurst": (int, 20, True, 1),
+    "LogSampleWindow": (int, 60, True, 1),
+    "LoopStallWarning": (float, 1.0, True, 0.1),
+    "LoopStallTimeout": (float, 10.0, True, 1),
+    "LoopStallRestart": (bool, True, True, None),
+    "HardwareWatchdogDevice": (str, "", True, None),
+    "SiteCurrentLimit": (float, 0.0, False, 0),
+    "ConnectorMaxCurrent": (float, 32.0, False, 0),
+    "ChargeProfileMaxStackLevel": (int, 10, True, 0),
+    "ChargingScheduleAllowedChargingRateUnit": (list, ["Current", "Power"], True, None),
+    "ChargingScheduleMaxPeriods": (int, 24, True, 1),
+    "MaxChargingProfilesInstalled": (int, 10, True, 1),
+}
+
+
+def convert_value(key, value):
+    """Convert a config value (native JSON or an OCPP string) to its schema type; raises ValueError."""
+    if key not in CONFIG_SCHEMA:
+        return value
+    kind, _, _, minimum = CONFIG_SCHEMA[key]
+    if kind is int:
+        if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+            raise ValueError(f"{key} must be an integer")
+        value = int(value)
+    elif kind is float:
+        if isinstance(value, bool):
+            raise ValueError(f"{key} must be a number")
+        value = float(value)
+    elif kind is bool:
+        if isinstance(value, str):
+            if value.lower() not in ('true', 'false'):
+                raise ValueError(f"{key} must be true or false")
+            value = value.lower() == 'true'
+        value = bool(value)
+    elif kind is str:
+        value = str(value)
+    elif kind in (list, "measurands"):
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(",") if item.strip()]
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f"{key} must be a list")
+        value = tuple(value)
+        if kind == "measurands":
+            unknown = [item for item in value if item not in MEASURANDS]
+            if unknown:
+                raise ValueError(f"{key} has unknown measurands {unknown}")
+    elif kind is dict:
+        if isinstance(value, str):
+            value = json.loads(value)
+        if not isinstance(value, dict):
+            raise ValueError(f"{key} must be an object")
+        value = MappingProxyType(dict(value))
+    if minimum is not None and kind in (int, float) and value < minimum:
+        raise ValueError(f"{key} must be >= {minimum}")
+    return value
+
+
+def to_json_value(value):
+    if isinstance(value, tuple):
+        return list(value)
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    return value
+
+
+class ConfigSnapshot:
+    """
+    Immutable, typed view of config.json. A new snapshot is built for every
+    change and swapped in one assignment, so readers never see a half-applied
+    update and never need to cast values.
+    """
+
+    __slots__ = ('_values',)
+
+    def __init__(self, values):
+        object.__setattr__(self, '_values', MappingProxyType(values))
+
+    def __getattr__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ConfigSnapshot is immutable; use ConfigStore.set()")
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def keys(self):
+        return self._values.keys()
+
+    def items(self):
+        return self._values.items()
+
+    def to_json(self):
+        return {key: to_json_value(value) for key, value in self._values.items()}
+
+
+def build_snapshot(raw, previous=None):
+    """Typed snapshot of `raw`; schema keys it lacks get their CONFIG_SCHEMA default."""
+    values = {key: convert_value(key, schema[1]) for key, schema in CONFIG_SCHEMA.items() if key not in raw}
+    for key, value in raw.items():
+        try:
+            values[key] = convert_value(key, value)
+        except (TypeError, ValueError) as e:
+            fallback = previous.get(key) if previous is not None and key in previous else CONFIG_SCHEMA[key][1]
+            logging.error(f"Invalid config value {key}={value!r} ({e}); using {fallback!r}")
+            values[key] = convert_value(key, fallback)
+    return ConfigSnapshot(values)
+
+
+class ConfigStore:
+    """
+    Owns config.json: loads it into a ConfigSnapshot, applies validated
+    ChangeConfiguration values, reloads when the file is edited (inotify, or
+    polling where inotify is missing) and persists changes atomically.
+
+    Saves are coalesced: a burst of changes within SAVE_DELAY results in a
+    single temp-file + fsync + rename, which keeps SD-card writes down.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.save_timer = None
+        self.last_written = None
+        self.watcher = None
+        self.snapshot = build_snapshot(self._read() or {})
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (IOError, json.JSONDecodeError) as e:
+            logging.error(f"Failed to load JSON config from {self.path}: {e}")
+            return None
+
+    def is_readonly(self, key):
+        schema = CONFIG_SCHEMA.get(key)
+        return (schema is not None and schema[2]) or key in self.snapshot.get("ReadOnlyParameters", ())
+
+    def set(self, key, value):
+        """Validate and apply one OCPP value. Returns 'Accepted', 'Rejected' or 'NotSupported'."""
+        with self.lock:
+            if key not in self.snapshot and key not in CONFIG_SCHEMA:
+                return 'NotSupported'
+            if self.is_readonly(key):
+                return 'Rejected'
+            try:
+                converted = convert_value(key, value)
+            except (TypeError, ValueError) as e:
+                logging.warning(f"Rejected ChangeConfiguration {key}={value!r}: {e}")
+                return 'Rejected'
+            values = dict(self.snapshot.items())
+            values[key] = converted
+            self.snapshot = ConfigSnapshot(values)
+        self.save()
+        return 'Accepted'
+
+    def reload(self):
+        with self.lock:
+            raw = self._read()
+            if raw is None:
+                return self.snapshot  # Keep the last good config, e.g. while an editor is mid-write
+            self.snapshot = build_snapshot(raw, previous=self.snapshot)
+            return self.snapshot
+
+    def save(self, delay=SAVE_DELAY):
+        with self.lock:
+            if self.save_timer is not None:
+                return  # A write is already pending and will pick up this change
+            self.save_timer = threading.Timer(delay, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def flush_pending(self):
+        """Write now if a coalesced save is still waiting (e.g. at exit)."""
+        if self.save_timer is not None:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            data = json.dumps(self.snapshot.to_json())
+            temp_file = f'{self.path}.tmp'
+            try:
+                with open(temp_file, 'w') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_file, self.path)
+                self._fsync_dir()
+                self.last_written = data
+            except OSError as e:
+                logging.error(f"Failed to save config to {self.path}: {e}")
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _on_file_changed(self):
+        with self.lock:
+            try:
+                with open(self.path, 'r') as file:
+                    if file.read() == self.last_written:
+                        return  # Our own save
+            except IOError:
+                return
+        logging.info(f"{self.path} changed on disk, reloading configuration.")
+        self.reload()
+
+    def watch(self):
+        if self.watcher is None:
+            self.watcher = threading.Thread(target=self._watch, daemon=True)
+            self.watcher.start()
+            atexit.register(self.flush_pending)
+        return self
+
+    def _watch(self):
+        try:
+            inotify = Inotify(os.path.dirname(os.path.abspath(self.path)))
+        except OSError as e:
+            logging.info(f"inotify unavailable ({e}), polling {self.path} for changes.")
+            self._poll()
+            return
+        name = os.path.basename(self.path)
+        while True:
+            if name in inotify.read_names():
+                self._on_file_changed()
+
+    def _poll(self):
+        last_mtime = None
+        while True:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if last_mtime is not None and mtime != last_mtime:
+                self._on_file_changed()
+            last_mtime = mtime
+            time.sleep(POLL_INTERVAL)
+
+
+class Inotify:
+    """Minimal ctypes binding: watches one directory for files being written or renamed into it."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify not supported")
+        self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def read_names(self):
+        """Block until events arrive and return the file names they refer to."""
+        data = os.read(self.fd, 4096)
+        names = set()
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            _, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            names.add(data[offset:offset + length].rstrip(b'\0').decode('utf-8', errors='replace'))
+            offset += length
+        return names
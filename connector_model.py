@@ -0,0 +1,230 @@
+import logging
+
+STATUSES = ('Available', 'Preparing', 'Charging', 'SuspendedEVSE', 'SuspendedEV', 'Finishing', 'Reserved',
+            'Unavailable', 'Faulted')
+# OCPP 1.6 connector status transitions (section 4.9); anything else is refused
+TRANSITIONS = {
+    'Available': frozenset({'Preparing', 'Charging', 'SuspendedEV', 'SuspendedEVSE', 'Reserved', 'Unavailable', 'Faulted'}),
+    'Preparing': frozenset({'Available', 'Charging', 'SuspendedEV', 'SuspendedEVSE', 'Finishing', 'Faulted'}),
+    'Charging': frozenset({'Available', 'SuspendedEV', 'SuspendedEVSE', 'Finishing', 'Unavailable', 'Faulted'}),
+    'SuspendedEV': frozenset({'Available', 'Charging', 'SuspendedEVSE', 'Finishing', 'Unavailable', 'Faulted'}),
+    'SuspendedEVSE': frozenset({'Available', 'Charging', 'SuspendedEV', 'Finishing', 'Unavailable', 'Faulted'}),
+    'Finishing': frozenset({'Available', 'Preparing', 'Unavailable', 'Faulted'}),
+    'Reserved': frozenset({'Available', 'Preparing', 'Unavailable', 'Faulted'}),
+    'Unavailable': frozenset({'Available', 'Preparing', 'Charging', 'SuspendedEV', 'SuspendedEVSE', 'Faulted'}),
+    'Faulted': frozenset({'Available', 'Preparing', 'Charging', 'SuspendedEV', 'SuspendedEVSE', 'Finishing', 'Reserved',
+                          'Unavailable'}),
+}
+# Statuses of a connector whose transaction is delivering, or could deliver, energy
+CHARGING_STATES = frozenset({'Charging', 'SuspendedEV', 'SuspendedEVSE'})
+SUSPENDED_EV_DELAY = 10.0  # Seconds without current draw before the EV counts as suspended
+
+
+class Transaction:
+    __slots__ = ('transaction_id', 'connector_id', 'id_tag', 'meter_start', 'start_time', 'authorized', 'stopping')
+
+    def __init__(self, transaction_id, connector_id, id_tag, meter_start, start_time):
+        self.transaction_id = transaction_id  # None until StartTransaction.conf for a locally started session
+        self.connector_id = connector_id
+        self.id_tag = id_tag
+        self.meter_start = meter_start
+        self.start_time = start_time
+        self.authorized = True  # False once StartTransaction.conf refuses the idTag
+        self.stopping = False  # stop_transaction is under way
+
+
+class Connector:
+    """
+    Everything main.py tracks for one connector: OCPP status and what was last
+    notified, the latest meter sample and energy register, its relay and the
+    running transaction. Meter frames update the fields in place.
+    """
+
+    __slots__ = ('connector_id', 'status', 'error_code', 'notification_sent', 'voltage', 'current', 'power', 'energy',
+                 'frame_time', 'idle_since', 'relay', 'transaction', 'history')
+
+    def __init__(self, connector_id, relay=None):
+        self.connector_id = connector_id
+        self.status = 'Available'
+        self.error_code = 'NoError'
+        self.notification_sent = False
+        self.voltage = 0.0
+        self.current = 0.0
+        self.power = 0.0
+        self.energy = 0.0  # Wh register
+        self.frame_time = None  # time.monotonic() of the latest meter frame
+        self.idle_since = None  # When the current last dropped to zero
+        self.relay = relay
+        self.transaction = None
+        self.history = None  # SessionHistory of the running transaction
+
+    def set_status(self, status=None, error_code=None):
+        """Apply a status and/or error code; True if either changed and a StatusNotification is due."""
+        status = self.status if status is None else status
+        error_code = self.error_code if error_code is None else error_code
+        if status == self.status and error_code == self.error_code:
+            return False
+        if status != self.status and status not in TRANSITIONS[self.status]:
+            logging.warning(f"Connector {self.connector_id}: {self.status} -> {status} is not an OCPP transition; ignored")
+            return False
+        self.status = status
+        self.error_code = error_code
+        self.notification_sent = False
+        return True
+
+    def integrate(self, power, now):
+        """Energy register after adding `power` W since the previous frame, for meters without their own register."""
+        if self.frame_time is not None:
+            return self.energy + power * (now - self.frame_time) / 3600
+        return self.energy
+
+    def record_meter(self, voltage, current, power, energy, now):
+        self.voltage = voltage
+        self.current = current
+        self.power = power
+        self.energy = energy
+        self.frame_time = now
+        if current > 0:
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = now
+
+    def charging_status(self, now, offered=None):
+        """Charging, SuspendedEV (no draw for SUSPENDED_EV_DELAY) or SuspendedEVSE (offered 0 A) during a transaction."""
+        if offered == 0:
+            return 'SuspendedEVSE'
+        if self.idle_since is not None and now - self.idle_since >= SUSPENDED_EV_DELAY:
+            return 'SuspendedEV'
+        return 'Charging'
+
+    def meter_value(self):
+        return {'voltage': self.voltage, 'current': self.current, 'power': self.power, 'energy': self.energy}
+
+
+class CurrentDraws:
+    """Read-only connector_id -> current view of a ConnectorSet, for LoadManager.allocate_frame."""
+
+    __slots__ = ('connectors',)
+
+    def __init__(self, connectors):
+        self.connectors = connectors
+
+    def get(self, connector_id, default=0.0):
+        connector = self.connectors.get(connector_id)
+        return connector.current if connector is not None else default
+
+
+class ConnectorSet:
+    """
+    Connectors 1..N in a list indexed by id. Ids from JSON (config keys,
+    CSMS payloads) may be strings; every lookup takes either.
+    """
+
+    def __init__(self, count, relays=None):
+        relays = relays or {}
+        self.slots = [None] + [Connector(connector_id, relays.get(connector_id)) for connector_id in range(1, count + 1)]
+        self.draws = CurrentDraws(self)
+
+    def get(self, connector_id):
+        try:
+            connector_id = int(connector_id)
+        except (TypeError, ValueError):
+            return None
+        return self.slots[connector_id] if 0 < connector_id < len(self.slots) else None
+
+    def __getitem__(self, connector_id):
+        connector = self.get(connector_id)
+        if connector is None:
+            raise KeyError(connector_id)
+        return connector
+
+    def __contains__(self, connector_id):
+        return self.get(connector_id) is not None
+
+    def __iter__(self):
+        return iter(self.slots[1:])
+
+    def __len__(self):
+        return len(self.slots) - 1
+
+    def ids(self):
+        return range(1, len(self.slots))
+
+    def with_transaction(self):
+        """Connectors with a running transaction, as a list so callers may stop them while iterating."""
+        return [connector for connector in self.slots[1:] if connector.transaction is not None]
+
+    def find_transaction(self, transaction_id):
+        for connector in self.slots[1:]:
+            if connector.transaction is not None and connector.transaction.transaction_id == transaction_id:
+                return connector
+        return None
+
+
+def benchmark(frames=20000, connectors=3):
+    """Per-frame cost of the meter hot path: the previous dict-per-frame handling against in-place Connector updates."""
+    import time
+    import tracemalloc
+
+    frame = {connector_id: {'voltage': 230.0, 'current': 16.0, 'power': 3680.0, 'energy': 0}
+             for connector_id in range(1, connectors + 1)}
+    samples = [(0.0, connector_id, 230.0, 16.0, 3680.0, 0.0) for connector_id in range(1, connectors + 1)]
+
+    def dict_path():
+        meter = {}
+        last_frame_time = {}
+
+        def handle(now):
+            for key, values in frame.items():
+                values = dict(values)  # parse_meter_line builds a fresh dict per connector per frame
+                elapsed = now - last_frame_time.get(key, now)
+                last_frame_time[key] = now
+                if key in meter:
+                    meter[key]['energy'] += values['power'] * (elapsed / 3600)
+                    values['energy'] = meter[key]['energy']
+                meter[key] = values
+                f"Meter {key}: {meter[key]}"  # The debug line, formatted whether or not it was logged
+            return {key: values['current'] for key, values in meter.items()}
+        return handle, meter
+
+    def connector_path():
+        connector_set = ConnectorSet(connectors)
+
+        def handle(now):
+            for _, connector_id, voltage, current, power, _ in samples:
+                connector = connector_set.slots[connector_id]
+                connector.record_meter(voltage, current, power, connector.integrate(power, now), now)
+                connector.charging_status(now)
+            return connector_set.draws
+        return handle, connector_set
+
+    print(f"{connectors} connectors, {frames} frames")
+    for name, build in (("dicts", dict_path), ("connectors", connector_path)):
+        handle, state = build()
+        handle(0.0)
+        started = time.perf_counter()
+        for index in range(frames):
+            handle(index * 0.01)
+        elapsed = (time.perf_counter() - started) / frames
+
+        tracemalloc.start()
+        handle(0.0)
+        transient = 0
+        for index in range(1000):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            handle(index * 0.01)
+            transient = max(transient, tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        handle, state = build()
+        handle(0.0)
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"  {name:10s} {elapsed * 1e6:5.2f} us/frame, {transient:5d} B allocated per frame, "
+              f"{retained / connectors:5.0f} B of state per connector")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,5 +1,6 @@
 import json
 import subprocess
+import nm_profiles
 
 # Path to the hardware details JSON file
 hardware_details_path = './hardware_details.json'
@@ -27,20 +28,11 @@ def disconnect_wifi_interface(interface='wlan0'):
         print(f"Failed to disconnect {interface}: {e}")
 
 def create_hotspot(ssid, password):
-    """Creates a Wi-Fi hotspot using the specified SSID and password."""
-    try:
-        disconnect_wifi_interface()
-        # Turn off the Wi-Fi device
-        subprocess.run(['nmcli', 'radio', 'wifi', 'off'], check=True)
-        # Set the Wi-Fi device to managed mode
-        subprocess.run(['nmcli', 'device', 'set', 'wlan0', 'managed', 'yes'], check=True)
-        # Turn on the Wi-Fi device
-        subprocess.run(['nmcli', 'radio', 'wifi', 'on'], check=True)
-        # Create the Wi-Fi Hotspot
-        subprocess.run(['nmcli', 'device', 'wifi', 'hotspot', 'ifname', 'wlan0', 'ssid', ssid, 'password', password], check=True)
-        print(f"Hotspot '{ssid}' created successfully.")
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to create hotspot: {e}")
+    """Brings up the saved hotspot profile, creating it with the given SSID and password on first use."""
+    if nm_profiles.switch_to_hotspot(ssid, password):
+        print(f"Hotspot '{ssid}' active (switch took {nm_profiles.last_switch.get('seconds', 0)}s).")
+    else:
+        print(f"Failed to create hotspot '{ssid}'.")
 
 def main():
     hardware_details = read_hardware_details(hardware_details_path)
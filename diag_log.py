@@ -0,0 +1,421 @@
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import zlib
+from collections import deque
+from urllib.parse import unquote, urlsplit
+
+LOG_DIR = "logs"
+LOG_FILE = "charger.log"
+RING_SIZE = 2000  # Most recent records kept in RAM
+FILE_MAX_BYTES = 1024 * 1024  # Rotate the log file at this size
+FILE_COUNT = 10  # Rotated files kept, gzip'd
+SAMPLE_BURST = 20  # INFO/DEBUG records let through per call site per window
+SAMPLE_WINDOW = 60  # Seconds
+QUEUE_SIZE = 10000  # Records waiting for the writer thread; more are dropped rather than block the caller
+CONSOLE_FORMAT = '%(levelname)s:%(name)s:%(message)s'  # basicConfig's, as PM2 has always captured it
+UPLOAD_CHUNK = 64 * 1024  # Bytes of compressed bundle handed to the uploader at a time
+UPLOAD_TIMEOUT = 60  # Seconds without progress before an upload fails
+
+installed = None  # The DiagnosticsLog set up by setup(), if any
+
+
+def record_entry(record):
+    """The structured form of a log record, as written to the files and the ring."""
+    entry = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name,
+             "message": record.getMessage()}
+    suppressed = getattr(record, 'suppressed', 0)
+    if suppressed:
+        entry["suppressed"] = suppressed
+    return entry
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record_entry(record))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `burst` records below WARNING per call site per
+    `window` seconds; the first record of the next window carries the number
+    dropped in `suppressed`. Warnings and errors always pass.
+    """
+
+    def __init__(self, burst=SAMPLE_BURST, window=SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.sites = {}  # (pathname, lineno): [window start, records passed, records dropped]
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        site = self.sites.get(key)
+        if site is None or record.created - site[0] >= self.window:
+            if site is not None and site[2]:
+                record.suppressed = site[2]
+            self.sites[key] = [record.created, 1, 0]
+            return True
+        if site[1] < self.burst:
+            site[1] += 1
+            return True
+        site[2] += 1
+        self.dropped += 1
+        return False
+
+
+class DropQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: with the queue full, the record is counted and dropped."""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only this module's handlers see the record, so it is not copied: the message and
+        # traceback are just rendered now, while the arguments and exception are still current
+        record.msg = record.getMessage()
+        if record.exc_info:
+            record.msg += '\n' + logging.Formatter().formatException(record.exc_info)
+        record.args = record.exc_info = record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # Waits for room, so stop() still writes out a full queue
+
+
+class RingHandler(logging.Handler):
+    def __init__(self, ring):
+        super().__init__()
+        self.ring = ring
+
+    def emit(self, record):
+        self.ring.append(record_entry(record))
+
+
+def _gzip_rotate(source, dest):
+    with open(source, 'rb') as plain, gzip.open(dest, 'wb') as packed:
+        shutil.copyfileobj(plain, packed)
+    os.remove(source)
+
+
+class DiagnosticsLog:
+    """
+    Root logging routed through a bounded queue to a writer thread, so a
+    log call costs the caller a filter check and a queue put, never disk I/O.
+    The writer thread sends every record to stdout (for PM2), to a ring of
+    the last RING_SIZE records and, as one JSON object per line, to
+    LOG_DIR/LOG_FILE, rotated at FILE_MAX_BYTES into FILE_COUNT gzip'd files
+    (charger.log.1.gz is the newest). High-frequency INFO/DEBUG call sites are
+    sampled by SamplingFilter.
+    """
+
+    def __init__(self, directory=LOG_DIR, ring_size=RING_SIZE, max_bytes=FILE_MAX_BYTES, file_count=FILE_COUNT,
+                 sample_burst=SAMPLE_BURST, sample_window=SAMPLE_WINDOW, console=True):
+        self.path = os.path.join(directory, LOG_FILE)
+        self.file_count = file_count
+        self.ring = deque(maxlen=ring_size)
+        handlers = [RingHandler(self.ring)]
+        try:
+            os.makedirs(directory, exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=file_count,
+                                                                encoding='utf-8', delay=True)
+            file_handler.namer = lambda name: name + '.gz'
+            file_handler.rotator = _gzip_rotate
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+        except OSError as e:
+            logging.error(f"Log files unavailable in {directory}, keeping logs in RAM only: {e}")
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+            handlers.append(console_handler)
+        self.sampler = SamplingFilter(sample_burst, sample_window)
+        self.queue_handler = DropQueueHandler(queue.Queue(QUEUE_SIZE))
+        self.queue_handler.addFilter(self.sampler)
+        self.listener = DrainingListener(self.queue_handler.queue, *handlers)
+
+    def install(self):
+        """Replace the root logger's handlers with the queue and start the writer thread."""
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        self.listener.start()
+        return self
+
+    def close(self):
+        """Write out what is queued and stop the writer thread."""
+        logging.getLogger().removeHandler(self.queue_handler)
+        self.listener.stop()
+
+    def stats(self):
+        return {"sampled_out": self.sampler.dropped, "queue_dropped": self.queue_handler.dropped,
+                "queued": self.queue_handler.queue.qsize(), "ring": len(self.ring)}
+
+    def log_files(self, since=None, until=None):
+        """Log files oldest first, leaving out those wholly before `since` or after `until` (epoch seconds)."""
+        paths = [f"{self.path}.{index}.gz" for index in range(self.file_count, 0, -1)] + [self.path]
+        for path in paths:
+            try:
+                if os.path.getmtime(path) < (since or 0):
+                    continue  # Last written before the range
+                if until is not None:
+                    with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'r')) as file:
+                        if json.loads(file.readline() or '{}').get('ts', 0) > until:
+                            continue  # First record after the range
+            except (OSError, ValueError, EOFError):
+                continue
+            yield path
+
+    def records(self, since=None, until=None):
+        """Yield log lines (JSON, with newline) in [since, until] from the files, or the ring if there are none."""
+        found = False
+        for path in self.log_files(since, until):
+            found = True
+            try:
+                with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as file:
+                    for line in file:
+                        if _in_range(line, since, until):
+                            yield line if line.endswith(b'\n') else line + b'\n'
+            except (OSError, EOFError) as e:
+                logging.warning(f"Could not read {path} for diagnostics: {e}")
+        if not found:
+            for entry in list(self.ring):
+                if (since is None or entry["ts"] >= since) and (until is None or entry["ts"] <= until):
+                    yield json.dumps(entry).encode() + b'\n'
+
+
+def _in_range(line, since, until):
+    if since is None and until is None:
+        return True
+    try:
+        ts = json.loads(line)["ts"]
+    except (ValueError, KeyError, TypeError):
+        return False
+    return (since is None or ts >= since) and (until is None or ts <= until)
+
+
+def setup(config=None):
+    """Install a DiagnosticsLog sized from the Log* config keys; returns it."""
+    global installed
+    config = config or {}
+    if installed is None:
+        installed = DiagnosticsLog(ring_size=config.get("LogRingSize", RING_SIZE),
+                                   max_bytes=config.get("LogFileMaxBytes", FILE_MAX_BYTES),
+                                   file_count=config.get("LogFileCount", FILE_COUNT),
+                                   sample_burst=config.get("LogSampleBurst", SAMPLE_BURST),
+                                   sample_window=config.get("LogSampleWindow", SAMPLE_WINDOW)).install()
+    return installed
+
+
+def bundle(sections, log=None, since=None, until=None):
+    """
+    Yield a gzip stream of NDJSON, UPLOAD_CHUNK bytes at a time: one
+    {"type": name, "data": ...} line per entry of `sections`, then the log
+    records in [since, until] as {"type": "log", ...} lines. Only one chunk
+    is held in memory at a time.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+    buffer = bytearray()
+    lines = (json.dumps({"type": name, "data": data}, default=str).encode() + b'\n' for name, data in sections.items())
+    for line in lines:
+        buffer += compressor.compress(line)
+    if log is not None:
+        for line in log.records(since, until):
+            buffer += compressor.compress(b'{"type":"log",' + line[1:])
+            if len(buffer) >= UPLOAD_CHUNK:
+                yield bytes(buffer)
+                buffer.clear()
+    buffer += compressor.flush()
+    yield bytes(buffer)
+
+
+class ChunkReader:
+    """File-like read() over an iterator of byte chunks, for ftplib.storbinary."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def upload(location, file_name, chunks, timeout=UPLOAD_TIMEOUT):
+    """
+    Stream `chunks` to `location` as `file_name`: FTP STOR into the URL's
+    directory, or HTTP PUT (chunked) to the URL, with `file_name` appended
+    when the URL ends in '/'. Blocking; raises on failure.
+    """
+    parts = urlsplit(location)
+    if parts.scheme == 'ftp':
+        import ftplib
+        with ftplib.FTP(timeout=timeout) as ftp:
+            ftp.connect(parts.hostname, parts.port or 21)
+            ftp.login(unquote(parts.username or 'anonymous'), unquote(parts.password or ''))
+            if parts.path.strip('/'):
+                ftp.cwd(unquote(parts.path))
+            ftp.storbinary(f"STOR {file_name}", ChunkReader(chunks), blocksize=UPLOAD_CHUNK)
+    elif parts.scheme in ('http', 'https'):
+        import requests  # Slow to import and only needed here
+        url = location + file_name if location.endswith('/') else location
+        response = requests.put(url, data=chunks, timeout=timeout, headers={'Content-Type': 'application/gzip'})
+        response.raise_for_status()
+    else:
+        raise ValueError(f"Unsupported diagnostics location {location!r}")
+
+
+def serve_uploads(directory, port=0):
+    """
+    Local stand-in for a CSMS upload server: accepts HTTP PUT (chunked or
+    with Content-Length) into `directory`. Returns the server; call
+    serve_forever() on it (it is started on a thread by benchmark()).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class UploadHandler(BaseHTTPRequestHandler):
+        def do_PUT(self):
+            path = os.path.join(directory, os.path.basename(self.path.rstrip('/')) or 'upload')
+            with open(path, 'wb') as file:
+                if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    while True:
+                        size = int(self.rfile.readline().split(b';')[0], 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            break
+                        file.write(self.rfile.read(size))
+                        self.rfile.readline()
+                else:
+                    remaining = int(self.headers.get('Content-Length', 0))
+                    while remaining:
+                        data = self.rfile.read(min(remaining, UPLOAD_CHUNK))
+                        file.write(data)
+                        remaining -= len(data)
+            self.send_response(201)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(('127.0.0.1', port), UploadHandler)
+
+
+def benchmark(records=200000):
+    """Caller cost of a log call during disk stalls, sampling of a hot call site, and bundle upload memory."""
+    import statistics
+    import tempfile
+    import threading
+    import time
+    import tracemalloc
+
+    class StallingHandler(logging.StreamHandler):
+        # An SD card that stalls for 50 ms every 2000 records
+        def emit(self, record):
+            self.count = getattr(self, 'count', 0) + 1
+            if self.count % 2000 == 0:
+                time.sleep(0.05)
+            super().emit(record)
+
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    root.setLevel(logging.INFO)
+    try:
+        with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+            calls = 20000
+            for name in ("direct handler", "queue"):
+                for handler in root.handlers[:]:
+                    root.removeHandler(handler)
+                stalling = StallingHandler(devnull)
+                if name == "queue":
+                    log = DiagnosticsLog(os.path.join(directory, "bench"), sample_burst=calls, console=False)
+                    log.listener.handlers += (stalling,)
+                    log.install()
+                else:
+                    root.addHandler(stalling)
+                latencies = []
+                for index in range(calls):
+                    started = time.perf_counter()
+                    logging.info(f"Meter frame {index}: 230.1 V, 16.02 A")
+                    latencies.append(time.perf_counter() - started)
+                dropped = ""
+                if name == "queue":
+                    log.close()
+                    dropped = f", {log.queue_handler.dropped} dropped with the queue full"
+                latencies.sort()
+                print(f"{name:15s} log call p50 {statistics.median(latencies) * 1e6:6.1f} us, "
+                      f"p99 {latencies[int(calls * 0.99)] * 1e6:7.1f} us, max {latencies[-1] * 1e3:6.2f} ms{dropped}")
+
+            log = DiagnosticsLog(os.path.join(directory, "sampling"), console=False).install()
+            for index in range(records):
+                record = logging.LogRecord('root', logging.INFO, __file__, 1, f"frame {index}", None, None)
+                record.created = 1e9 + index * 0.01  # 100 frames/s for 2000 s
+                log.queue_handler.handle(record)
+            log.close()
+            print(f"sampling: {records} INFO records from one call site at 100/s -> {records - log.sampler.dropped} written, "
+                  f"{log.sampler.dropped} counted as suppressed")
+
+            log = DiagnosticsLog(os.path.join(directory, "logs"), sample_burst=records, console=False).install()
+            started = time.time()
+            for index in range(records):
+                logging.info(f"Connector {index % 3 + 1} status check {index}: voltage 230.{index % 10} V")
+                if index % 1000 == 0:
+                    while log.queue_handler.queue.qsize() > 1000:  # Stay within what the writer keeps up with
+                        time.sleep(0.001)
+            log.close()
+            written = sum(os.path.getsize(path) for path in log.log_files())
+            print(f"log files: {len(list(log.log_files()))} files, {written // 1024} KiB on disk for {records} records")
+
+            uploads = os.path.join(directory, "uploads")
+            os.makedirs(uploads)
+            server = serve_uploads(uploads)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            location = f"http://127.0.0.1:{server.server_address[1]}/"
+            sections = {"config": {"HeartbeatInterval": 30}, "metrics": {"connectors": 3}, "faults": []}
+            import requests  # noqa: F401 - imported up front so the import is not counted as upload memory
+            for label, since in (("all", None), ("recent", started + (time.time() - started) * 0.9)):
+                tracemalloc.start()
+                began = time.perf_counter()
+                upload(location, f"{label}.ndjson.gz", bundle(sections, log, since=since))
+                elapsed = time.perf_counter() - began
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                path = os.path.join(uploads, f"{label}.ndjson.gz")
+                with gzip.open(path, 'rb') as file:
+                    lines = sum(1 for _ in file)
+                print(f"upload {label:6s}: {lines} lines, {os.path.getsize(path) // 1024} KiB gzip in {elapsed:.2f}s, "
+                      f"peak {peak // 1024} KiB of Python memory")
+            server.shutdown()
+    finally:
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        for handler in saved_handlers:
+            root.addHandler(handler)
+        root.setLevel(saved_level)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,151 @@
+import logging
+import time
+
+# Declarative meter fault rules, checked on every meter frame.
+#
+#   field         - meter field the rule watches
+#   op            - 'above' or 'below' the threshold
+#   threshold     - config key holding the threshold, with its default
+#   hysteresis    - how far back past the threshold the value must go to clear
+#   debounce      - consecutive frames the condition must hold before tripping
+#   hold_minutes  - optional config key: the condition must also hold this long
+#   transaction   - only evaluated while the connector has an active transaction
+#   status/error_code/stop_reason - one-shot actions taken when the rule trips
+FAULT_RULES = (
+    {"name": "under_voltage", "field": "voltage", "op": "below", "threshold": ("VoltageRestrictions_min", 210),
+     "hysteresis": 5.0, "debounce": 3, "transaction": False,
+     "status": "Faulted", "error_code": "UnderVoltage", "stop_reason": "SuspendedEVSE"},
+    {"name": "over_voltage", "field": "voltage", "op": "above", "threshold": ("VoltageRestrictions_max", 250),
+     "hysteresis": 5.0, "debounce": 3, "transaction": False,
+     "status": "Faulted", "error_code": "OverVoltage", "stop_reason": "SuspendedEVSE"},
+    {"name": "over_current", "field": "current", "op": "above", "threshold": ("CurrentRestrictions_max", 32),
+     "hysteresis": 1.0, "debounce": 2, "transaction": True,
+     "status": "Faulted", "error_code": "OverCurrentFailure", "stop_reason": "SuspendedEVSE"},
+    {"name": "idle_current", "field": "current", "op": "below", "threshold": ("CurrentRestrictions_min", 0.3),
+     "hysteresis": 0.0, "debounce": 1, "hold_minutes": ("CurrentTimingRestrictions_duration_minutes", 1), "transaction": True,
+     "status": "Available", "error_code": "NoError", "stop_reason": "SuspendedEV"},
+)
+
+TRIP = 'trip'
+RELEASE = 'release'
+
+
+class CompiledRule:
+    __slots__ = ('name', 'field', 'above', 'trip_level', 'release_level', 'debounce', 'hold_seconds',
+                 'transaction', 'status', 'error_code', 'stop_reason')
+
+    def __init__(self, rule, config):
+        key, default = rule["threshold"]
+        threshold = float(config.get(key, default))
+        self.name = rule["name"]
+        self.field = rule["field"]
+        self.above = rule["op"] == "above"
+        self.trip_level = threshold
+        self.release_level = threshold - rule["hysteresis"] if self.above else threshold + rule["hysteresis"]
+        self.debounce = int(rule["debounce"])
+        hold_key = rule.get("hold_minutes")
+        self.hold_seconds = float(config.get(hold_key[0], hold_key[1])) * 60 if hold_key else 0.0
+        self.transaction = rule["transaction"]
+        self.status = rule["status"]
+        self.error_code = rule["error_code"]
+        self.stop_reason = rule["stop_reason"]
+
+
+class FaultEvaluator:
+    """
+    Rule table compiled against one config: thresholds are cast once, and
+    per-connector state (debounce counters, hold timers, tripped flags) lives
+    in flat lists indexed by rule. evaluate() returns only state changes, so
+    each trip or release happens exactly once.
+    """
+
+    def __init__(self, config, rules=FAULT_RULES):
+        self.rules = [CompiledRule(rule, config) for rule in rules]
+        self.state = {}
+
+    def _connector_state(self, connector_id):
+        state = self.state.get(connector_id)
+        if state is None:
+            count = len(self.rules)
+            # [consecutive frames, condition start time, tripped]
+            state = self.state[connector_id] = ([0] * count, [None] * count, [False] * count)
+        return state
+
+    def evaluate(self, connector_id, voltage, current, in_transaction, now=None):
+        """Returns a list of (event, rule) tuples, event being TRIP or RELEASE."""
+        counts, since, tripped = self._connector_state(connector_id)
+        events = None
+        for index, rule in enumerate(self.rules):
+            value = voltage if rule.field == 'voltage' else current
+            if rule.transaction and not in_transaction:
+                counts[index] = 0
+                since[index] = None
+                if tripped[index]:
+                    tripped[index] = False
+                    events = events or []
+                    events.append((RELEASE, rule))
+                continue
+            if tripped[index]:
+                if (value < rule.release_level) if rule.above else (value > rule.release_level):
+                    tripped[index] = False
+                    counts[index] = 0
+                    since[index] = None
+                    events = events or []
+                    events.append((RELEASE, rule))
+                continue
+            if (value > rule.trip_level) if rule.above else (value < rule.trip_level):
+                counts[index] += 1
+                if rule.hold_seconds:
+                    if now is None:
+                        now = time.monotonic()
+                    if since[index] is None:
+                        since[index] = now
+                    if now - since[index] < rule.hold_seconds:
+                        continue
+                if counts[index] >= rule.debounce:
+                    tripped[index] = True
+                    events = events or []
+                    events.append((TRIP, rule))
+            else:
+                counts[index] = 0
+                since[index] = None
+        return events or ()
+
+    def is_faulted(self, connector_id):
+        state = self.state.get(connector_id)
+        if state is None:
+            return False
+        return any(tripped and rule.status == 'Faulted' for rule, tripped in zip(self.rules, state[2]))
+
+    def reset(self, connector_id=None):
+        if connector_id is None:
+            self.state.clear()
+        else:
+            self.state.pop(connector_id, None)
+
+
+def compile_rules(config, rules=FAULT_RULES, previous=None):
+    """Compile the rule table for a config, keeping per-connector state from `previous` when the rules line up."""
+    evaluator = FaultEvaluator(config, rules)
+    if previous is not None and [rule.name for rule in previous.rules] == [rule.name for rule in evaluator.rules]:
+        evaluator.state = previous.state
+    logging.info("Fault rules compiled: " + ", ".join(
+        f"{rule.name} {'>' if rule.above else '<'} {rule.trip_level}" for rule in evaluator.rules))
+    return evaluator
+
+
+def benchmark(frames=200000):
+    config = {"VoltageRestrictions_min": 200, "VoltageRestrictions_max": 260, "CurrentRestrictions_max": 20,
+              "CurrentRestrictions_min": 0.3, "CurrentTimingRestrictions_duration_minutes": 2}
+    evaluator = FaultEvaluator(config)
+    started = time.perf_counter()
+    now = 0.0
+    for frame in range(frames):
+        now += 0.02
+        evaluator.evaluate(1 + frame % 3, 230.0 + (frame % 100) * 0.4, 16.0, True, now)
+    elapsed = time.perf_counter() - started
+    print(f"fault rules: {elapsed / frames * 1e6:.2f} us/frame over {frames} frames ({len(evaluator.rules)} rules)")
+
+
+if __name__ == '__main__':
+    benchmark()
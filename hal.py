@@ -0,0 +1,405 @@
+# Hardware abstraction layer shared by main.py, webserver.py and the LCD/RFID helpers.
+#
+# Board detection runs once per process, every module shares one pigpio daemon
+# connection, and each peripheral (relays, GPIO inputs, serial meter, control
+# pilot current limit, LCD, RFID) has a Raspberry Pi backend and a
+# deterministic simulated backend. Set JP_HAL_BACKEND=sim to force the
+# simulator (or =pi to force hardware); by default the simulator is used
+# whenever the board is not a Raspberry Pi.
+import asyncio
+import atexit
+import functools
+import logging
+import math
+import os
+import platform
+import threading
+import time
+
+HAL_BACKEND_ENV = 'JP_HAL_BACKEND'
+SIM_METER_INTERVAL_ENV = 'JP_SIM_METER_INTERVAL'  # Seconds between simulated meter frames
+SIM_RFID_TAGS_ENV = 'JP_SIM_RFID_TAGS'  # Comma separated tags the simulated reader presents in turn
+
+SERIAL_PORT = '/dev/serial0'
+BAUD_RATE = 9600
+LCD_COLS = 20
+LCD_ROWS = 4
+
+SIM_VOLTAGE = 230.0
+SIM_CHARGING_CURRENT = 16.0
+
+_pi = None
+_pi_lock = threading.Lock()
+_lcd = None
+_current_limits = {}  # connector_id: amps offered by the simulated limiters
+
+
+@functools.lru_cache(maxsize=None)
+def is_raspberry_pi():
+    if platform.system() != 'Linux':
+        return False
+    try:
+        with open('/proc/device-tree/model', 'r') as file:
+            return 'Raspberry Pi' in file.read()
+    except (FileNotFoundError, PermissionError):
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def backend_name():
+    backend = os.environ.get(HAL_BACKEND_ENV)
+    if backend in ('pi', 'sim'):
+        return backend
+    return 'pi' if is_raspberry_pi() else 'sim'
+
+
+def use_simulator():
+    return backend_name() == 'sim'
+
+
+def get_pi():
+    """Return the process-wide pigpio connection, opening it on first use."""
+    global _pi
+    with _pi_lock:
+        if _pi is None:
+            import pigpio
+            pi = pigpio.pi()
+            if not pi.connected:
+                raise RuntimeError("Failed to connect to pigpio daemon")
+            _pi = pi
+            atexit.register(cleanup)
+        return _pi
+
+
+def cleanup():
+    global _pi
+    with _pi_lock:
+        if _pi is not None:
+            _pi.stop()
+            _pi = None
+            print("pigpio connection closed")
+
+
+# Relays
+class PigpioRelay:
+    def __init__(self, pin):
+        import pigpio
+        self.pin = pin
+        self.pi = get_pi()
+        self.pi.set_mode(pin, pigpio.OUTPUT)
+        self.state = self.pi.read(pin)
+
+    def set(self, state):
+        self.pi.write(self.pin, 1 if state else 0)
+        self.state = 1 if state else 0
+
+
+class SimulatedRelay:
+    def __init__(self, pin):
+        self.pin = pin
+        self.state = 0
+
+    def set(self, state):
+        self.state = 1 if state else 0
+
+
+def create_relay(pin):
+    return SimulatedRelay(pin) if use_simulator() else PigpioRelay(pin)
+
+
+# GPIO inputs
+class PigpioInput:
+    def __init__(self, pin, pull='down'):
+        import pigpio
+        self.pin = pin
+        self.pi = get_pi()
+        self.pi.set_mode(pin, pigpio.INPUT)
+        self.pi.set_pull_up_down(pin, {'up': pigpio.PUD_UP, 'down': pigpio.PUD_DOWN}.get(pull, pigpio.PUD_OFF))
+
+    def read(self):
+        return self.pi.read(self.pin)
+
+    def watch(self, callback, glitch_filter_us=0):
+        """
+        Call callback(level, tick) on every edge, `tick` being pigpio's
+        microsecond timestamp of the edge (wraps at 2**32); returns an object
+        with cancel().
+        """
+        import pigpio
+        if glitch_filter_us:
+            self.pi.set_glitch_filter(self.pin, glitch_filter_us)
+        return self.pi.callback(self.pin, pigpio.EITHER_EDGE, lambda gpio, level, tick: callback(level, tick))
+
+
+class _SimulatedWatch:
+    def __init__(self, watchers, callback):
+        self.watchers = watchers
+        self.callback = callback
+        watchers.append(callback)
+
+    def cancel(self):
+        if self.callback in self.watchers:
+            self.watchers.remove(self.callback)
+
+
+class SimulatedInput:
+    def __init__(self, pin, pull='down'):
+        self.pin = pin
+        self.level = 0 if pull == 'down' else 1
+        self.watchers = []
+
+    def read(self):
+        return self.level
+
+    def watch(self, callback, glitch_filter_us=0):
+        return _SimulatedWatch(self.watchers, callback)
+
+    def set_level(self, level, tick=None):
+        """Drive the simulated pin, e.g. from a test or benchmark; `tick` defaults to the monotonic clock in µs, as pigpio's."""
+        if level != self.level:
+            self.level = level
+            tick = int(time.monotonic() * 1e6) & 0xFFFFFFFF if tick is None else tick
+            for callback in list(self.watchers):
+                callback(level, tick)
+
+
+_inputs = {}
+
+def create_input(pin, pull='down'):
+    # Inputs are cached so a simulated pin driven elsewhere is the one being read
+    if pin not in _inputs:
+        _inputs[pin] = SimulatedInput(pin, pull) if use_simulator() else PigpioInput(pin, pull)
+    return _inputs[pin]
+
+
+# Serial meter
+class SerialMeterSource:
+    """
+    Reads the metering MCU over the UART: binary frames at up to max_baud when
+    the MCU firmware negotiates them (see meter_protocol), otherwise its
+    `M<id>,V,I,P` lines at BAUD_RATE.
+    """
+
+    def __init__(self, port=SERIAL_PORT, max_baud=BAUD_RATE):
+        import aioserial
+        from meter_protocol import MeterLink
+        self.serial = aioserial.AioSerial(port=port, baudrate=BAUD_RATE, parity=aioserial.PARITY_NONE,
+                                          stopbits=aioserial.STOPBITS_ONE, bytesize=aioserial.EIGHTBITS, timeout=1)
+        self.link = MeterLink(self.serial, max_baud=max_baud)
+
+    @property
+    def energy_register(self):
+        """True when frames carry the MCU's energy register, so power need not be integrated here."""
+        return self.link.energy_register
+
+    @property
+    def last_frame_time(self):
+        """time.monotonic() when the last frame arrived."""
+        return self.link.last_frame_time
+
+    async def read_frame(self):
+        """{connector_id: {'voltage', 'current', 'power', 'energy'}}, or None if nothing valid arrived."""
+        return await self.link.read_frame()
+
+    def close(self):
+        self.link.log_stats()
+        self.serial.close()
+
+
+class SimulatedMeterSource:
+    """
+    Produces frames in the MCU line format from a deterministic model: a slow
+    voltage swing around SIM_VOLTAGE and SIM_CHARGING_CURRENT on every
+    connector whose relay is on.
+    """
+
+    def __init__(self, connector_ids, relay_state=None, interval=None):
+        self.connector_ids = list(connector_ids)
+        self.relay_state = relay_state or (lambda connector_id: 0)
+        self.interval = float(os.environ.get(SIM_METER_INTERVAL_ENV, 1)) if interval is None else interval
+        self.frame = 0
+        self.next_frame = None
+        self.last_frame_time = None  # When the last frame was due, so loop stalls show up as latency
+        self.energy_register = False
+
+    def build_line(self):
+        parts = []
+        for connector_id in self.connector_ids:
+            voltage = SIM_VOLTAGE + 5 * math.sin((self.frame + connector_id * 7) / 30)
+            current = SIM_CHARGING_CURRENT + 0.5 * math.sin(self.frame / 5) if self.relay_state(connector_id) else 0.0
+            current = min(current, _current_limits.get(connector_id, current))  # The simulated EV follows the offered limit
+            parts.append(f"M{connector_id},{voltage:.1f},{current:.2f},{voltage * current:.1f}")
+        self.frame += 1
+        return ','.join(parts)
+
+    async def readline(self):
+        now = time.monotonic()
+        if self.next_frame is None:
+            self.next_frame = now
+        if self.next_frame > now:
+            await asyncio.sleep(self.next_frame - now)
+        self.last_frame_time = self.next_frame
+        self.next_frame += self.interval
+        return self.build_line()
+
+    async def read_frame(self):
+        from meter_protocol import parse_meter_line
+        return parse_meter_line(await self.readline())
+
+    def close(self):
+        pass
+
+
+def _mcu_meter_source(connector_ids, config):
+    return SerialMeterSource(max_baud=config.get("MeterLinkBaud", BAUD_RATE))
+
+
+def _modbus_meter_source(connector_ids, config):
+    import meter_modbus
+    return meter_modbus.ModbusMeterSource(connector_ids, config.get("ModbusMeters", {}),
+                                          baud=config.get("ModbusBaud", meter_modbus.DEFAULT_BAUD),
+                                          poll_interval=config.get("ModbusPollInterval", meter_modbus.DEFAULT_POLL_INTERVAL),
+                                          port=config.get("ModbusPort", meter_modbus.DEFAULT_PORT))
+
+
+# MeterBackend: factory(connector_ids, config). Every meter source provides `async read_frame()`
+# ({connector_id: {'voltage', 'current', 'power', 'energy'}} or None), `energy_register` (frames
+# carry the meter's own Wh register instead of needing power integrated), `last_frame_time`
+# (time.monotonic() of the last frame) and `close()`.
+METER_BACKENDS = {
+    "mcu": _mcu_meter_source,
+    "modbus": _modbus_meter_source,
+}
+METER_CONFIG_KEYS = ("MeterBackend", "MeterLinkBaud", "ModbusMeters", "ModbusPort", "ModbusBaud", "ModbusPollInterval")
+
+
+def meter_config(config):
+    """The config keys the meter backends read, as a plain dict that can be sent to another process."""
+    # ConfigStore wraps objects in read-only mappings, which cannot be pickled
+    return {key: dict(config[key]) if hasattr(config[key], 'items') else config[key] for key in METER_CONFIG_KEYS if key in config}
+
+
+def create_meter_source(connector_ids, relay_state=None, config=None):
+    if use_simulator():
+        return SimulatedMeterSource(connector_ids, relay_state)
+    config = config or {}
+    backend = config.get("MeterBackend", "mcu")
+    if backend not in METER_BACKENDS:
+        logging.warning(f"Unknown MeterBackend {backend!r}; using mcu")
+        backend = "mcu"
+    return METER_BACKENDS[backend](connector_ids, config)
+
+
+# Charging current limits
+class PilotPwmLimiter:
+    """
+    Offers a charging current on the control pilot as a 1 kHz hardware PWM
+    duty cycle (IEC 61851: amps / 0.6 % for 6-51 A, 100 % pauses charging).
+    """
+
+    def __init__(self, connector_id, pin):
+        self.connector_id = connector_id
+        self.pin = pin
+        self.pi = get_pi()
+        self.limit = None
+
+    def set_current_limit(self, amps):
+        if amps < 6:
+            duty = 100.0
+        elif amps <= 51:
+            duty = amps / 0.6
+        else:
+            duty = min(96.0, amps / 2.5 + 64)
+        self.pi.hardware_PWM(self.pin, 1000, int(duty * 10000))
+        self.limit = amps
+
+
+class SimulatedCurrentLimiter:
+    """Records the offered current; SimulatedMeterSource caps that connector's current to it."""
+
+    def __init__(self, connector_id):
+        self.connector_id = connector_id
+        self.limit = None
+        self.changes = 0
+
+    def set_current_limit(self, amps):
+        self.limit = amps
+        self.changes += 1
+        _current_limits[self.connector_id] = amps
+
+
+def create_current_limiter(connector_id, pin=None):
+    if use_simulator():
+        return SimulatedCurrentLimiter(connector_id)
+    if pin is None:
+        logging.warning(f"No control pilot pin configured for connector {connector_id}; current limits are only recorded.")
+        return SimulatedCurrentLimiter(connector_id)
+    return PilotPwmLimiter(connector_id, pin)
+
+
+# LCD
+class CharLcd:
+    def __init__(self):
+        from RPLCD.i2c import CharLCD
+        self.lcd = CharLCD('PCF8574', 0x27, port=1, cols=LCD_COLS, rows=LCD_ROWS, charmap='A02', dotsize=8)
+
+    def write_line(self, line_number, message, cols=LCD_COLS):
+        # Move cursor to the beginning of the line, clear it, then write the message
+        self.lcd.cursor_pos = (line_number - 1, 0)
+        self.lcd.write_string(' ' * cols)
+        self.lcd.cursor_pos = (line_number - 1, 0)
+        self.lcd.write_string(message[:cols])
+
+
+class ConsoleLcd:
+    def __init__(self):
+        self.lines = [''] * LCD_ROWS
+
+    def write_line(self, line_number, message, cols=LCD_COLS):
+        self.lines[line_number - 1] = message[:cols]
+        print('################', line_number, message)
+
+
+def get_lcd():
+    global _lcd
+    if _lcd is None:
+        if use_simulator():
+            _lcd = ConsoleLcd()
+        else:
+            try:
+                _lcd = CharLcd()
+            except Exception as e:
+                logging.error(f"LCD not available, using console output: {e}")
+                _lcd = ConsoleLcd()
+    return _lcd
+
+
+# RFID
+class Mfrc522Reader:
+    def __init__(self):
+        from MFRC522 import SimpleMFRC522
+        self.reader = SimpleMFRC522(pi=get_pi())
+
+    def read_no_block(self):
+        return self.reader.read_no_block()
+
+
+class SimulatedRfidReader:
+    """Presents the tags from JP_SIM_RFID_TAGS (or inject()) one read at a time."""
+
+    def __init__(self, tags=None):
+        if tags is None:
+            tags = [tag for tag in os.environ.get(SIM_RFID_TAGS_ENV, '').split(',') if tag]
+        self.tags = list(tags)
+
+    def inject(self, tag):
+        self.tags.append(tag)
+
+    def read_no_block(self):
+        if not self.tags:
+            return None, None
+        return self.tags.pop(0), ''
+
+
+def create_rfid_reader():
+    return SimulatedRfidReader() if use_simulator() else Mfrc522Reader()
@@ -0,0 +1,117 @@
+import logging
+
+# Even while other traffic keeps heartbeats suppressed, send one this often to resync the clock
+CLOCK_SYNC_INTERVAL = 24 * 3600
+CLOCK_DRIFT_WARNING = 5.0  # Seconds between our clock and the CSMS currentTime worth logging
+# websockets.connect settings, overridable in charger.json
+DEFAULT_PING_INTERVAL = 60
+DEFAULT_PING_TIMEOUT = 30
+DEFAULT_COMPRESSION = "deflate"
+# Ethernet + IPv4 + TCP (with timestamps) bytes around every segment, for the bytes/day estimate
+TCP_SEGMENT_OVERHEAD = 66
+
+
+def heartbeat_delay(now, last_sent, last_heartbeat, interval):
+    """
+    Seconds until the next Heartbeat is due, <= 0 when it is due now, or None
+    when heartbeats are disabled. Any message sent to the CSMS counts as a
+    heartbeat, so the interval runs from the last frame sent; a real Heartbeat
+    still goes out every CLOCK_SYNC_INTERVAL for its currentTime.
+    """
+    if interval <= 0:
+        return None
+    return min(last_sent + interval, last_heartbeat + CLOCK_SYNC_INTERVAL) - now
+
+
+def websocket_options(charger_config):
+    """Keyword arguments for websockets.connect from the charger.json settings."""
+    compression = charger_config.get('compression', DEFAULT_COMPRESSION)
+    if compression not in ("deflate", None):
+        logging.warning(f"Unknown compression {compression!r} in charger.json; using {DEFAULT_COMPRESSION}")
+        compression = DEFAULT_COMPRESSION
+    return {
+        "ping_interval": charger_config.get('ping_interval', DEFAULT_PING_INTERVAL),
+        "ping_timeout": charger_config.get('ping_timeout', DEFAULT_PING_TIMEOUT),
+        "compression": compression,
+    }
+
+
+def measure_exchanges(compression, rounds=50):
+    """
+    Bytes on the wire for one Heartbeat exchange and for one WebSocket ping,
+    measured through a real websockets connection on localhost. Each frame is
+    counted as one TCP segment, plus one bare ACK per exchange.
+    """
+    import asyncio
+    import json
+    import uuid
+
+    import websockets
+
+    written = [0, 0]  # bytes, segments
+
+    def count_writes(transport):
+        write = transport.write
+
+        def counted(data):
+            written[0] += len(data)
+            written[1] += 1
+            write(data)
+        transport.write = counted
+
+    async def csms(websocket, *args):
+        count_writes(websocket.transport)
+        async for raw in websocket:
+            message = json.loads(raw)
+            await websocket.send(json.dumps([3, message[1], {"currentTime": "2024-01-01T00:00:00.000Z"}]))
+
+    async def run():
+        async with websockets.serve(csms, '127.0.0.1', 0, subprotocols=["ocpp1.6j"], compression=compression) as server:
+            port = server.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}/CP", subprotocols=["ocpp1.6j"], compression=compression,
+                                          ping_interval=None) as ws:
+                count_writes(ws.transport)
+                for _ in range(5):  # Let the deflate context settle before measuring
+                    await ws.send(json.dumps([2, str(uuid.uuid4()), "Heartbeat", {}], separators=(',', ':')))
+                    await ws.recv()
+                costs = []
+                for exchange in ("heartbeat", "ping"):
+                    written[:] = [0, 0]
+                    for _ in range(rounds):
+                        if exchange == "heartbeat":
+                            await ws.send(json.dumps([2, str(uuid.uuid4()), "Heartbeat", {}], separators=(',', ':')))
+                            await ws.recv()
+                        else:
+                            await (await ws.ping())
+                    costs.append((written[0] + (written[1] + rounds) * TCP_SEGMENT_OVERHEAD) / rounds)
+                return costs
+
+    return asyncio.run(run())
+
+
+def bytes_per_day(heartbeat_cost, ping_cost, heartbeat_interval, ping_interval):
+    heartbeats = 86400 / heartbeat_interval if heartbeat_interval else 86400 / CLOCK_SYNC_INTERVAL
+    pings = 86400 / ping_interval if ping_interval else 0
+    return heartbeats * heartbeat_cost + pings * ping_cost
+
+
+def benchmark():
+    """Keepalive bytes/day for an idle charger, and for one charging with MeterValues every 60 s."""
+    costs = {compression: measure_exchanges(compression) for compression in ("deflate", None)}
+    for compression, (heartbeat_cost, ping_cost) in costs.items():
+        print(f"compression {compression or 'off'}: heartbeat exchange {heartbeat_cost:.0f} B, ping {ping_cost:.0f} B (incl. TCP/IP)")
+    heartbeat_cost, ping_cost = costs["deflate"]
+    before = bytes_per_day(heartbeat_cost, ping_cost, 30, 20)
+    print(f"before: heartbeat every 30 s, ping every 20 s: {before / 1024:.0f} KiB/day")
+    for label, heartbeat_interval, compression in (
+            ("idle, Boot interval 300 s", 300, "deflate"),
+            ("idle, Boot interval 300 s, no deflate", 300, None),
+            ("idle, Boot interval 3600 s", 3600, "deflate"),
+            ("charging, heartbeats suppressed by MeterValues", 0, "deflate")):
+        heartbeat_cost, ping_cost = costs[compression]
+        after = bytes_per_day(heartbeat_cost, ping_cost, heartbeat_interval, DEFAULT_PING_INTERVAL)
+        print(f"{label}, ping every {DEFAULT_PING_INTERVAL} s: {after / 1024:.0f} KiB/day ({1 - after / before:.0%} less)")
+
+
+if __name__ == '__main__':
+    benchmark()
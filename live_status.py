@@ -0,0 +1,170 @@
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from collections import deque
+
+# Local UDP endpoint used to hand live charger state from main.py to webserver.py
+LIVE_STATUS_HOST = '127.0.0.1'
+LIVE_STATUS_PORT = 5055
+PUBLISH_INTERVAL = 0.5  # Seconds between meter datagrams per connector
+BROADCAST_INTERVAL = 1.0  # Seconds between SSE deltas sent to viewers
+MAX_RECENT_FAULTS = 20
+SUBSCRIBER_QUEUE_SIZE = 32
+
+
+class LiveStatusPublisher:
+    """
+    Fire-and-forget publisher used by the charging process.
+    Datagrams go to a non-blocking UDP socket, so a missing or slow webserver
+    never delays the OCPP loop.
+    """
+
+    def __init__(self, host=LIVE_STATUS_HOST, port=LIVE_STATUS_PORT, interval=PUBLISH_INTERVAL):
+        self.address = (host, port)
+        self.interval = interval
+        self.last_sent = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def _send(self, message):
+        try:
+            self.sock.sendto(json.dumps(message, separators=(',', ':')).encode('utf-8'), self.address)
+        except OSError:
+            # Nobody listening or buffer full; live data is best effort
+            pass
+
+    def publish_meter(self, connector_id, voltage, current, power, energy):
+        now = time.monotonic()
+        if now - self.last_sent.get(connector_id, 0) < self.interval:
+            return
+        self.last_sent[connector_id] = now
+        self._send({"type": "meter", "connector_id": connector_id,
+                    "voltage": round(voltage, 1),
+                    "current": round(current, 2),
+                    "power": round(power, 1),
+                    "energy": round(energy, 1)})
+
+    def publish_status(self, connector_id, status, error_code):
+        self._send({"type": "status", "connector_id": connector_id, "status": status, "error_code": error_code})
+
+    def publish_fault(self, connector_id, error_code):
+        self._send({"type": "fault", "connector_id": connector_id, "error_code": error_code, "timestamp": time.time()})
+
+    def close(self):
+        self.sock.close()
+
+
+class LiveStatusHub:
+    """
+    Single receiver for the webserver. Keeps the latest charger state and fans
+    throttled, delta-encoded updates out to every SSE viewer, so the number of
+    viewers does not change the load on main.py.
+    """
+
+    def __init__(self, host=LIVE_STATUS_HOST, port=LIVE_STATUS_PORT, interval=BROADCAST_INTERVAL):
+        self.address = (host, port)
+        self.interval = interval
+        self.connectors = {}
+        self.faults = deque(maxlen=MAX_RECENT_FAULTS)
+        self.pending = {}
+        self.pending_faults = []
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def _snapshot_locked(self):
+        return {"connectors": {str(k): dict(v) for k, v in self.connectors.items()}, "faults": list(self.faults)}
+
+    def snapshot(self):
+        with self.lock:
+            return self._snapshot_locked()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            subscriber.put_nowait(("snapshot", self._snapshot_locked()))
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def handle_message(self, message):
+        connector_id = message.get("connector_id")
+        if connector_id is None:
+            return
+        with self.lock:
+            if message.get("type") == "fault":
+                fault = {"connector_id": connector_id, "error_code": message.get("error_code"), "timestamp": message.get("timestamp")}
+                self.faults.append(fault)
+                self.pending_faults.append(fault)
+                return
+            state = self.connectors.setdefault(connector_id, {})
+            for key, value in message.items():
+                if key in ("type", "connector_id"):
+                    continue
+                if state.get(key) != value:
+                    state[key] = value
+                    self.pending.setdefault(connector_id, {})[key] = value
+
+    def broadcast(self):
+        with self.lock:
+            if not self.pending and not self.pending_faults:
+                return
+            delta = {"connectors": {str(k): v for k, v in self.pending.items()}, "faults": self.pending_faults}
+            self.pending = {}
+            self.pending_faults = []
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(("delta", delta))
+            except queue.Full:
+                # Viewer is too slow; replace its backlog with a fresh snapshot
+                self._resync(subscriber)
+
+    def _resync(self, subscriber):
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            subscriber.put_nowait(("snapshot", self.snapshot()))
+        except queue.Full:
+            pass
+
+    def _run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(self.address)
+        except OSError as e:
+            logging.error(f"Live status hub could not bind {self.address}: {e}")
+            return
+        next_broadcast = time.monotonic() + self.interval
+        while True:
+            sock.settimeout(max(0.01, next_broadcast - time.monotonic()))
+            try:
+                data, _ = sock.recvfrom(4096)
+                self.handle_message(json.loads(data))
+            except socket.timeout:
+                pass
+            except (ValueError, OSError) as e:
+                logging.debug(f"Ignoring malformed live status datagram: {e}")
+            if time.monotonic() >= next_broadcast:
+                self.broadcast()
+                next_broadcast = time.monotonic() + self.interval
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
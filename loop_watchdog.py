@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+HEARTBEAT_INTERVAL = 0.25  # Seconds between heartbeats stamped by the loop
+STALL_WARNING = 1.0  # Seconds without a heartbeat before every stack is logged
+STALL_TIMEOUT = 10.0  # Seconds without a heartbeat before the relays are forced off and the watchdogs starve
+FEED_INTERVAL = 1.0  # Seconds between watchdog feeds, unless systemd's WATCHDOG_USEC asks for more often
+STACK_LIMIT = 20  # Frames logged per task
+STALL_EXIT_CODE = 70  # EX_SOFTWARE, so PM2 or systemd starts the process again
+DEVICE_FEED = b'\0'
+DEVICE_MAGIC_CLOSE = b'V'  # Disarms /dev/watchdog on a deliberate exit, where the driver allows it
+
+installed = None  # The running LoopWatchdog, once setup() has been called
+
+
+def sd_notify(state):
+    """Send `state` (e.g. "WATCHDOG=1") to systemd; False when not run by a unit with a notify socket."""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]  # Abstract namespace
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(state.encode(), address)
+        return True
+    except OSError as e:
+        logging.debug(f"sd_notify {state} failed: {e}")
+        return False
+
+
+def dump_stacks(loop=None):
+    """Stacks of every thread and of every task of `loop`, as text; for use while the loop thread is stuck."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    lines = []
+    for ident, frame in sys._current_frames().items():
+        lines.append(f"Thread {names.get(ident, ident)}:")
+        lines.extend(line.rstrip() for line in traceback.format_stack(frame))
+    if loop is not None:
+        try:
+            tasks = list(asyncio.all_tasks(loop))
+        except RuntimeError:  # The loop thread changed the task set while it was copied
+            tasks = []
+        for task in tasks:
+            coro = task.get_coro()
+            lines.append(f"Task {task.get_name()} ({getattr(coro, '__qualname__', coro)}):")
+            for frame in task.get_stack(limit=STACK_LIMIT):
+                lines.append(f'  File "{frame.f_code.co_filename}", line {frame.f_lineno}, in {frame.f_code.co_name}')
+    return "\n".join(lines)
+
+
+class LoopWatchdog:
+    """
+    Watches the asyncio loop from a thread. A coroutine on the loop stamps a
+    heartbeat every HEARTBEAT_INTERVAL; once it is `warn_after` seconds
+    overdue the stacks of all threads and tasks are logged. At `trip_after`
+    the relays are opened from the watchdog thread, and the systemd and
+    hardware watchdogs, fed only while the loop keeps up, are left to starve.
+    With `restart` the process then exits for PM2 or systemd to start it
+    again; otherwise the relays it opened are closed again once the loop runs,
+    but only on connectors `can_energise` still allows (none without it).
+    """
+
+    def __init__(self, loop, warn_after=STALL_WARNING, trip_after=STALL_TIMEOUT, restart=True, device=None):
+        self.loop = loop
+        self.warn_after = warn_after
+        self.trip_after = max(trip_after, warn_after)
+        self.restart = restart
+        self.device_path = device
+        self.device = None
+        self.relays = {}  # connector_id: RelayController, from main() once the hardware is up
+        self.can_energise = None  # can_energise(connector_id), set by the ChargePoint: no fault, emergency stop or ended session
+        watchdog_usec = int(os.environ.get("WATCHDOG_USEC", 0) or 0)
+        self.feed_interval = min(FEED_INTERVAL, watchdog_usec / 2e6) if watchdog_usec else FEED_INTERVAL
+        self.beat = time.monotonic()
+        self.last_feed = 0.0
+        self.lock = threading.Lock()
+        self.tripped = None  # Relays opened by the current trip, closed again on recovery
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.heartbeat_task = None
+        self.max_lag = 0.0  # Worst heartbeat lateness seen, in seconds
+        self.stalls = 0
+        self.trips = 0
+        self.feeds = 0
+
+    def start(self):
+        if self.device_path:
+            try:
+                self.device = open(self.device_path, 'wb', buffering=0)  # Opening arms the hardware watchdog
+            except OSError as e:
+                logging.error(f"Could not open watchdog device {self.device_path}: {e}")
+        self.heartbeat_task = self.loop.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.run, name="loop-watchdog", daemon=True)
+        self.thread.start()
+        sd_notify("READY=1")
+        return self
+
+    async def heartbeat(self):
+        while True:
+            due = time.monotonic() + HEARTBEAT_INTERVAL
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self.beat = time.monotonic()
+            self.max_lag = max(self.max_lag, self.beat - due)
+            if self.tripped is not None:
+                self.recover()
+
+    def run(self):
+        warned = False
+        while not self.stop_event.wait(HEARTBEAT_INTERVAL):
+            stall = time.monotonic() - self.beat
+            if stall < self.warn_after:
+                warned = False
+            elif not warned:
+                warned = True
+                self.stalls += 1
+                logging.error(f"Event loop stalled for {stall:.1f}s\n{dump_stacks(self.loop)}")
+            if stall >= self.trip_after:
+                if self.tripped is None:
+                    self.trip(stall)
+            elif time.monotonic() - self.last_feed >= self.feed_interval:
+                self.feed()
+
+    def feed(self):
+        self.last_feed = time.monotonic()
+        sd_notify("WATCHDOG=1")
+        if self.device is not None:
+            try:
+                self.device.write(DEVICE_FEED)
+            except OSError as e:
+                logging.error(f"Could not feed watchdog device {self.device_path}: {e}")
+        self.feeds += 1
+
+    def trip(self, stall):
+        """Open every relay from this thread; the loop that would normally do it is stuck."""
+        with self.lock:
+            self.tripped = [connector_id for connector_id, relay in self.relays.items() if relay.relay_state == 1]
+            self.trips += 1
+        for relay in list(self.relays.values()):
+            try:
+                relay.close_relay()
+            except Exception as e:
+                logging.error(f"Could not open relay on GPIO {getattr(relay, 'relay_pin', '?')}: {e}")
+        logging.critical(f"Event loop stalled for {stall:.1f}s; relays forced off and watchdog feeds stopped")
+        if self.restart:
+            logging.critical(f"Exiting with status {STALL_EXIT_CODE} to be restarted")
+            from diag_log import installed as diagnostics_log
+            if diagnostics_log is not None:
+                diagnostics_log.close()  # Writes out the stack dump before the process goes
+            self.close_device()
+            os._exit(STALL_EXIT_CODE)
+
+    def recover(self):
+        with self.lock:
+            connector_ids, self.tripped = self.tripped, None
+        logging.warning(f"Event loop running again after a stall; {len(connector_ids)} relay(s) had been opened")
+        for connector_id in connector_ids:
+            relay = self.relays.get(connector_id)
+            try:
+                allowed = relay is not None and self.can_energise is not None and self.can_energise(connector_id)
+            except Exception as e:
+                logging.error(f"Could not check connector {connector_id} before closing its relay: {e}")
+                allowed = False
+            if allowed:
+                relay.open_relay()
+            else:
+                logging.warning(f"Relay of connector {connector_id} left open after the stall")
+
+    def stats(self):
+        return {"max_lag": round(self.max_lag, 3), "stalls": self.stalls, "trips": self.trips, "feeds": self.feeds}
+
+    def close_device(self):
+        if self.device is not None:
+            try:
+                self.device.write(DEVICE_MAGIC_CLOSE)
+                self.device.close()
+            except OSError as e:
+                logging.error(f"Could not disarm watchdog device {self.device_path}: {e}")
+            self.device = None
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        sd_notify("STOPPING=1")
+        self.close_device()
+
+
+def setup(loop, config=None):
+    """Start the LoopWatchdog with the LoopStall* and HardwareWatchdogDevice keys of `config`."""
+    global installed
+    config = config or {}
+    installed = LoopWatchdog(loop, warn_after=config.get("LoopStallWarning", STALL_WARNING),
+                             trip_after=config.get("LoopStallTimeout", STALL_TIMEOUT),
+                             restart=config.get("LoopStallRestart", True),
+                             device=config.get("HardwareWatchdogDevice", "") or None).start()
+    return installed
+
+
+def benchmark(stall=3.0, warn_after=0.5, trip_after=1.5):
+    """Block the loop for `stall` seconds and report detection, relay and feed timings, and heartbeat cost."""
+    import tempfile
+
+    class Relay:
+        def __init__(self, relay_pin, relay_state):
+            self.relay_pin = relay_pin
+            self.relay_state = relay_state
+            self.changes = []
+
+        def open_relay(self):
+            self.relay_state = 1
+            self.changes.append((time.monotonic(), 1))
+
+        def close_relay(self):
+            self.relay_state = 0
+            self.changes.append((time.monotonic(), 0))
+
+    class Records(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def emit(self, record):
+            self.records.append((time.monotonic(), record))
+
+    def hung_i2c_write():
+        time.sleep(stall)
+
+    with tempfile.TemporaryDirectory() as directory:
+        notify_path = os.path.join(directory, "notify")
+        device_path = os.path.join(directory, "watchdog")
+        notify = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        notify.bind(notify_path)
+        notify.settimeout(0.1)
+        notifications = []
+        listening = threading.Event()
+        listening.set()
+
+        def listen():
+            while listening.is_set():
+                try:
+                    state = notify.recv(64).decode()
+                except socket.timeout:
+                    continue
+                notifications.append((time.monotonic(), state))
+
+        listener = threading.Thread(target=listen, daemon=True)
+        listener.start()
+        saved_socket = os.environ.get("NOTIFY_SOCKET")
+        os.environ["NOTIFY_SOCKET"] = notify_path
+        records = Records()
+        root = logging.getLogger()
+        saved_level = root.level
+        root.setLevel(logging.ERROR)
+        root.addHandler(records)
+        relays = {1: Relay(22, 1), 2: Relay(27, 0)}
+
+        async def run():
+            watchdog = LoopWatchdog(asyncio.get_running_loop(), warn_after, trip_after, restart=False,
+                                    device=device_path).start()
+            watchdog.relays = relays
+            watchdog.can_energise = lambda connector_id: True
+            await asyncio.sleep(3)
+            healthy_lag = watchdog.max_lag
+            started = time.monotonic()
+            hung_i2c_write()
+            ended = time.monotonic()
+            await asyncio.sleep(1.5)
+            watchdog.close()
+            return watchdog, healthy_lag, started, ended
+
+        try:
+            watchdog, healthy_lag, started, ended = asyncio.run(run())
+        finally:
+            root.removeHandler(records)
+            root.setLevel(saved_level)
+            listening.clear()
+            listener.join()
+            notify.close()
+            if saved_socket is None:
+                os.environ.pop("NOTIFY_SOCKET", None)
+            else:
+                os.environ["NOTIFY_SOCKET"] = saved_socket
+        with open(device_path, 'rb') as file:
+            device_bytes = file.read()
+
+    off = [at for at, state in relays[1].changes if state == 0]
+    on = [at for at, state in relays[1].changes if state == 1]
+    feeds = [at for at, state in notifications if state == "WATCHDOG=1"]
+    before = [at for at in feeds if at < started]
+    tripped = [at for at in feeds if off and off[0] < at < ended]
+    after = [at for at in feeds if at > ended]
+    dumps = [(at, record) for at, record in records.records if "stalled" in record.getMessage() and record.levelno == logging.ERROR]
+    print(f"loop blocked for {stall:.1f}s (warn after {warn_after}s, trip after {trip_after}s, heartbeat every {HEARTBEAT_INTERVAL}s)")
+    print(f"  healthy heartbeat lag max      {healthy_lag * 1e3:6.2f} ms")
+    if dumps:
+        at, record = dumps[0]
+        print(f"  stack dump logged after        {at - started:6.2f} s, names the blocking call: "
+              f"{'hung_i2c_write' in record.getMessage()}")
+    print(f"  relay 1 forced off after       {off[0] - started:6.2f} s" if off else "  relay 1 never forced off")
+    if on:
+        print(f"  relay 1 back on after recovery {on[0] - ended:6.2f} s; relay 2, off before the stall, "
+              f"{'stayed off' if relays[2].relay_state == 0 else 'was switched on'}")
+    print(f"  watchdog feeds: {len(before)} before, {len(tripped)} once tripped, {len(after)} after the stall; "
+          f"device got {device_bytes.count(DEVICE_FEED)} feeds and magic close {device_bytes.endswith(DEVICE_MAGIC_CLOSE)}")
+    print(f"  notifications: {sorted(set(state for _, state in notifications))}, stats {watchdog.stats()}")
+
+
+if __name__ == '__main__':
+    benchmark()
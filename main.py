@@ -1,32 +1,44 @@
 import asyncio
-import csv
 import json
 import logging
 import os
-import platform
-import re
 import subprocess
 import threading
+from collections import deque
 from datetime import datetime
-from datetime import timedelta
 import time
 from lcd_display_20_4 import update_lcd_line
-# from MFRC522 import SimpleMFRC522
-import atexit
+from live_status import LiveStatusPublisher
+from meter_buffer import MeterRing
+from fault_rules import TRIP, compile_rules
+from config_store import CONFIG_SCHEMA, ConfigStore
+from meter_scheduler import MeterScheduler
+from meter_batch import AdaptiveSampler, MeterValuesBatch
+from session_history import SessionHistory, remove_spill_files
+from transaction_journal import TransactionJournal
+from session_store import SessionStore
+from timeseries_store import MAINTENANCE_INTERVAL, TimeSeriesStore
+from meter_process import CONSUMER_POLL, LATENCY_LOG_INTERVAL, MeterProcess
+from meter_protocol import parse_meter_line
+from connector_model import CHARGING_STATES, ConnectorSet, Transaction
+from smart_charging import ChargingProfiles, LoadManager, format_time, parse_time
+from keepalive import CLOCK_DRIFT_WARNING, heartbeat_delay, websocket_options
+from auth_cache import AUTHORIZE_TIMEOUT, CACHED_AUTHORIZE_TIMEOUT, MAX_START_RETRY_INTERVAL, AuthorizationCache
+import diag_log
+import hal
+import loop_watchdog
+import ocpp_schemas
+import startup_profile
+from ocpp_codec import CodecChargePoint
 
-import aioserial
-import requests
 import websockets
 from ocpp.routing import on
-from ocpp.v16 import ChargePoint as cp
 from ocpp.v16 import call, call_result
-from ocpp.v16.enums import (Action, AuthorizationStatus, ClearCacheStatus,
-                            ConfigurationStatus, MessageTrigger, RegistrationStatus,
-                            ResetStatus, ResetType, TriggerMessageStatus)
-
-if platform.system() == 'Linux' and os.path.exists('/proc/device-tree/model'):
-    import pigpio
+from ocpp.v16.enums import (Action, AuthorizationStatus, ChargingProfileStatus, ClearCacheStatus,
+                            ClearChargingProfileStatus, ConfigurationStatus, DiagnosticsStatus, GetCompositeScheduleStatus,
+                            MessageTrigger, RegistrationStatus, ResetStatus, ResetType, TriggerMessageStatus)
 
+startup_profile.mark("imports")
 
 
 # Constants
@@ -37,33 +49,39 @@ FIRMWARE_FILE = "firmware.py"
 BACKUP_FIRMWARE_FILE = "firmware_backup.py"
 TEMP_CSV_FILE = "temp.csv"
 NEW_FIRMWARE_PREFIX = "new_firmware_"
-SERIAL_PORT = '/dev/serial0'
-BAUD_RATE = 9600
+# Seconds after Boot accepted within which journaled transactions are resumed or closed
+RECOVERY_TIMEOUT = 60
+# Seconds a stop waits for StartTransaction.conf before StopTransaction is left until the start is confirmed
+START_CONFIRM_WAIT = 10
+# GetDiagnostics upload retries and seconds between them, when the CSMS gives none
+DIAGNOSTICS_RETRIES = 1
+DIAGNOSTICS_RETRY_INTERVAL = 30
+MAX_RECENT_FAULTS = 50  # Faults kept for the diagnostics bundle
 # GPIO Pins for Emergency Stop Condition
 EMERGENCY_STOP_PIN1 = 6  # GPIO pin number
 
-# Global variable for the pigpio instance
-pigpio_instance = None
-
-def get_pigpio_instance():
-    global pigpio_instance
-    if not pigpio_instance:
-        pigpio_instance = pigpio.pi()
-        if not pigpio_instance.connected:
-            raise RuntimeError("Failed to connect to pigpio daemon")
-        atexit.register(cleanup_pigpio)  # Register cleanup function to be called at exit
-    return pigpio_instance
-
-def cleanup_pigpio():
-    global pigpio_instance
-    if pigpio_instance:
-        pigpio_instance.stop()  # Properly stop the pigpio instance
-        pigpio_instance = None
-        print("pigpio connection closed")
 # Logging configuration
 logging.basicConfig(level=logging.INFO)
 
+config_store = None
+
 # Functions
+def remove_session_history(entry):
+    """Delete the spill files of a journaled session; entries from before sessions had their own key used the id or connector."""
+    keys = [entry["history"]] if entry.get("history") else [f"pending-{entry['connector_id']}", entry["transaction_id"]]
+    for key in keys:
+        if key is not None:
+            remove_spill_files(key)
+
+
+def get_config_store():
+    """The process-wide ConfigStore for CONFIG_FILE, watched for edits from the first call on."""
+    global config_store
+    if config_store is None:
+        config_store = ConfigStore(CONFIG_FILE).watch()
+    return config_store
+
+
 def load_json_config(file_path):
     try:
         with open(file_path, 'r') as file:
@@ -73,18 +91,6 @@ def load_json_config(file_path):
         return {}
 
 
-def is_raspberry_pi():
-    global pigpio_instance
-    if platform.system() == 'Linux':
-        try:
-            with open('/proc/device-tree/model', 'r') as file:
-                model_info = file.read()
-                
-            return 'Raspberry Pi' in model_info
-        except FileNotFoundError:
-            return False
-    return False
-
 def get_relay_pins():
     return {1: 22, 2: 27, 3: 10}
 
@@ -95,56 +101,89 @@ class RelayController:
         self.relay_state = 0  # 0: Off, 1: On
         self.last_rfid_read = {"id": None, "text": ""}
         self.RFID_EXPIRY_TIME = 5  # Seconds to consider the RFID tag as new
-        self.IS_PI=0
-
-        if is_raspberry_pi():
-            self.pi = get_pigpio_instance()
-            if not self.pi.connected:
-                raise RuntimeError("pigpio daemon is not running")
-            self.pi.set_mode(self.relay_pin, pigpio.OUTPUT)
-            self.IS_PI=1
+        self.relay = hal.create_relay(relay_pin)
 
     def open_relay(self):
-        if self.IS_PI==1:
-            self.pi.write(self.relay_pin, 1)
-        else:
-            self.relay_state = 1
+        self.relay.set(1)
+        self.relay_state = 1
         logging.info(f'Relay on GPIO {self.relay_pin} is turned ON.')
 
     def close_relay(self):
-        if self.IS_PI==1:
-            self.pi.write(self.relay_pin, 0)
-        else:
-            self.relay_state = 0
+        self.relay.set(0)
+        self.relay_state = 0
         logging.info(f'Relay on GPIO {self.relay_pin} is turned OFF.')
 
-class ChargePoint(cp):
-    def __init__(self, *args, **kwargs):
+class Hardware:
+    """
+    GPIO inputs, relays, current limiters and meter buffers for every connector,
+    the meter process when MeterProcess is enabled, plus the LCD and the OCPP
+    schema validators. main() builds it on a worker
+    thread while the WebSocket handshake is in flight and keeps it across
+    reconnections.
+    """
+
+    def __init__(self, config):
+        connector_ids = range(1, int(config.get("NumberOfConnectors", 2)) + 1)
+        # Set EMERGENCY_STOP_PIN1 as input with pull-down resistor
+        self.emergency_stop_input = hal.create_input(EMERGENCY_STOP_PIN1, pull='down')
+        self.relay_controllers = {int(connector_id): RelayController(relay_pin) for connector_id, relay_pin in config.get("RelayPins", {}).items()}
+        pilot_pins = config.get("PilotPins", {})
+        self.current_limiters = {connector_id: hal.create_current_limiter(connector_id, pilot_pins.get(str(connector_id))) for connector_id in connector_ids}
+        # Every meter frame per connector, for windowed statistics between MeterValues
+        self.meter_buffers = {connector_id: MeterRing() for connector_id in connector_ids}
+        # Samples buffered here would be lost with a ChargePoint, so the history lives as long as the hardware
+        self.meter_history = TimeSeriesStore(resolution=config.get("MeterHistoryResolution", 1.0),
+                                             flush_interval=config.get("MeterHistoryFlushInterval", 60),
+                                             raw_days=config.get("MeterHistoryRawDays", 7),
+                                             rollup_days=config.get("MeterHistoryRollupDays", 180))
+        self.recent_faults = deque(maxlen=MAX_RECENT_FAULTS)
+        self.meter_process = None
+        if config.get("MeterProcess", False):
+            self.meter_process = MeterProcess(connector_ids, config.get("RelayPins", {}), config, config.get("MeterProcessCpu", -1))
+        hal.get_lcd()
+        ocpp_schemas.prewarm()
+        startup_profile.mark("hardware ready")
+
+
+class ChargePoint(CodecChargePoint):
+    def __init__(self, *args, hardware=None, **kwargs):
         super().__init__(*args, **kwargs)
-        if is_raspberry_pi():
-            self.pi = get_pigpio_instance()
-            self.setup_emergency_stop_pin()
-            if not self.pi.connected:
-                raise RuntimeError("pigpio daemon is not running")
-            
+        self.config_store = get_config_store()
+        hardware = hardware or Hardware(self.config)
+        self.emergency_stop_input = hardware.emergency_stop_input
         self.initialize_csv()
-        self.last_rfid_data = {"id": None, "text": ""}
+        self.last_rfid_read = {"id": None, "text": ""}
         self.RFID_EXPIRY_TIME = 5  # Seconds
         self.emergency_status=0
-        self.last_sent_status_info = {}
-
-        self.meter = {}
-        self.config = load_json_config(CONFIG_FILE)
-        self.active_transactions = self.config.get("active_transactions", {})
-        relay_pins = self.config.get("RelayPins", {})
-        self.relay_controllers = {int(connector_id): RelayController(relay_pin) for connector_id, relay_pin in relay_pins.items()}
-        self.connector_status = {connector_id: {"status": "Available", "error_code": "NoError", "notification_sent": False}
-                                 for connector_id in range(1, int(self.config.get("NumberOfConnectors", 2)) + 1)}
+        self.live_status = LiveStatusPublisher()
+
+        self.meter_buffers = hardware.meter_buffers
+        self.meter_process = hardware.meter_process
+        self.meter_history = hardware.meter_history
+        self.recent_faults = hardware.recent_faults
+        self.diagnostics_uploading = False
+        self.last_sample_pass = None  # Monotonic time of the last MeterValues sampling pass
+        self.meter_batch = MeterValuesBatch()
+        self.adaptive_sampler = AdaptiveSampler()
+        self.journal = TransactionJournal()  # Open transactions survive restarts and power cuts here
+        self.sessions = SessionStore()  # Completed sessions, queried and exported by webserver.py
+        self.auth_cache = AuthorizationCache()  # idTagInfo of every tag the CSMS has answered for
+        self.pending_starts = {}  # connector_id: task sending StartTransaction for a session already charging
+        self.deferred_stops = {}  # connector_id: transactionData of a stop waiting for StartTransaction.conf
+        # Status, meter sample, relay, transaction and session history per connector
+        self.connectors = ConnectorSet(int(self.config.get("NumberOfConnectors", 2)), hardware.relay_controllers)
+        # Shares the site supply between charging connectors, driven by SetChargingProfile
+        self.load_manager = LoadManager(ChargingProfiles(), hardware.current_limiters, lambda: self.config)
+        if loop_watchdog.installed is not None:
+            loop_watchdog.installed.can_energise = self.may_energise  # Consulted before relays go back on after a stall
+        self.last_heartbeat = time.monotonic()
+        self.heartbeat_reconfigured = asyncio.Event()
+        self.clock_offset = 0.0  # CSMS currentTime minus our clock, in seconds
                                  
         self.function_call_queue = asyncio.Queue()
-        asyncio.create_task(self.process_function_call_queue())
-        for connector_id in range(len(self.connector_status)):
-            self.relay_controllers[connector_id+1].close_relay()
+        self.queue_task = asyncio.create_task(self.process_function_call_queue())
+        for connector in self.connectors:
+            connector.relay.close_relay()
 
         self.reset_data()
 
@@ -163,84 +202,77 @@ class ChargePoint(cp):
         """Monitors for RFID tags and processes them."""
         logging.info('RFID monitoring started.')
 
-        if(is_raspberry_pi):
-            reader=None
-            # reader = SimpleMFRC522(pi=self.pi) 
-            last_write_time = time.time()
+        reader = hal.create_rfid_reader()
+        last_write_time = time.time()
 
-            while True:
-                try:
-                    id, text = reader.read_no_block()
-                    if id:
-                        text = text.strip("\x00") if text else ""
-                        current_time = time.time()
-
-                        # Log every RFID read for auditing and debugging
-                        logging.debug(f"RFID read: ID {id}, Text: '{text}'.")
-
-                        # Compare new read with last saved RFID data
-                        if id != self.last_rfid_read["id"] or text != self.last_rfid_read["text"] or (current_time - last_write_time >= self.RFID_EXPIRY_TIME):
-                            self.last_rfid_read = {"id": str(id), "text": text}
-                            logging.info(f"New RFID data: ID {id}, Text: '{text}'.")
-
-                            # Loop through all connectors and initiate transactions if the connector is available
-                            for connector_id, status_info in self.connector_status.items():
-                                if status_info['status'] == 'Available':
-                                    logging.info(f"Initiating transaction for connector {connector_id} with RFID ID {id}.")
-                                    await self.function_call_queue.put({
-                                        "function": self.start_transaction,
-                                        "args": [connector_id, str(id)],
-                                        "kwargs": {}
-                                    })
-
-                        last_write_time = current_time
-                    else:
-                        # Log when no RFID is read, this can be set to DEBUG if logging every second is too verbose
-                        logging.debug("No RFID tag read.")
+        while True:
+            try:
+                id, text = reader.read_no_block()
+                if id:
+                    text = text.strip("\x00") if text else ""
+                    current_time = time.time()
+
+                    # Log every RFID read for auditing and debugging
+                    logging.debug(f"RFID read: ID {id}, Text: '{text}'.")
+
+                    # Compare new read with last saved RFID data
+                    if id != self.last_rfid_read["id"] or text != self.last_rfid_read["text"] or (current_time - last_write_time >= self.RFID_EXPIRY_TIME):
+                        self.last_rfid_read = {"id": str(id), "text": text}
+                        logging.info(f"New RFID data: ID {id}, Text: '{text}'.")
+
+                        # Loop through all connectors and initiate transactions if the connector is available
+                        for connector in self.connectors:
+                            if connector.status == 'Available':
+                                logging.info(f"Initiating transaction for connector {connector.connector_id} with RFID ID {id}.")
+                                await self.function_call_queue.put({
+                                    "function": self.start_transaction,
+                                    "args": [connector.connector_id, str(id)],
+                                    "kwargs": {}
+                                })
+
+                    last_write_time = current_time
+                else:
+                    # Log when no RFID is read, this can be set to DEBUG if logging every second is too verbose
+                    logging.debug("No RFID tag read.")
 
-                    await asyncio.sleep(4)  # Non-blocking wait before checking for RFID tag again
-                except Exception as e:
-                    logging.error(f"Error in RFID monitoring loop: {e}")
+                await asyncio.sleep(4)  # Non-blocking wait before checking for RFID tag again
+            except Exception as e:
+                logging.error(f"Error in RFID monitoring loop: {e}")
 
     async def emergency_stop_all_transactions(self):
         logging.info("Initiating emergency stop for all transactions.")
-        for connector_id in list(self.active_transactions.keys()):
+        for connector in self.connectors.with_transaction():
             # await self.stop_transaction(connector_id, reason='EmergencyStop')
 
-            await self.function_call_queue.put({"function": self.stop_transaction, "args": [connector_id, 'EmergencyStop'], "kwargs": {}})
-            logging.debug(f"Transaction stopped for connector {connector_id}.")        
+            await self.function_call_queue.put({"function": self.stop_transaction, "args": [connector.connector_id, 'EmergencyStop'], "kwargs": {}})
+            logging.debug(f"Transaction stopped for connector {connector.connector_id}.")        
         logging.info("Emergency stop triggered for all transactions and connectors set to Unavailable.")
 
-    def setup_emergency_stop_pin(self):
-        # Set EMERGENCY_STOP_PIN1 as input with pull-down resistor
-        self.pi.set_mode(EMERGENCY_STOP_PIN1, pigpio.INPUT)
-        self.pi.set_pull_up_down(EMERGENCY_STOP_PIN1, pigpio.PUD_DOWN)
-    
     async def monitor_emergency_stop_pin(self):
         logging.info('Monitoring emergency stop pin.')
-        if is_raspberry_pi():
-            while True:
-                if self.pi.read(EMERGENCY_STOP_PIN1) == 1 and self.emergency_status==0:
-                    self.emergency_status=1
-                    logging.info("Emergency stop switch CLOSED. Triggering emergency stop.")
-                    for connector_id in self.connector_status.keys():
-                        self.update_connector_status(connector_id=connector_id, status='Faulted', error_code='OtherError')
-                        logging.debug(f"Connector status updated to Unavailable for connector {connector_id}.")
-                    await self.emergency_stop_all_transactions()
-                elif self.pi.read(EMERGENCY_STOP_PIN1) == 1:  
-                    pass 
-                else:
-                    # self.emergency_status=0
-                    # for connector_id in self.connector_status.keys():
-                    #     self.update_connector_status(connector_id=connector_id, status='Available', error_code='NoError')
-                    # logging.debug("Emergency stop switch OPEN.")
-                    for connector_id in self.connector_status.keys():
-                        if(self.connector_status[connector_id]['status']=='Faulted'):
-                            self.update_connector_status(connector_id=connector_id, status='Available', error_code='NoError')
-                    logging.debug("Emergency stop switch OPEN.")
-                await asyncio.sleep(1)  # Non-blocking delay
+        while True:
+            if self.emergency_stop_input.read() == 1 and self.emergency_status==0:
+                self.emergency_status=1
+                logging.info("Emergency stop switch CLOSED. Triggering emergency stop.")
+                for connector_id in self.connectors.ids():
+                    self.update_connector_status(connector_id=connector_id, status='Faulted', error_code='OtherError')
+                    logging.debug(f"Connector status updated to Unavailable for connector {connector_id}.")
+                await self.emergency_stop_all_transactions()
+            elif self.emergency_stop_input.read() == 1:  
+                pass 
+            else:
+                # self.emergency_status=0
+                # for connector_id in self.connector_status.keys():
+                #     self.update_connector_status(connector_id=connector_id, status='Available', error_code='NoError')
+                # logging.debug("Emergency stop switch OPEN.")
+                for connector in self.connectors:
+                    if(connector.status=='Faulted' and not self.fault_evaluator.is_faulted(connector.connector_id)):
+                        self.update_connector_status(connector_id=connector.connector_id, status='Available', error_code='NoError')
+                logging.debug("Emergency stop switch OPEN.")
+            await asyncio.sleep(1)  # Non-blocking delay
 
     def initialize_csv(self):
+        import csv  # Only needed when a session row changes, so kept off the startup path
         try:
             with open(CSV_FILENAME, 'x', newline='') as csvfile:
                 writer = csv.writer(csvfile)
@@ -249,11 +281,13 @@ class ChargePoint(cp):
             pass
 
     def add_transaction_to_csv(self, transaction_id, meter_start):
+        import csv
         with open(CSV_FILENAME, 'a', newline='') as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow([transaction_id, meter_start, '', '', 'No'])
 
     def update_transaction_in_csv(self, transaction_id, current_meter_value=None, meter_stop=None, is_meter_stop_sent=None):
+        import csv
         with open(CSV_FILENAME, 'r', newline='') as csvfile, open(TEMP_CSV_FILE, 'w', newline='') as tempfile:
             reader = csv.reader(csvfile)
             writer = csv.writer(tempfile)
@@ -268,28 +302,28 @@ class ChargePoint(cp):
                 writer.writerow(row)
         os.replace(TEMP_CSV_FILE, CSV_FILENAME)
 
+    @property
+    def config(self):
+        """Current typed ConfigSnapshot; replaced as a whole on every change."""
+        return self.config_store.snapshot
+
     def reset_data(self):
-        self.config = load_json_config(CONFIG_FILE)
-        self.active_transactions = self.config.get("active_transactions", {})
+        self.config_store.reload()
+        self.compile_fault_rules()
 
     def save_config(self):
-        with open(CONFIG_FILE, 'w') as file:
-            json.dump(self.config, file)
+        self.config_store.save()
 
     def update_connector_status(self, connector_id, status=None, error_code=None):
-        status_changed = False
-        if status is not None and self.connector_status[connector_id]['status'] != status:
-            self.connector_status[connector_id]['status'] = status
-            status_changed = True
-
-        if error_code is not None and self.connector_status[connector_id]['error_code'] != error_code:
-            self.connector_status[connector_id]['error_code'] = error_code
-            status_changed = True
-
-        # Only mark for notification if there's a change
-        if status_changed:
-            self.connector_status[connector_id]['notification_sent'] = False
-            asyncio.create_task(self.send_status_notification(connector_id))
+        connector = self.connectors[connector_id]
+        # Only mark for notification if there's a change the OCPP state machine allows
+        if connector.set_status(status, error_code):
+            self.live_status.publish_status(connector.connector_id, connector.status, connector.error_code)
+            if status == 'Faulted':
+                self.live_status.publish_fault(connector.connector_id, connector.error_code)
+                self.recent_faults.append({"connector_id": connector.connector_id, "error_code": connector.error_code,
+                                           "timestamp": time.time()})
+            asyncio.create_task(self.send_status_notification(connector.connector_id))
         else:
             logging.info(f"No change in status for connector {connector_id}, skipping notification.")
 
@@ -322,11 +356,17 @@ class ChargePoint(cp):
             if response.status == RegistrationStatus.accepted:
                 self.connected = True
                 logging.info("Connected to central system.")
-                for connector_id in self.connector_status:
-                    if connector_id in self.active_transactions:
-                        self.update_connector_status(connector_id=connector_id, status='Charging', error_code='NoError')
+                if startup_profile.mark("boot accepted"):
+                    startup_profile.report()  # The first Boot of the process only; a reconnect is not a startup
+                self.sync_clock(response.current_time)
+                self.apply_heartbeat_interval(response.interval)
+                asyncio.create_task(self.recover_transactions())
+                for connector in self.connectors:
+                    if connector.transaction is not None:
+                        status = connector.status if connector.status in CHARGING_STATES else 'Charging'
+                        self.update_connector_status(connector_id=connector.connector_id, status=status, error_code='NoError')
                     else:
-                        self.update_connector_status(connector_id=connector_id, status='Available', error_code='NoError')
+                        self.update_connector_status(connector_id=connector.connector_id, status='Available', error_code='NoError')
             else:
                 logging.warning("Boot notification not accepted. Retrying...")
                 await asyncio.sleep(retry_interval)
@@ -337,107 +377,463 @@ class ChargePoint(cp):
             await self.send_boot_notification(retries + 1)
 
     async def heartbeat(self):
-        heartbeat_interval = int(self.config.get('HeartbeatInterval', 30))
+        """Sends a Heartbeat only when nothing else has gone to the CSMS for HeartbeatInterval seconds."""
         while True:
-            await asyncio.sleep(heartbeat_interval)
-            request = call.HeartbeatPayload()
-            response = await self.call(request)
-            logging.info(f"Heartbeat sent/received at {datetime.now()}: {response}")
+            delay = heartbeat_delay(time.monotonic(), self.last_sent, self.last_heartbeat,
+                                    int(self.config.get('HeartbeatInterval', 30)))
+            if delay is not None and delay <= 0:
+                await self.send_heartbeat()
+                continue
+            self.heartbeat_reconfigured.clear()
+            # Not wait_for: before Python 3.12 it drops a cancel that arrives as the event is set
+            reconfigured = asyncio.ensure_future(self.heartbeat_reconfigured.wait())
+            try:
+                await asyncio.wait((reconfigured,), timeout=delay)
+            finally:
+                reconfigured.cancel()
+
+    async def send_heartbeat(self):
+        request = call.HeartbeatPayload()
+        response = await self.call(request)
+        self.last_heartbeat = time.monotonic()
+        if response is not None:
+            self.sync_clock(response.current_time)
+        logging.info(f"Heartbeat sent/received at {datetime.now()}: {response} "
+                     f"(OCPP traffic so far: {self.bytes_sent} B sent, {self.bytes_received} B received)")
+
+    def apply_heartbeat_interval(self, interval):
+        """Adopt the heartbeat interval from BootNotification.conf, which overrides HeartbeatInterval."""
+        if interval and interval > 0 and interval != self.config.get('HeartbeatInterval'):
+            if self.config_store.set('HeartbeatInterval', interval) == 'Accepted':
+                logging.info(f"HeartbeatInterval set to {interval}s by the central system")
+                self.heartbeat_reconfigured.set()
+
+    def sync_clock(self, current_time):
+        try:
+            offset = parse_time(current_time) - time.time()
+        except (TypeError, ValueError):
+            return
+        if abs(offset - self.clock_offset) > CLOCK_DRIFT_WARNING:
+            logging.warning(f"Clock differs from the central system by {offset:.1f}s")
+        self.clock_offset = offset
 
     async def authorize(self, id_tag):
+        """
+        Ask the CSMS about `id_tag`. If it does not answer within
+        AUTHORIZE_TIMEOUT, a cached Accepted status is enough under
+        LocalAuthorizeOffline, and a tag the cache does not know under
+        AllowOfflineTxForUnknownId. A tag the cache would accept offline
+        waits only CACHED_AUTHORIZE_TIMEOUT.
+        """
         request = call.AuthorizePayload(id_tag=id_tag)
-        response = await self.call(request)
+        cached = self.config.get("AuthorizationCacheEnabled", True) and self.config.get("LocalAuthorizeOffline", True) \
+            and self.auth_cache.accepted(id_tag)
+        try:
+            response = await asyncio.wait_for(self.call(request), CACHED_AUTHORIZE_TIMEOUT if cached else AUTHORIZE_TIMEOUT)
+        except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed) as e:
+            status = self.auth_cache.status(id_tag) if self.config.get("AuthorizationCacheEnabled", True) else None
+            if status is None:
+                accepted = self.config.get("AllowOfflineTxForUnknownId", False)
+            else:
+                accepted = status == AuthorizationStatus.accepted and self.config.get("LocalAuthorizeOffline", True)
+            logging.warning(f"No Authorize.conf for idTag {id_tag} ({str(e) or 'timed out'}); "
+                            f"{'accepted' if accepted else 'refused'} offline with cached status {status}")
+            return accepted
+        if response is None:
+            return False  # CALLError
+        self.update_auth_cache(id_tag, response.id_tag_info)
         return response.id_tag_info['status'] == AuthorizationStatus.accepted
 
+    def update_auth_cache(self, id_tag, id_tag_info):
+        if self.config.get("AuthorizationCacheEnabled", True):
+            self.auth_cache.update(id_tag, id_tag_info)
+
     async def send_status_notifications_loop(self):
         while True:
-            for connector_id, status_info in self.connector_status.items():
-                if not status_info['notification_sent']:
-                    await self.send_status_notification(connector_id)
+            for connector in self.connectors:
+                if not connector.notification_sent:
+                    await self.send_status_notification(connector.connector_id)
             await asyncio.sleep(1)
 
     async def send_status_notification(self, connector_id):
-        status_info = self.connector_status[connector_id]
+        connector = self.connectors[connector_id]
         # Proceed only if a notification hasn't been sent for the current status and error_code
-        if not status_info['notification_sent']:
-            request = call.StatusNotificationPayload(connector_id=connector_id, status=status_info['status'], error_code=status_info['error_code'])
+        if not connector.notification_sent:
+            status, error_code = connector.status, connector.error_code
+            request = call.StatusNotificationPayload(connector_id=connector.connector_id, status=status, error_code=error_code)
             await self.call(request)
-            if(status_info['status'] != 'Charging'):
-                await self.update_specific_lcd_line(connector_id, f'{status_info["status"]} {status_info["error_code"]}')
-            status_info['notification_sent'] = True
-            # Update last sent status info to current for comparison in future updates
-            self.last_sent_status_info[connector_id] = {'status': status_info['status'], 'error_code': status_info['error_code']}
-            logging.info(f"StatusNotification sent for connector {connector_id} with status {status_info['status']} and error_code {status_info['error_code']}")
+            if(status != 'Charging'):
+                await self.update_specific_lcd_line(connector.connector_id, f'{status} {error_code}')
+            # A change made while the call was in flight still needs its own notification
+            if (connector.status, connector.error_code) == (status, error_code):
+                connector.notification_sent = True
+            logging.info(f"StatusNotification sent for connector {connector.connector_id} with status {status} and error_code {error_code}")
     
     async def start_transaction(self, connector_id, id_tag):
         logging.info(f"Start Transaction called {connector_id} {id_tag}")
-        if connector_id not in self.active_transactions:
-            meter_start = self.get_meter_value(connector_id)
-            authorize_response = await self.authorize(id_tag)
-            if not authorize_response:
+        connector = self.connectors[connector_id]
+        connector_id = connector.connector_id
+        if connector.transaction is None:
+            blocked = self.energise_blocked(connector_id)
+            if blocked is not None:
+                logging.error(f"Connector {connector_id} cannot be energised ({blocked}). Transaction not started.")
+                return False
+            self.update_connector_status(connector_id=connector_id, status='Preparing')
+            # Under LocalPreAuthorize a tag the cache accepts charges at once; StartTransaction.conf has the final word
+            pre_authorized = self.config.get("LocalPreAuthorize", False) and self.config.get("AuthorizationCacheEnabled", True) \
+                and self.auth_cache.accepted(id_tag)
+            if not pre_authorized and not await self.authorize(id_tag):
                 logging.error(f"Authorization failed for idTag {id_tag}. Transaction not started.")
+                if connector.status == 'Preparing':
+                    self.update_connector_status(connector_id=connector_id, status='Available')
                 return False
-            request = call.StartTransactionPayload(connector_id=connector_id, id_tag=id_tag, meter_start=int(meter_start['energy']), timestamp=datetime.utcnow().isoformat())
-            response = await self.call(request)
-            transaction_id = response.transaction_id
-            transaction = {"transaction_id": transaction_id, "connector_id": connector_id, "id_tag": id_tag, "meter_start": int(meter_start['energy']), "start_time": datetime.now()}
-            self.active_transactions[connector_id] = transaction
-            self.relay_controllers[connector_id].open_relay()
+            if connector.transaction is not None:
+                logging.error(f"Connector {connector_id} was taken while idTag {id_tag} was being authorized")
+                return False
+            # An emergency stop or a fault may have come while the CSMS was asked
+            blocked = self.energise_blocked(connector_id)
+            if blocked is not None:
+                logging.error(f"Connector {connector_id} cannot be energised ({blocked}). Transaction not started.")
+                if connector.status == 'Preparing':
+                    self.update_connector_status(connector_id=connector_id, status='Available')
+                return False
+            meter_start = int(connector.energy)
+            start_time = datetime.utcnow().isoformat()
+            # Energise first; the transaction id arrives with StartTransaction.conf in the background
+            transaction = Transaction(None, connector_id, id_tag, meter_start, start_time)
+            connector.transaction = transaction
+            # Spill files are named per session, so nothing a crash leaves behind ends up in a later session
+            history_key = f"session-{connector_id}-{int(time.time() * 1000)}"
+            self.journal.started(connector_id, None, id_tag, meter_start, start_time, history=history_key)
+            self.load_manager.transaction_started(connector_id, None)
+            connector.history = SessionHistory(history_key, self.config.get("StopTxnSampledData", ()),
+                                               self.config.get("StopTxnAlignedData", ()))
+            connector.relay.open_relay()
             self.update_connector_status(connector_id=connector_id, status='Charging', error_code='NoError')
-            self.add_transaction_to_csv(transaction_id, int(meter_start['energy']))
-            logging.info(f"Transaction {transaction_id} started on connector {connector_id}")
+            self.pending_starts[connector_id] = asyncio.create_task(self.confirm_start(connector, transaction))
+            logging.info(f"Charging started on connector {connector_id} for idTag {id_tag}"
+                         f"{' (pre-authorized from the cache)' if pre_authorized else ''}")
             return True
         else:
             logging.error(f"Connector {connector_id} is already in use")
             return False
 
+    async def confirm_start(self, connector, transaction):
+        """
+        Send StartTransaction for a session that is already charging. A
+        timeout is retried for as long as the connection lasts, waiting
+        TransactionMessageRetryInterval times the attempt count between tries;
+        CALLErrors give up after TransactionMessageAttempts. Without an answer
+        the journal keeps the start for recovery after reconnecting. A stop
+        that stopped waiting for the answer is sent once it comes. An idTag
+        the CSMS does not accept stops the transaction under
+        StopTransactionOnInvalidId, else only the energy delivery.
+        """
+        connector_id = connector.connector_id
+        request = call.StartTransactionPayload(connector_id=connector_id, id_tag=transaction.id_tag,
+                                               meter_start=transaction.meter_start, timestamp=transaction.start_time)
+        attempts = errors = 0
+        try:
+            while True:
+                attempts += 1
+                try:
+                    response = await self.call(request)
+                except asyncio.TimeoutError:
+                    logging.warning(f"No StartTransaction.conf for connector {connector_id} (attempt {attempts}); retrying")
+                else:
+                    if response is not None:
+                        break
+                    errors += 1
+                    if errors >= max(1, self.config.get("TransactionMessageAttempts", 3)):
+                        logging.error(f"StartTransaction for connector {connector_id} failed {errors} times; left to recovery"
+                                      f"{', connector stays Finishing until then' if connector_id in self.deferred_stops else ''}")
+                        return False
+                await asyncio.sleep(min(self.config.get("TransactionMessageRetryInterval", 5) * attempts, MAX_START_RETRY_INTERVAL))
+        except websockets.exceptions.ConnectionClosed:
+            logging.warning(f"Connection lost before StartTransaction.conf for connector {connector_id}; left to recovery")
+            return False
+        finally:
+            if self.pending_starts.get(connector_id) is asyncio.current_task():
+                del self.pending_starts[connector_id]
+
+        transaction_id = transaction.transaction_id = response.transaction_id
+        self.journal.confirmed(connector_id, transaction_id)
+        if connector.transaction is transaction and not transaction.stopping:
+            self.load_manager.transaction_started(connector_id, transaction_id, parse_time(transaction.start_time))
+        self.add_transaction_to_csv(transaction_id, transaction.meter_start)
+        self.update_auth_cache(transaction.id_tag, response.id_tag_info)
+        logging.info(f"Transaction {transaction_id} started on connector {connector_id}")
+        if connector_id in self.deferred_stops and connector.transaction is transaction:
+            entry = self.journal.open_transactions()[connector_id]
+            await self.close_transaction(connector_id, entry, self.deferred_stops.pop(connector_id))
+            self.release_connector(connector, entry["stop"]["reason"])
+            return True
+        status = response.id_tag_info['status']
+        if status != AuthorizationStatus.accepted and connector.transaction is transaction and not transaction.stopping:
+            transaction.authorized = False
+            connector.relay.close_relay()
+            if self.config.get("StopTransactionOnInvalidId", True):
+                logging.warning(f"idTag {transaction.id_tag} is {status}; stopping transaction {transaction_id}")
+                await self.function_call_queue.put({"function": self.stop_transaction, "args": [connector_id, 'DeAuthorized'], "kwargs": {}})
+            else:
+                logging.warning(f"idTag {transaction.id_tag} is {status}; energy delivery stopped for transaction {transaction_id}")
+                self.update_connector_status(connector_id, status='SuspendedEVSE')
+        return True
+
     async def stop_transaction(self, connector_id, reason='Remote'):
-        if connector_id in self.active_transactions:
-            transaction = self.active_transactions[connector_id]
-            transaction_id = transaction['transaction_id']
-            meter_stop = int(self.get_meter_value(connector_id)['energy'])
-            id_tag = transaction['id_tag']
-            authorize_response = await self.authorize(id_tag)
-            if not authorize_response:
+        connector = self.connectors[connector_id]
+        connector_id = connector.connector_id
+        if connector.transaction is not None:
+            transaction = connector.transaction
+            meter_stop = int(connector.energy)
+            id_tag = transaction.id_tag
+            if transaction.stopping:
+                return False
+            # The CSMS has already refused this tag, so asking again would keep the session from ending
+            if transaction.authorized and not await self.authorize(id_tag):
                 logging.error(f"Authorization failed for idTag {id_tag}. Transaction not stopped.")
                 return False
+            if transaction.stopping:
+                return False
+            transaction.stopping = True
+            pending = self.pending_starts.get(connector_id)
+            if pending is not None:
+                connector.relay.close_relay()  # Stop delivering energy while StartTransaction.conf is still awaited
+                try:
+                    await asyncio.wait_for(asyncio.shield(pending), START_CONFIRM_WAIT)
+                except asyncio.TimeoutError:
+                    pass  # confirm_start keeps trying and sends the stop once the start is confirmed
+            transaction_id = transaction.transaction_id
             valid_reasons = ['EmergencyStop', 'EVDisconnected', 'HardReset', 'Local', 'Other', 'PowerLoss', 'Reboot', 'Remote', 'SoftReset', 'UnlockCommand', 'DeAuthorized']
             reason = reason if reason in valid_reasons else 'Other'
-            stop_transaction_request = call.StopTransactionPayload(meter_stop=meter_stop, timestamp=datetime.now().isoformat(), transaction_id=transaction_id, reason=reason)
+            # Samples still queued belong to this transaction, so they must reach the CSMS first
+            if transaction_id is not None:
+                await self.flush_meter_values(connector_id)
+            self.adaptive_sampler.reset(connector_id)
+            history, connector.history = connector.history, None
+            if connector.status in CHARGING_STATES:
+                self.update_connector_status(connector_id, status='Finishing')
+            transaction_data = self.build_transaction_data(history) if history is not None else None
+            if history is not None:
+                history.discard()
+            stop_time = datetime.utcnow().isoformat()
+            self.journal.stopping(connector_id, meter_stop, stop_time, reason)
+            connector.relay.close_relay()
+            self.load_manager.transaction_stopped(connector_id)
+            if transaction_id is None:
+                # The journal holds one session per connector, so the connector stays taken until
+                # StartTransaction.conf lets the stop go out, or recovery closes both after a reconnect
+                self.deferred_stops[connector_id] = transaction_data
+                logging.warning(f"Stopped charging on connector {connector_id} before StartTransaction was confirmed; "
+                                f"StopTransaction follows the confirmation")
+                return True
+            stop_transaction_request = call.StopTransactionPayload(meter_stop=meter_stop, timestamp=stop_time, transaction_id=transaction_id, reason=reason, transaction_data=transaction_data or None)
             self.update_transaction_in_csv(transaction_id, meter_stop=meter_stop, is_meter_stop_sent='Yes')
             await self.call(stop_transaction_request, suppress=True)
-            self.relay_controllers[connector_id].close_relay()
-            
-            if reason not in ['EmergencyStop', 'PowerLoss']:
-                self.update_connector_status(connector_id, status='Available', error_code='NoError')
-            del self.active_transactions[connector_id]
+            self.sessions.append(transaction_id, connector_id, id_tag, transaction.start_time, stop_time,
+                                 transaction.meter_start, meter_stop, reason)
+            self.journal.stopped(connector_id)
+            self.release_connector(connector, reason)
+
+    def energise_blocked(self, connector_id):
+        """Why the relay of `connector_id` must stay open whatever the session: 'EmergencyStop', a fault, or None."""
+        if self.emergency_status != 0:
+            return 'EmergencyStop'
+        if self.fault_evaluator.is_faulted(connector_id):
+            return 'fault'
+        return None
+
+    def may_energise(self, connector_id):
+        """Whether the relay of `connector_id` may be closed again: an authorized session is still running and nothing forbids it."""
+        connector = self.connectors.get(connector_id)
+        transaction = connector.transaction if connector is not None else None
+        return transaction is not None and transaction.authorized and not transaction.stopping \
+            and self.energise_blocked(connector_id) is None
+
+    def release_connector(self, connector, reason):
+        connector.transaction = None
+        if connector.status == 'Finishing' or (reason not in ['EmergencyStop', 'PowerLoss'] and not self.fault_evaluator.is_faulted(connector.connector_id)):
+            self.update_connector_status(connector.connector_id, status='Available', error_code='NoError')
+
+    async def recover_transactions(self):
+        """
+        Deal with the transactions the journal still holds from before a restart:
+        a decided stop is sent again, a session interrupted for less than
+        TransactionResumeWindow seconds resumes metering, and any other is
+        closed with reason PowerLoss at its last checkpointed energy register.
+        """
+        try:
+            await asyncio.wait_for(self._recover_transactions(), RECOVERY_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.error(f"Transaction recovery did not finish within {RECOVERY_TIMEOUT}s; it is retried on the next boot")
+        except Exception as e:
+            logging.error(f"Transaction recovery failed: {e}")
+
+    async def _recover_transactions(self):
+        window = self.config.get("TransactionResumeWindow", 0)
+        for connector_id, entry in self.journal.open_transactions().items():
+            connector = self.connectors.get(connector_id)
+            if connector is not None and connector.transaction is not None:
+                continue  # Started on this connection, nothing to recover
+            interrupted = time.time() - entry["timestamp"]
+            if "stop" not in entry and connector is not None and 0 <= interrupted <= window \
+                    and self.energise_blocked(connector_id) is None:
+                self.resume_transaction(connector_id, entry)
+                logging.info(f"Resumed transaction {entry['transaction_id']} on connector {connector_id} after {interrupted:.0f}s")
+                continue
+            if "stop" not in entry:
+                self.journal.stopping(connector_id, entry["energy"], datetime.utcfromtimestamp(entry["timestamp"]).isoformat(), 'PowerLoss')
+                entry = self.journal.open_transactions()[connector_id]
+            if entry["transaction_id"] is None:
+                # Charged without StartTransaction.conf; the CSMS has to know the transaction before it can be stopped
+                request = call.StartTransactionPayload(connector_id=connector_id, id_tag=entry["id_tag"],
+                                                       meter_start=entry["meter_start"], timestamp=entry["start_time"])
+                response = await self.call(request)
+                if response is None:
+                    logging.error(f"StartTransaction for the unconfirmed session on connector {connector_id} failed; retried on the next boot")
+                    continue
+                self.journal.confirmed(connector_id, response.transaction_id)
+                self.update_auth_cache(entry["id_tag"], response.id_tag_info)
+                entry = self.journal.open_transactions()[connector_id]
+            await self.close_transaction(connector_id, entry)
+
+    async def close_transaction(self, connector_id, entry, transaction_data=None):
+        """Send the StopTransaction journaled in `entry`, record the session and close the journal entry."""
+        stop = entry["stop"]
+        request = call.StopTransactionPayload(meter_stop=stop["meter_stop"], timestamp=stop["timestamp"],
+                                              transaction_id=stop["transaction_id"], reason=stop["reason"],
+                                              id_tag=entry.get("id_tag"), transaction_data=transaction_data or None)
+        await self.call(request, suppress=True)
+        recorded = self.sessions.get(stop["transaction_id"])
+        if recorded is None or recorded["start_time"] != entry["start_time"]:  # Not if only the journal missed the stop
+            self.sessions.append(stop["transaction_id"], connector_id, entry.get("id_tag"), entry["start_time"],
+                                 stop["timestamp"], entry["meter_start"], stop["meter_stop"], stop["reason"])
+        self.journal.stopped(connector_id)
+        remove_session_history(entry)
+        self.update_transaction_in_csv(stop["transaction_id"], meter_stop=stop["meter_stop"], is_meter_stop_sent='Yes')
+        logging.info(f"Closed transaction {stop['transaction_id']} on connector {connector_id} ({stop['reason']}, meterStop {stop['meter_stop']})")
+
+    def resume_transaction(self, connector_id, entry):
+        connector = self.connectors[connector_id]
+        transaction = Transaction(entry["transaction_id"], connector.connector_id, entry["id_tag"], entry["meter_start"], entry["start_time"])
+        connector.transaction = transaction
+        if connector.energy < entry["energy"]:
+            connector.energy = entry["energy"]  # Integrated meters restart from zero; carry on from the checkpoint
+        self.load_manager.transaction_started(connector.connector_id, transaction.transaction_id)
+        # Samples from before the restart are gone, so the history starts again from now
+        remove_session_history(entry)
+        history_key = entry.get("history") or f"session-{connector.connector_id}-{int(time.time() * 1000)}"
+        connector.history = SessionHistory(history_key, self.config.get("StopTxnSampledData", ()),
+                                           self.config.get("StopTxnAlignedData", ()))
+        connector.relay.open_relay()
+        self.update_connector_status(connector_id=connector_id, status='Charging', error_code='NoError')
+        if transaction.transaction_id is None:
+            self.pending_starts[connector.connector_id] = asyncio.create_task(self.confirm_start(connector, transaction))
 
     async def send_periodic_meter_values(self):
-        while True:
-            for connector_id, transaction in self.active_transactions.items():
-                meter_value = self.get_meter_value(connector_id)
-                sampled_data_config = self.config.get("MeterValuesSampledData", [])
-                sampled_values = []
-                for data in sampled_data_config:
-                    if data == "Energy.Active.Import.Register":
-                        sampled_values.append({"value": str(meter_value.get('energy', 0)), "context": "Sample.Periodic", "format": "Raw", "measurand": data, "location": "EV", "unit": "Wh"})
-                    elif data == "Voltage":
-                        voltage = meter_value.get('voltage', 0)
-                        sampled_values.append({"value": str(voltage), "format": "Raw", "measurand": data, "unit": "V"})
-                    elif data == "Current.Import":
-                        current = meter_value.get('current', 0)
-                        sampled_values.append({"value": str(current), "format": "Raw", "measurand": data, "unit": "A"})
-                    elif data == "Power.Active.Import":
-                        sampled_values.append({"value": str(meter_value.get('power', 0)), "format": "Raw", "measurand": data, "unit": "W"})
-                request = call.MeterValuesPayload(connector_id=connector_id, transaction_id=transaction['transaction_id'], meter_value=[{"timestamp": datetime.utcnow().isoformat(), "sampled_value": sampled_values}])
-                await self.call(request)
-                self.update_transaction_in_csv(transaction['transaction_id'], current_meter_value=meter_value['energy'])
-
-                energy = meter_value.get('energy', 0)  # Assuming 'energy' key holds the energy value in Wh
-                energy_display_message = f"Energy: {int(energy)}Wh"
-                await self.update_specific_lcd_line(connector_id, energy_display_message)
-
-            await asyncio.sleep(int(self.config.get("MeterValueSampleInterval", 60)))
+        scheduler = MeterScheduler(self.periodic_tick_interval,
+                                   lambda: self.config.get("ClockAlignedDataInterval", 0),
+                                   self.sample_meter_values)
+        await scheduler.run()
+
+    def periodic_tick_interval(self):
+        interval = self.config.get("MeterValueSampleInterval", 60)
+        if interval and self.config.get("AdaptiveSampling", False):
+            return min(interval, self.config.get("AdaptiveSampleMinInterval", 10))
+        return interval
+
+    def periodic_sample_due(self, connector_id, now, meter_value):
+        if not self.config.get("AdaptiveSampling", False):
+            return True
+        # Never sample less often than the CSMS asked for in MeterValueSampleInterval
+        max_interval = min(self.config.get("AdaptiveSampleMaxInterval", 300),
+                           self.config.get("MeterValueSampleInterval", 60))
+        return self.adaptive_sampler.due(connector_id, now, meter_value.get('power', 0),
+                                         self.periodic_tick_interval(), max_interval,
+                                         self.config.get("AdaptivePowerChangeThreshold", 0.1))
+
+    def build_sampled_values(self, meter_value, measurands, context):
+        sampled_values = []
+        for data in measurands:
+            if data == "Energy.Active.Import.Register":
+                sampled_values.append({"value": str(meter_value.get('energy', 0)), "context": context, "format": "Raw", "measurand": data, "location": "EV", "unit": "Wh"})
+            elif data == "Voltage":
+                sampled_values.append({"value": str(meter_value.get('voltage', 0)), "context": context, "format": "Raw", "measurand": data, "unit": "V"})
+            elif data == "Current.Import":
+                sampled_values.append({"value": str(meter_value.get('current', 0)), "context": context, "format": "Raw", "measurand": data, "unit": "A"})
+            elif data == "Power.Active.Import":
+                sampled_values.append({"value": str(meter_value.get('power', 0)), "context": context, "format": "Raw", "measurand": data, "unit": "W"})
+        return sampled_values
+
+    async def sample_meter_values(self, periodic, aligned_timestamp):
+        """
+        One sampling pass for both MeterValues streams: each connector's meter
+        window is read once and reused for the Sample.Periodic readings of
+        active transactions and the Sample.Clock readings of every connector.
+
+        Periodic samples are queued and sent in batches of up to
+        MeterValuesMaxBatch, or once the oldest has waited
+        MeterValuesMaxBatchLatency seconds; a clock-aligned reading carries any
+        queued samples with it.
+        """
+        now = time.monotonic()
+        window = now - self.last_sample_pass if self.last_sample_pass is not None else self.config.get("MeterValueSampleInterval", 60)
+        self.last_sample_pass = now
+        timestamp = datetime.utcnow().isoformat()
+        snapshot = {connector_id: self.get_window_meter_value(connector_id, window) for connector_id in self.connectors.ids()}
+        max_batch = self.config["MeterValuesMaxBatch"]  # Schema defaults 1 and 0: batching is opt-in
+        max_latency = self.config["MeterValuesMaxBatchLatency"]
+
+        for connector_id, meter_value in snapshot.items():
+            connector = self.connectors[connector_id]
+            transaction = connector.transaction
+            if transaction is not None and transaction.stopping:
+                transaction = None  # meterStop is fixed; a deferred stop keeps the connector but records nothing more
+            if transaction is not None:
+                self.journal.meter(connector_id, connector.energy)
+            if periodic and transaction is not None and self.periodic_sample_due(connector_id, now, meter_value):
+                self.meter_batch.add(connector_id, {"timestamp": timestamp, "sampled_value": self.build_sampled_values(
+                    meter_value, self.config.get("MeterValuesSampledData", ()), "Sample.Periodic")}, now)
+                if connector.history is not None:
+                    connector.history.add("Sample.Periodic", time.time(), meter_value)
+            if aligned_timestamp is not None and connector.history is not None:
+                connector.history.add("Sample.Clock", aligned_timestamp, meter_value)
+            aligned_values = []
+            if aligned_timestamp is not None:
+                sampled_values = self.build_sampled_values(meter_value, self.config.get("MeterValuesAlignedData", ()), "Sample.Clock")
+                if sampled_values:
+                    aligned_values.append({"timestamp": datetime.utcfromtimestamp(aligned_timestamp).isoformat(), "sampled_value": sampled_values})
+            if aligned_values or self.meter_batch.should_flush(connector_id, max_batch, max_latency, now):
+                await self.flush_meter_values(connector_id, aligned_values, meter_value)
+
+    def build_transaction_data(self, history):
+        return [{"timestamp": datetime.utcfromtimestamp(timestamp).isoformat(),
+                 "sampled_value": self.build_sampled_values(meter_value, measurands, context)}
+                for context, measurands, timestamp, meter_value in history.entries()]
+
+    async def flush_meter_values(self, connector_id, extra_values=(), meter_value=None):
+        """Send the queued periodic samples for a connector (plus `extra_values`) as one MeterValues message."""
+        transaction = self.connectors[connector_id].transaction
+        if transaction is not None and transaction.transaction_id is None:
+            # Held back until StartTransaction.conf gives them a transaction id
+            for entry in extra_values:
+                self.meter_batch.add(connector_id, entry, time.monotonic())
+            return
+        meter_values = self.meter_batch.take(connector_id) + list(extra_values)
+        if not meter_values:
+            return
+        transaction_id = transaction.transaction_id if transaction is not None else None
+        request = call.MeterValuesPayload(connector_id=connector_id, transaction_id=transaction_id, meter_value=meter_values)
+        await self.call(request)
+        self.meter_batch.record_sent(meter_values)
+        self.meter_batch.log_stats()
+
+        if transaction is not None:
+            meter_value = meter_value or self.get_meter_value(connector_id)
+            self.update_transaction_in_csv(transaction_id, current_meter_value=meter_value['energy'])
+            energy = meter_value.get('energy', 0)  # Assuming 'energy' key holds the energy value in Wh
+            energy_display_message = f"Energy: {int(energy)}Wh"
+            await self.update_specific_lcd_line(connector_id, energy_display_message)
 
 
     @on(Action.TriggerMessage)
@@ -449,15 +845,77 @@ class ChargePoint(cp):
             await self.function_call_queue.put({"function": self.send_boot_notification, "args": [], "kwargs": {}})
             status = TriggerMessageStatus.accepted
         elif requested_message == MessageTrigger.heartbeat:
-            await self.function_call_queue.put({"function": self.heartbeat, "args": [], "kwargs": {}})
+            await self.function_call_queue.put({"function": self.send_heartbeat, "args": [], "kwargs": {}})
             status = TriggerMessageStatus.accepted
         elif requested_message == MessageTrigger.status_notification:
-            self.last_sent_status_info = {}
-            connector_id = connector_id if connector_id is not None else 1
-            await self.function_call_queue.put({"function": self.send_status_notification, "args": [connector_id], "kwargs": {}})
+            connectors = list(self.connectors) if connector_id is None else [self.connectors.get(connector_id)]
+            if None in connectors:
+                status = TriggerMessageStatus.rejected
+            else:
+                for connector in connectors:
+                    connector.notification_sent = False  # Sent again even though it has not changed
+                    await self.function_call_queue.put({"function": self.send_status_notification, "args": [connector.connector_id], "kwargs": {}})
+                status = TriggerMessageStatus.accepted
+        elif requested_message == MessageTrigger.diagnostics_status_notification:
+            await self.function_call_queue.put({"function": self.send_diagnostics_status, "args": [], "kwargs": {}})
             status = TriggerMessageStatus.accepted
         return call_result.TriggerMessagePayload(status=status)
 
+    @on(Action.GetDiagnostics)
+    async def on_get_diagnostics(self, location, retries=None, retry_interval=None, start_time=None, stop_time=None, **kwargs):
+        file_name = f"diagnostics-{self.id}-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.ndjson.gz"
+        await self.function_call_queue.put({"function": self.upload_diagnostics, "args": [location, file_name],
+                                            "kwargs": {"retries": retries, "retry_interval": retry_interval,
+                                                       "since": parse_time(start_time), "until": parse_time(stop_time)}})
+        return call_result.GetDiagnosticsPayload(file_name=file_name)
+
+    async def upload_diagnostics(self, location, file_name, retries=None, retry_interval=None, since=None, until=None):
+        """
+        Stream the diagnostics bundle (metrics, config, recent faults, then the
+        logs between `since` and `until`) to `location` from a worker thread,
+        reporting progress with DiagnosticsStatusNotification.
+        """
+        sections = {"metrics": self.diagnostics_metrics(), "config": self.config.to_json(),
+                    "faults": list(self.recent_faults)}
+        retries = DIAGNOSTICS_RETRIES if retries is None else retries
+        retry_interval = DIAGNOSTICS_RETRY_INTERVAL if retry_interval is None else retry_interval
+        self.diagnostics_uploading = True
+        await self.send_diagnostics_status(DiagnosticsStatus.uploading)
+        status = DiagnosticsStatus.upload_failed
+        for attempt in range(retries + 1):
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, diag_log.upload, location, file_name, diag_log.bundle(sections, diag_log.installed, since, until))
+                status = DiagnosticsStatus.uploaded
+                logging.info(f"Diagnostics uploaded to {location} as {file_name}")
+                break
+            except Exception as e:
+                logging.error(f"Diagnostics upload to {location} failed (attempt {attempt + 1} of {retries + 1}): {e}")
+                if attempt < retries:
+                    await asyncio.sleep(retry_interval)
+        self.diagnostics_uploading = False
+        await self.send_diagnostics_status(status)
+
+    async def send_diagnostics_status(self, status=None):
+        """Report `status`; when triggered by the CSMS, Uploading during an upload and Idle otherwise."""
+        if status is None:
+            status = DiagnosticsStatus.uploading if self.diagnostics_uploading else DiagnosticsStatus.idle
+        await self.call(call.DiagnosticsStatusNotificationPayload(status=status))
+
+    def diagnostics_metrics(self):
+        return {
+            "uptime": round(startup_profile.process_age()),
+            "connectors": [{"connector_id": connector.connector_id, "status": connector.status,
+                            "error_code": connector.error_code, **connector.meter_value(),
+                            "transaction_id": connector.transaction.transaction_id if connector.transaction else None}
+                           for connector in self.connectors],
+            "ocpp_bytes": {"sent": self.bytes_sent, "received": self.bytes_received},
+            "meter_history": {"bytes_written": self.meter_history.bytes_written, "writes": self.meter_history.writes},
+            "log": diag_log.installed.stats() if diag_log.installed is not None else None,
+            "loop": loop_watchdog.installed.stats() if loop_watchdog.installed is not None else None,
+            "load": os.getloadavg(),
+        }
+
     @on(Action.UpdateFirmware)
     async def on_update_firmware(self, **kwargs):
         url = kwargs.get('location')
@@ -469,15 +927,16 @@ class ChargePoint(cp):
 
     @on(Action.ClearCache)
     async def on_clear_cache(self, **kwargs):
+        self.auth_cache.clear()
         self.reset_data()
         return call_result.ClearCachePayload(status=ClearCacheStatus.accepted)
 
     @on(Action.Reset)
     async def handle_reset(self, **kwargs):
         reset_type = kwargs.get('type')
-        for connector_id in list(self.active_transactions.keys()):
-            await self.stop_transaction(connector_id)
-        for connector_id in self.connector_status:
+        for connector in self.connectors.with_transaction():
+            await self.stop_transaction(connector.connector_id)
+        for connector_id in self.connectors.ids():
             self.update_connector_status(connector_id=connector_id, status='Unavailable', error_code='NoError')
             asyncio.create_task(self.send_status_notification(connector_id))
         await asyncio.sleep(5)
@@ -503,31 +962,30 @@ class ChargePoint(cp):
         for key in requested_keys:
             if key in self.config:
                 value = self.config[key]
-                if isinstance(value, list):
+                if isinstance(value, (list, tuple)):
                     value = ",".join(map(str, value))
+                elif isinstance(value, bool):
+                    value = str(value).lower()
+                elif key in CONFIG_SCHEMA and CONFIG_SCHEMA[key][0] is dict:
+                    value = json.dumps(dict(value))
                 else:
                     value = str(value)
-                configuration.append({"key": key, "value": value, "readonly": key in readonly_parameters})
+                configuration.append({"key": key, "value": value, "readonly": key in readonly_parameters or self.config_store.is_readonly(key)})
         return call_result.GetConfigurationPayload(configuration_key=configuration)
 
     @on(Action.ChangeConfiguration)
     async def handle_set_configuration(self, **kwargs):
         key = kwargs.get('key')
         value = kwargs.get('value')
-        readonly_parameters = set(self.config.get("ReadOnlyParameters", []))
-        if key in readonly_parameters:
-            return call_result.ChangeConfigurationPayload(status=ConfigurationStatus.rejected)
-        if key in self.config:
-            if isinstance(self.config[key], int):
-                try:
-                    value = int(value)
-                except ValueError:
-                    return call_result.ChangeConfigurationPayload(status=ConfigurationStatus.rejected)
-            elif isinstance(self.config[key], list):
-                value = value.split(",")
-            self.config[key] = value
-            self.save_config()
+        # Validates against CONFIG_SCHEMA, swaps in a new snapshot and schedules a coalesced save
+        status = self.config_store.set(key, value)
+        if status == 'Accepted':
+            self.compile_fault_rules()
+            if key == 'HeartbeatInterval':
+                self.heartbeat_reconfigured.set()
             return call_result.ChangeConfigurationPayload(status=ConfigurationStatus.accepted)
+        elif status == 'Rejected':
+            return call_result.ChangeConfigurationPayload(status=ConfigurationStatus.rejected)
         else:
             return call_result.ChangeConfigurationPayload(status=ConfigurationStatus.not_supported)
 
@@ -535,8 +993,9 @@ class ChargePoint(cp):
     async def on_remote_start_transaction(self, **kwargs):
         id_tag = kwargs.get('id_tag')
         connector_id = kwargs.get('connector_id', 1)
-        if connector_id in self.active_transactions:
-            logging.info(f"Connector {connector_id} is already in use.")
+        connector = self.connectors.get(connector_id)
+        if connector is None or connector.transaction is not None:
+            logging.info(f"Connector {connector_id} is unknown or already in use.")
             return call_result.RemoteStartTransactionPayload(status='Rejected')
         logging.info(f"Start Transaction Called {connector_id}")
         await self.function_call_queue.put({"function": self.start_transaction, "args": [connector_id, id_tag], "kwargs": {}})
@@ -545,114 +1004,180 @@ class ChargePoint(cp):
     @on(Action.RemoteStopTransaction)
     async def on_remote_stop_transaction(self, **kwargs):
         transaction_id = kwargs.get('transaction_id')
-        for connector_id, transaction in self.active_transactions.items():
-            if transaction['transaction_id'] == transaction_id:
-                await self.function_call_queue.put({"function": self.stop_transaction, "args": [connector_id, 'Remote'], "kwargs": {}})
-                return call_result.RemoteStopTransactionPayload(status='Accepted')
+        connector = self.connectors.find_transaction(transaction_id)
+        if connector is not None:
+            await self.function_call_queue.put({"function": self.stop_transaction, "args": [connector.connector_id, 'Remote'], "kwargs": {}})
+            return call_result.RemoteStopTransactionPayload(status='Accepted')
         return call_result.RemoteStopTransactionPayload(status='Rejected')
 
+    @on(Action.SetChargingProfile)
+    async def on_set_charging_profile(self, **kwargs):
+        connector_id = kwargs.get('connector_id')
+        connector = self.connectors.get(connector_id)
+        transaction = connector.transaction if connector is not None else None
+        status = self.load_manager.profiles.install(connector_id, kwargs.get('cs_charging_profiles', {}), self.config,
+                                                    transaction.transaction_id if transaction is not None else None)
+        return call_result.SetChargingProfilePayload(status=ChargingProfileStatus.accepted if status == 'Accepted' else ChargingProfileStatus.rejected)
+
+    @on(Action.ClearChargingProfile)
+    async def on_clear_charging_profile(self, **kwargs):
+        cleared = self.load_manager.profiles.clear(profile_id=kwargs.get('id'), connector_id=kwargs.get('connector_id'),
+                                                   purpose=kwargs.get('charging_profile_purpose'), stack_level=kwargs.get('stack_level'))
+        return call_result.ClearChargingProfilePayload(status=ClearChargingProfileStatus.accepted if cleared else ClearChargingProfileStatus.unknown)
+
+    @on(Action.GetCompositeSchedule)
+    async def on_get_composite_schedule(self, **kwargs):
+        connector_id = kwargs.get('connector_id')
+        if connector_id != 0 and connector_id not in self.connectors:
+            return call_result.GetCompositeSchedulePayload(status=GetCompositeScheduleStatus.rejected)
+        unit = 'W' if kwargs.get('charging_rate_unit') == 'W' else 'A'
+        start, periods = self.load_manager.composite_schedule(connector_id, kwargs.get('duration'), unit)
+        schedule = {"duration": kwargs.get('duration'), "start_schedule": format_time(start), "charging_rate_unit": unit,
+                    "charging_schedule_period": [{"start_period": offset, "limit": limit} for offset, limit in periods]}
+        return call_result.GetCompositeSchedulePayload(status=GetCompositeScheduleStatus.accepted, connector_id=connector_id,
+                                                       schedule_start=format_time(start), charging_schedule=schedule)
+
     def get_meter_value(self, connector_id):
-        return self.meter.get(connector_id, {'voltage': 0, 'current': 0, 'power': 0, 'energy': 0})
+        connector = self.connectors.get(connector_id)
+        return connector.meter_value() if connector is not None else {'voltage': 0, 'current': 0, 'power': 0, 'energy': 0}
+
+    def get_meter_statistics(self, connector_id, seconds):
+        """Min/max/mean/RMS and energy over the last `seconds` of frames, see MeterRing.stats."""
+        buffer = self.meter_buffers.get(connector_id)
+        return buffer.stats(seconds=seconds) if buffer is not None else {"samples": 0, "energy": 0.0}
+
+    def get_window_meter_value(self, connector_id, seconds):
+        """
+        Like get_meter_value, but voltage/current/power are averaged over every
+        frame of the last `seconds` so spikes and dips between reports count.
+        """
+        meter_value = dict(self.get_meter_value(connector_id))
+        stats = self.get_meter_statistics(connector_id, seconds)
+        if stats["samples"]:
+            for field in ('voltage', 'current', 'power'):
+                meter_value[field] = round(stats[field]['mean'], 2)
+            logging.info(f"Connector {connector_id} over {seconds}s: {stats['samples']} frames, "
+                         f"current {stats['current']['min']:.2f}-{stats['current']['max']:.2f} A "
+                         f"(rms {stats['current']['rms']:.2f}), voltage {stats['voltage']['min']:.1f}-{stats['voltage']['max']:.1f} V, "
+                         f"{stats['energy']:.2f} Wh")
+        return meter_value
 
     def parse_metervalues(self, s):
-        parts = re.split(r',(?=M)', s)
-        result = {}
-        for part in parts:
-            values = part.split(',')
-            key = int(values[0].replace('M', ''))
-            voltage = float(values[1])
-            current = float(values[2])
-            power = float(values[3])
-            if current < 0.3:
-                current = 0
-                power = 0
-            result[key] = {'voltage': voltage, 'current': current, 'power': power, 'energy': 0}
-        return result
+        return parse_meter_line(s)
 
     async def read_serial_data(self):
-        if not is_raspberry_pi():
+        if self.meter_process is not None:
+            await self.read_meter_process()
+            return
+        try:
+            meter_source = hal.create_meter_source(self.connectors.ids(), relay_state=lambda connector_id: self.connectors[connector_id].relay.relay_state,
+                                                   config=hal.meter_config(self.config))
+        except Exception as e:
+            logging.error(f"Serial error: {e}")
+            return
+        if hal.use_simulator():
             logging.info('Simulating meter readings [Device is not recognised as PI]')
-            sleep_interval = 1
-            try:
-                while True:
-                    for key in range(1, int(self.config.get("NumberOfConnectors", 2)) + 1):
-                        if key not in self.meter:
-                            temp = {'voltage': 220, 'current': 60, 'power': 220 * 60, 'energy': 0}
-                            self.meter[key] = temp
-                        else:
-                            self.meter[key]['energy'] += (self.meter[key]['power']) * (sleep_interval / 3600)
-
-                        if self.meter[key]['voltage'] < self.config.get("VoltageRestrictions_min", 210):
-                            self.update_connector_status(key, status='Faulted', error_code='UnderVoltage')
-                            if key in self.active_transactions:
-                                await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEVSE"}})
-
-                        if self.meter[key]['voltage'] > self.config.get("VoltageRestrictions_max", 250):
-                            self.update_connector_status(key, status='Faulted', error_code='OverVoltage')
-                            if key in self.active_transactions:
-                                await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEVSE"}})
-
-                        if self.meter[key]['current'] > self.config.get("CurrentRestrictions_max", 32) and key in self.active_transactions:
-                            self.update_connector_status(key, status='Faulted', error_code='OverCurrentFailure')
-                            await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEVSE"}})
-
-                        if self.meter[key]['current'] > self.config.get("CurrentRestrictions_min", 0.3) and key in self.active_transactions:
-                            if datetime.now() - self.active_transactions[key]['start_time'] >= timedelta(minutes=int(self.config.get("CurrentTimingRestrictions_duration_minutes", 1))):  # Check if a minute has passed since the session start
-                                self.update_connector_status(key, status='Faulted', error_code='OverCurrentFailure')
-                                await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEVSE"}})
-                        
-
-                    logging.info('Meter', self.meter)
-                    await asyncio.sleep(sleep_interval)
-            except asyncio.CancelledError:
-                logging.info("Simulation cancelled.")
-        else:
+        try:
+            while True:
+                frame = await meter_source.read_frame()
+                if not frame:
+                    continue
+                now = time.monotonic()
+                for key, values in frame.items():
+                    connector = self.connectors.get(key)
+                    if connector is None:
+                        continue
+                    energy = values['energy'] if meter_source.energy_register else connector.integrate(values['power'], now)
+                    await self.handle_meter_values(connector, values['voltage'], values['current'], values['power'], energy, now)
+                # Modbus buses deliver their connectors separately, so share the limit on every connector's latest draw
+                self.load_manager.allocate_frame(self.connectors.draws)
+        except asyncio.CancelledError:
+            logging.info("Serial reading cancelled.")
+        finally:
+            meter_source.close()
+
+    async def read_meter_process(self):
+        """
+        Consume the samples the meter process publishes (energy already
+        integrated, Faulted trips already applied to the relays) and feed them
+        through the same per-frame handling as read_serial_data.
+        """
+        reader = self.meter_process.reader()
+        next_latency_log = time.monotonic() + LATENCY_LOG_INTERVAL
+        while True:
+            for connector in self.connectors:
+                limiter = self.load_manager.limiters.get(connector.connector_id)
+                reader.set_control(connector.connector_id, connector.relay.relay_state,
+                                   connector.transaction is not None, getattr(limiter, 'limit', None))
+            samples = reader.read()
+            if not samples:
+                if not self.meter_process.alive():
+                    logging.error("Meter process has exited; no meter values until restart")
+                    return
+                await asyncio.sleep(CONSUMER_POLL)
+                continue
+            for capture_time, connector_id, voltage, current, power, energy in samples:
+                connector = self.connectors.get(connector_id)
+                if connector is not None:
+                    await self.handle_meter_values(connector, voltage, current, power, energy, capture_time)
+            self.load_manager.allocate_frame(self.connectors.draws)
+            if time.monotonic() >= next_latency_log:
+                next_latency_log = time.monotonic() + LATENCY_LOG_INTERVAL
+                stats = reader.latency_stats()
+                logging.info(f"Meter process: {stats['samples']} samples, p50 {stats.get('p50_ms', 0):.1f} ms, "
+                             f"p99 {stats.get('p99_ms', 0):.1f} ms end to end, fault check {stats['check_mean_ms']:.1f} ms mean, "
+                             f"{stats['lost']} lost")
+
+    async def handle_meter_values(self, connector, voltage, current, power, energy, now):
+        """Per-frame handling, updating the Connector in place."""
+        connector.record_meter(voltage, current, power, energy, now)
+        buffer = self.meter_buffers.get(connector.connector_id)
+        if buffer is not None:
+            buffer.append(now, voltage, current, power)
+        if self.meter_history.record(connector.connector_id, time.time(), voltage, current, power, energy):
+            # The fsync'd append runs on a worker thread, as maintain() does; only the buffer swap happens here
+            asyncio.get_running_loop().run_in_executor(None, self.meter_history.write, self.meter_history.take())
+        self.live_status.publish_meter(connector.connector_id, voltage, current, power, energy)
+        await self.check_meter_faults(connector, now)
+        if connector.transaction is not None and connector.status in CHARGING_STATES:
+            # An open relay offers nothing, e.g. for a transaction whose idTag the CSMS refused
+            offered = 0 if connector.relay.relay_state == 0 else self.load_manager.limits.get(connector.connector_id)
+            status = connector.charging_status(now, offered)
+            if status != connector.status:
+                self.update_connector_status(connector.connector_id, status=status)
+
+    async def maintain_meter_history(self):
+        """Roll up and expire the meter history on a worker thread, so reading a day of samples does not stall the loop."""
+        while True:
             try:
-                ser = aioserial.AioSerial(port=SERIAL_PORT, baudrate=BAUD_RATE, parity=aioserial.PARITY_NONE, stopbits=aioserial.STOPBITS_ONE, bytesize=aioserial.EIGHTBITS, timeout=1)
-                sleep_interval = 1
-                try:
-                    while True:
-                        if ser.in_waiting > 0:
-                            line = await ser.readline_async()
-                            line = line.decode('utf-8').strip()
-                            if line:
-                                # logging.info(line)
-                                temp = self.parse_metervalues(line)
-                                for key, values in temp.items():
-                                    if key in self.meter:
-                                        self.meter[key]['energy'] += (values['power']) * (sleep_interval / 3600)
-                                        values['energy'] = self.meter[key]['energy']
-                                    self.meter[key] = values
-                                    if values['voltage'] < float(self.config.get("VoltageRestrictions_min", 210)):
-                                        self.update_connector_status(key, status='Faulted', error_code='UnderVoltage')
-                                        if key in self.active_transactions:
-                                            await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEVSE"}})
-
-                                    if values['voltage'] > float(self.config.get("VoltageRestrictions_max", 250)):
-                                        self.update_connector_status(key, status='Faulted', error_code='OverVoltage')
-                                        if key in self.active_transactions:
-                                            await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEVSE"}})
-
-                                    if values['current'] > float(self.config.get("CurrentRestrictions_max", 32)) and key in self.active_transactions:
-                                        self.update_connector_status(key, status='Faulted', error_code='OverCurrentFailure')
-                                        await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEVSE"}})
-
-                                    if float(values['current']) < float(self.config.get("CurrentRestrictions_min", 0.3)) and key in self.active_transactions:
-                                        if datetime.now() - self.active_transactions[key]['start_time'] >= timedelta(minutes=int(self.config.get("CurrentTimingRestrictions_duration_minutes", 1))):  # Check if a minute has passed since the session start
-                                            self.update_connector_status(key, status='Available', error_code='NoError')
-                                            await self.function_call_queue.put({"function": self.stop_transaction, "args": [key], "kwargs": {"reason": "SuspendedEV"}})
-
-
-                                    print(self.meter[key])
-                        await asyncio.sleep(sleep_interval)
-                except asyncio.CancelledError:
-                    logging.info("Serial reading cancelled.")
-                finally:
-                    ser.close()
+                await asyncio.get_running_loop().run_in_executor(None, self.meter_history.maintain)
             except Exception as e:
-                logging.error(f"Serial error: {e}")
+                logging.error(f"Meter history maintenance failed: {e}")
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+    async def check_meter_faults(self, connector, now):
+        if self.fault_config is not self.config:
+            self.compile_fault_rules()  # The config file was edited and reloaded
+        connector_id = connector.connector_id
+        in_transaction = connector.transaction is not None
+        for event, rule in self.fault_evaluator.evaluate(connector_id, connector.voltage, connector.current, in_transaction, now):
+            if event == TRIP:
+                logging.warning(f"Fault rule {rule.name} tripped on connector {connector_id}: {connector.meter_value()}")
+                self.update_connector_status(connector_id, status=rule.status, error_code=rule.error_code)
+                if in_transaction and rule.stop_reason:
+                    await self.function_call_queue.put({"function": self.stop_transaction, "args": [connector_id], "kwargs": {"reason": rule.stop_reason}})
+            elif rule.status == 'Faulted' and connector.error_code == rule.error_code:
+                logging.info(f"Fault rule {rule.name} cleared on connector {connector_id}.")
+                self.update_connector_status(connector_id, status='Available', error_code='NoError')
+
+    def compile_fault_rules(self):
+        self.fault_config = self.config
+        self.fault_evaluator = compile_rules(self.fault_config, previous=getattr(self, 'fault_evaluator', None))
+        if self.meter_process is not None:
+            self.meter_process.update_config(self.fault_config)
 
     def download_firmware(self, url, destination):
+        import requests  # Only needed for UpdateFirmware, and slow to import
         try:
             response = requests.get(url, timeout=60)
             if response.status_code == 200:
@@ -676,44 +1201,79 @@ class ChargePoint(cp):
 # Import necessary modules and define your ChargePoint class as before
 
 async def main():
+    diag_log.setup(get_config_store().snapshot)
+    # Opens the relays from its own thread if a blocking call wedges the loop
+    watchdog = loop_watchdog.setup(asyncio.get_running_loop(), get_config_store().snapshot)
     charger_config = load_json_config(CHARGER_CONFIG_FILE)
     server_url = charger_config['server_url']
     charger_id = charger_config['charger_id']
     reconnection_delay = charger_config.get('reconnection_delay', 10)  # In seconds
+    connect_options = websocket_options(charger_config)
 
-    while True:
-        try:
-            # Ensure any existing WebSocket connection is closed before reconnecting
-            async with websockets.connect(f"{server_url}/{charger_id}", subprotocols=["ocpp1.6j"]) as ws:
-                cp_instance = ChargePoint(charger_id, ws)
-                update_lcd_line(4, "Joulepoint, Online")
-                tasks = [
-                    cp_instance.start(),
-                    cp_instance.send_boot_notification(),
-                    cp_instance.heartbeat(),
-                    cp_instance.send_periodic_meter_values(),
-                    cp_instance.send_status_notifications_loop(),
-                    cp_instance.read_serial_data(),
-                    cp_instance.monitor_emergency_stop_pin(),
-                ]
-                await asyncio.gather(*tasks)
-
-        except websockets.exceptions.ConnectionClosedOK:
-            logging.info("WebSocket connection was closed normally, attempting to reconnect...")
-            await asyncio.sleep(reconnection_delay)
-        except websockets.exceptions.WebSocketException as e:
-            logging.error(f"WebSocket error occurred: {e}. Retrying...")
-            update_lcd_line(4, "Server Disconnected. Retrying...")
-            await asyncio.sleep(reconnection_delay)
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-            update_lcd_line(4, "Unexpected Error. Retrying...")
-            await asyncio.sleep(reconnection_delay)
-        except KeyboardInterrupt:
-            logging.info("Application shutdown requested by user.")
-            break
-        finally:
-            cleanup_pigpio()
+    def guard_relays(future):
+        # Connected or not, the watchdog can force the relays off from the moment they exist
+        if not future.cancelled() and future.exception() is None:
+            watchdog.relays = future.result().relay_controllers
+
+    def bring_up_hardware():
+        # On a worker thread while the first handshake is in flight
+        future = asyncio.get_running_loop().run_in_executor(None, Hardware, get_config_store().snapshot)
+        future.add_done_callback(guard_relays)
+        return future
+
+    hardware_ready = bring_up_hardware()
+    try:
+        while True:
+            try:
+                # Ensure any existing WebSocket connection is closed before reconnecting
+                async with websockets.connect(f"{server_url}/{charger_id}", subprotocols=["ocpp1.6j"], **connect_options) as ws:
+                    startup_profile.mark("connected")
+                    hardware = await hardware_ready
+                    cp_instance = ChargePoint(charger_id, ws, hardware=hardware)
+                    update_lcd_line(4, "Joulepoint, Online")
+                    tasks = [asyncio.create_task(coroutine) for coroutine in (
+                        cp_instance.start(),
+                        cp_instance.send_boot_notification(),
+                        cp_instance.heartbeat(),
+                        cp_instance.send_periodic_meter_values(),
+                        cp_instance.send_status_notifications_loop(),
+                        cp_instance.read_serial_data(),
+                        cp_instance.monitor_emergency_stop_pin(),
+                        cp_instance.maintain_meter_history(),
+                    )]
+                    tasks.append(cp_instance.queue_task)
+                    try:
+                        await asyncio.gather(*tasks)
+                    finally:
+                        # The next connection gets its own ChargePoint; this one must stop reading the meter and the stop pin first
+                        for task in tasks:
+                            task.cancel()
+                        await asyncio.gather(*tasks, return_exceptions=True)
+
+            except websockets.exceptions.ConnectionClosedOK:
+                logging.info("WebSocket connection was closed normally, attempting to reconnect...")
+                await asyncio.sleep(reconnection_delay)
+            except websockets.exceptions.WebSocketException as e:
+                logging.error(f"WebSocket error occurred: {e}. Retrying...")
+                update_lcd_line(4, "Server Disconnected. Retrying...")
+                await asyncio.sleep(reconnection_delay)
+            except Exception as e:
+                logging.error(f"Unexpected error: {e}")
+                update_lcd_line(4, "Unexpected Error. Retrying...")
+                if hardware_ready.done() and hardware_ready.exception() is not None:
+                    hardware_ready = bring_up_hardware()
+                await asyncio.sleep(reconnection_delay)
+            except KeyboardInterrupt:
+                logging.info("Application shutdown requested by user.")
+                break
+    finally:
+        # Hardware outlives each connection, so the pigpio connection is only closed on the way out
+        if hardware_ready.done() and not hardware_ready.cancelled() and hardware_ready.exception() is None:
+            hardware_ready.result().meter_history.close()
+        watchdog.close()
+        hal.cleanup()
+        if diag_log.installed is not None:
+            diag_log.installed.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
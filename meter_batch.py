@@ -0,0 +1,129 @@
+import json
+import logging
+import time
+
+POWER_CHANGE_FLOOR = 100.0  # Watts; smaller swings never count as a change, whatever the relative threshold
+# Bytes of a MeterValues CALL frame apart from its meterValue entries (OCPP-J envelope and message id)
+ENVELOPE_TEMPLATE = [2, "00000000-0000-0000-0000-000000000000", "MeterValues",
+                     {"connectorId": 0, "transactionId": 0, "meterValue": []}]
+
+
+class AdaptiveSampler:
+    """
+    Decides when a connector's periodic sample is recorded. While power moves
+    by more than `threshold` (relative) between ticks the interval halves down
+    to `min_interval`; while it stays steady the interval doubles up to
+    `max_interval`.
+    """
+
+    def __init__(self):
+        self.interval = {}
+        self.last_sample = {}  # connector_id: (monotonic time, power)
+
+    def due(self, connector_id, now, power, min_interval, max_interval, threshold):
+        last = self.last_sample.get(connector_id)
+        interval = self.interval.get(connector_id, min_interval)
+        if last is None:
+            changed, elapsed = True, 0.0
+        else:
+            elapsed = now - last[0]
+            changed = abs(power - last[1]) > max(POWER_CHANGE_FLOOR, threshold * abs(last[1]))
+        if changed:
+            self.interval[connector_id] = max(min_interval, interval / 2)
+        elif elapsed + 0.5 >= interval:  # Half a second of slack for scheduler jitter
+            self.interval[connector_id] = min(max_interval, interval * 2)
+        else:
+            return False
+        self.last_sample[connector_id] = (now, power)
+        return True
+
+    def reset(self, connector_id):
+        self.interval.pop(connector_id, None)
+        self.last_sample.pop(connector_id, None)
+
+
+class MeterValuesBatch:
+    """
+    Queues timestamped meterValue entries per connector so several samples go
+    out in one MeterValues message, and counts what each message costs.
+    """
+
+    def __init__(self):
+        self.pending = {}  # connector_id: [meterValue entry, ...]
+        self.first_queued = {}  # connector_id: monotonic time of the oldest pending entry
+        self.messages = 0
+        self.samples = 0
+        self.payload_bytes = 0
+        self.overhead_bytes = 0
+        self.envelope_bytes = len(json.dumps(ENVELOPE_TEMPLATE, separators=(',', ':')))
+
+    def add(self, connector_id, entry, now=None):
+        if connector_id not in self.pending or not self.pending[connector_id]:
+            self.first_queued[connector_id] = time.monotonic() if now is None else now
+        self.pending.setdefault(connector_id, []).append(entry)
+
+    def pending_count(self, connector_id):
+        return len(self.pending.get(connector_id, ()))
+
+    def should_flush(self, connector_id, max_batch, max_latency, now=None):
+        count = self.pending_count(connector_id)
+        if count == 0:
+            return False
+        if count >= max_batch:
+            return True
+        now = time.monotonic() if now is None else now
+        return now - self.first_queued[connector_id] >= max_latency
+
+    def take(self, connector_id):
+        self.first_queued.pop(connector_id, None)
+        return self.pending.pop(connector_id, [])
+
+    def record_sent(self, meter_values):
+        """Account for one sent message carrying `meter_values`."""
+        body = sum(len(json.dumps(entry, separators=(',', ':'))) for entry in meter_values) + max(0, len(meter_values) - 1)
+        self.messages += 1
+        self.samples += len(meter_values)
+        self.payload_bytes += body + self.envelope_bytes
+        self.overhead_bytes += self.envelope_bytes
+
+    def stats(self):
+        samples = max(1, self.samples)
+        return {"messages": self.messages, "samples": self.samples,
+                "samples_per_message": round(self.samples / max(1, self.messages), 2),
+                "bytes": self.payload_bytes, "overhead_bytes_per_sample": round(self.overhead_bytes / samples, 1),
+                "messages_saved": self.samples - self.messages}
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"MeterValues: {stats['samples']} samples in {stats['messages']} messages "
+                     f"({stats['samples_per_message']} per message, {stats['messages_saved']} messages saved, "
+                     f"{stats['overhead_bytes_per_sample']} B envelope overhead per sample)")
+
+
+def benchmark(hours=8, tick=5):
+    """Steady 7.4 kW session: compare one message per 60 s sample with adaptive sampling plus batches of 10."""
+    sampler = AdaptiveSampler()
+    batch = MeterValuesBatch()
+    now = 0.0
+    entry = {"timestamp": "2024-01-01T00:00:00", "sampledValue": [
+        {"value": "12345.6", "context": "Sample.Periodic", "format": "Raw",
+         "measurand": "Energy.Active.Import.Register", "location": "EV", "unit": "Wh"}]}
+    for step in range(int(hours * 3600 / tick)):
+        now += tick
+        power = 7360.0 + (step % 7) * 10  # Ripple well under the change threshold
+        if step == 2000:
+            power = 3600.0  # One step change (the EV tapering), which densifies sampling briefly
+        if sampler.due(1, now, power, tick, 300, 0.1):
+            batch.add(1, entry, now)
+        if batch.should_flush(1, 10, 900, now):
+            batch.record_sent(batch.take(1))
+    baseline = MeterValuesBatch()
+    for _ in range(int(hours * 3600 / 60)):
+        baseline.record_sent([entry])
+    print(f"baseline: {baseline.messages} messages, {baseline.payload_bytes} bytes")
+    print(f"adaptive+batched: {batch.messages} messages, {batch.samples} samples, {batch.payload_bytes} bytes")
+    print(f"messages reduced {baseline.messages / max(1, batch.messages):.1f}x")
+
+
+if __name__ == '__main__':
+    benchmark()
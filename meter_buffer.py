@@ -0,0 +1,143 @@
+import math
+import operator
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+np = None  # numpy, imported by the first MeterRing so importing this module stays cheap at startup
+_numpy_checked = False
+
+# Default sizing: ~5.5 minutes of history at 50 frames/s per connector
+RING_CAPACITY = 16384
+FIELDS = ('voltage', 'current', 'power')
+
+
+def load_numpy():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:  # The array-backed fallback keeps the same API, just slower
+            np = None
+    return np
+
+
+class MeterRing:
+    """
+    Fixed-size ring of every meter frame for one connector.
+
+    Each sample is written twice, at `i` and `i + capacity`, so the newest
+    `capacity` samples are always one contiguous slice in time order. Windows
+    are therefore views (NumPy) or single slices (array), never re-assembled,
+    and memory stays bounded regardless of uptime.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+        self.head = 0  # Index of the oldest sample in the first half
+        if load_numpy() is not None:
+            self.timestamps = np.zeros(2 * capacity, dtype=np.float64)
+            self.values = {field: np.zeros(2 * capacity, dtype=np.float32) for field in FIELDS}
+        else:
+            self.timestamps = array('d', bytes(16 * capacity))
+            self.values = {field: array('f', bytes(8 * capacity)) for field in FIELDS}
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, voltage, current, power):
+        if self.count < self.capacity:
+            index = self.count
+            self.count += 1
+        else:
+            index = self.head
+            self.head = (self.head + 1) % self.capacity
+        mirror = index + self.capacity
+        self.timestamps[index] = self.timestamps[mirror] = timestamp
+        for field, value in zip(FIELDS, (voltage, current, power)):
+            column = self.values[field]
+            column[index] = column[mirror] = value
+
+    def _bounds(self, since=None, until=None):
+        start, end = self.head, self.head + self.count
+        if np is not None:
+            ordered = self.timestamps[start:end]
+            lo = int(np.searchsorted(ordered, since, 'left')) if since is not None else 0
+            hi = int(np.searchsorted(ordered, until, 'right')) if until is not None else self.count
+            return start + lo, start + hi
+        # Search the mirrored buffer in place instead of slicing out a copy
+        lo = bisect_left(self.timestamps, since, start, end) if since is not None else start
+        hi = bisect_right(self.timestamps, until, start, end) if until is not None else end
+        return lo, hi
+
+    def window(self, since=None, until=None):
+        """Time-ordered timestamps and field columns for since <= t <= until."""
+        start, end = self._bounds(since, until)
+        return self.timestamps[start:end], {field: column[start:end] for field, column in self.values.items()}
+
+    def stats(self, seconds=None, since=None, until=None, now=None):
+        """
+        Min/max/mean/RMS of voltage, current and power plus the energy (Wh,
+        trapezoidal) over a window. `seconds` selects the trailing window
+        ending at `now` (monotonic time).
+        """
+        if seconds is not None:
+            now = time.monotonic() if now is None else now
+            since, until = now - seconds, now
+        timestamps, columns = self.window(since, until)
+        samples = len(timestamps)
+        result = {"samples": samples, "energy": 0.0}
+        if samples == 0:
+            return result
+        if np is not None:
+            for field, column in columns.items():
+                column = column.astype(np.float64)
+                result[field] = {"min": float(column.min()), "max": float(column.max()), "mean": float(column.mean()),
+                                 "rms": float(np.sqrt(np.dot(column, column) / samples))}
+            if samples > 1:
+                power = columns['power'].astype(np.float64)
+                result["energy"] = float(np.dot(power[1:] + power[:-1], np.diff(timestamps))) / 7200
+        else:
+            for field, column in columns.items():
+                result[field] = {"min": min(column), "max": max(column), "mean": math.fsum(column) / samples,
+                                 "rms": math.sqrt(math.fsum(map(operator.mul, column, column)) / samples)}
+            if samples > 1:
+                power = columns['power']
+                pairs = map(operator.add, power[1:], power[:-1])
+                steps = map(operator.sub, timestamps[1:], timestamps[:-1])
+                result["energy"] = math.fsum(map(operator.mul, pairs, steps)) / 7200
+        result["duration"] = float(timestamps[-1] - timestamps[0])
+        return result
+
+
+def benchmark(frames_per_second=50, connectors=3, seconds=3600):
+    """Feed `seconds` of frames at `frames_per_second` per connector and time appends and 60 s window stats."""
+    rings = {connector_id: MeterRing() for connector_id in range(1, connectors + 1)}
+    total = frames_per_second * seconds
+    started = time.perf_counter()
+    for frame in range(total):
+        timestamp = frame / frames_per_second
+        for connector_id, ring in rings.items():
+            ring.append(timestamp, 230.0, 16.0 + (frame % 50 == 0) * 10, 230.0 * 16.0)
+    append_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    rounds = 100
+    for _ in range(rounds):
+        for ring in rings.values():
+            stats = ring.stats(seconds=60, now=seconds)
+    stats_seconds = time.perf_counter() - started
+    ring_bytes = sum(ring.timestamps.itemsize * len(ring.timestamps) +
+                     sum(column.itemsize * len(column) for column in ring.values.values()) for ring in rings.values())
+    print(f"backend: {'numpy' if np is not None else 'array'}")
+    print(f"append: {append_seconds / (total * connectors) * 1e6:.2f} us/frame "
+          f"({total * connectors / append_seconds:.0f} frames/s, need {frames_per_second * connectors})")
+    print(f"60 s window stats: {stats_seconds / (rounds * connectors) * 1e3:.3f} ms per connector "
+          f"({stats['samples']} samples, max current {stats['current']['max']:.1f} A)")
+    print(f"ring memory: {ring_bytes / 1024:.0f} KiB for {connectors} connectors")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,372 @@
+"""
+Modbus RTU energy meters as a meter source (MeterBackend "modbus").
+
+Each connector has a DIN-rail meter on an RS-485 bus, configured in
+ModbusMeters as connector id -> slave address, or -> {"address": ...,
+"port": ..., "registers": {...}} for meters on another bus or with another
+register map. Quantities are IEEE 754 float32 input registers (function 04,
+high word first), SDM_REGISTERS by default. Each meter's registers are read
+with as few contiguous requests as pay off at the bus baud rate, every bus
+is polled by its own task, and requests go out back to back; a meter that
+does not answer costs its response timeout on its own bus only.
+"""
+import asyncio
+import logging
+import struct
+import threading
+import time
+
+from meter_protocol import LINK_STATS_INTERVAL, MIN_CURRENT, crc16
+
+DEFAULT_PORT = '/dev/ttyUSB0'
+DEFAULT_BAUD = 9600
+DEFAULT_POLL_INTERVAL = 1.0  # Seconds between polls of every meter on a bus
+FC_READ_INPUT_REGISTERS = 0x04
+MAX_REGISTERS = 125  # Per read request (Modbus limit)
+TURNAROUND = 0.05  # Seconds a meter may take to start answering; SDM meters need up to ~40 ms
+OFFLINE_AFTER = 3  # Consecutive timeouts before a meter is reported as not responding
+FRAME_QUEUE = 8  # Frames kept for a slow consumer; older ones are dropped
+
+# quantity: (first register, factor to V / A / W / Wh); every value spans two registers.
+# Eastron SDM120/SDM630 layout; energy is total import kWh.
+SDM_REGISTERS = {
+    'voltage': (0x0000, 1),
+    'current': (0x0006, 1),
+    'power': (0x000C, 1),
+    'energy': (0x0048, 1000),
+}
+
+
+class ModbusError(Exception):
+    """A Modbus exception response (illegal address, slave busy, ...)."""
+
+    def __init__(self, address, code):
+        super().__init__(f"meter {address} answered with exception code {code}")
+        self.code = code
+
+
+def char_time(baud):
+    return 11 / baud  # Start bit, 8 data bits, parity or 2nd stop bit, stop bit
+
+
+def frame_gap(baud):
+    """Silence that ends an RTU frame: 3.5 characters, fixed at 1.75 ms above 19200 baud."""
+    return 3.5 * char_time(baud) if baud <= 19200 else 0.00175
+
+
+def read_request(address, start, count, function=FC_READ_INPUT_REGISTERS):
+    body = struct.pack('>BBHH', address, function, start, count)
+    return body + struct.pack('<H', crc16(body))
+
+
+def max_gap(baud, turnaround=TURNAROUND):
+    """Unused registers worth reading to save one request: a request costs its 8+5 byte overhead and the turnaround."""
+    return int((turnaround + 13 * char_time(baud)) / (2 * char_time(baud)))
+
+
+def plan_reads(registers, gap, limit=MAX_REGISTERS):
+    """
+    Merge the two-register quantities in `registers` into contiguous reads,
+    bridging holes of up to `gap` registers: [(start, count, [(quantity,
+    offset, factor)])], offsets in registers from start.
+    """
+    reads = []
+    for quantity, (register, factor) in sorted(registers.items(), key=lambda item: item[1][0]):
+        if reads:
+            start, count, quantities = reads[-1]
+            end = start + count
+            if register - end <= gap and register + 2 - start <= limit:
+                quantities.append((quantity, register - start, factor))
+                reads[-1] = (start, max(end, register + 2) - start, quantities)
+                continue
+        reads.append((register, 2, [(quantity, 0, factor)]))
+    return reads
+
+
+def parse_response(address, response, count, function=FC_READ_INPUT_REGISTERS):
+    """Register bytes of a read response; raises ModbusError or ValueError (bad CRC, wrong slave or length)."""
+    if len(response) < 5:
+        raise ValueError(f"short response ({len(response)} bytes)")
+    if crc16(response[:-2]) != response[-2] | response[-1] << 8:
+        raise ValueError("bad CRC")
+    if response[0] != address or response[1] & 0x7F != function:
+        raise ValueError(f"response from meter {response[0]} to function {response[1]}")
+    if response[1] & 0x80:
+        raise ModbusError(address, response[2])
+    if response[2] != 2 * count or len(response) != 5 + 2 * count:
+        raise ValueError(f"expected {2 * count} register bytes, got {response[2]}")
+    return response[3:-2]
+
+
+class Meter:
+    """One slave on a bus and its precomputed read requests."""
+
+    def __init__(self, connector_id, address, registers, gap):
+        missing = set(SDM_REGISTERS) - set(registers)
+        if missing:
+            raise ValueError(f"Modbus meter {address} has no register for {', '.join(sorted(missing))}")
+        self.connector_id = connector_id
+        self.address = address
+        self.reads = [(read_request(address, start, count), count, quantities)
+                      for start, count, quantities in plan_reads(registers, gap)]
+        self.timeouts = 0  # Consecutive
+
+    def decode(self, blocks):
+        values = {}
+        for (_, _, quantities), data in zip(self.reads, blocks):
+            for quantity, offset, factor in quantities:
+                values[quantity] = struct.unpack_from('>f', data, 2 * offset)[0] * factor
+        if values['current'] < MIN_CURRENT:
+            values['current'] = 0
+            values['power'] = 0
+        return values
+
+
+class ModbusBus:
+    """The meters on one serial port, polled one request at a time (RTU is half duplex)."""
+
+    def __init__(self, port, meters, baud=DEFAULT_BAUD, serial=None):
+        import aioserial
+        self.port = port
+        self.meters = meters
+        self.baud = baud
+        longest = max((5 + 2 * count for meter in meters for _, count, _ in meter.reads), default=5)
+        # pyserial's read timeout bounds every response; the read runs on aioserial's thread, not the event loop
+        self.timeout = TURNAROUND + (8 + longest) * char_time(baud)
+        self.serial = serial or aioserial.AioSerial(port=port, baudrate=baud, parity=aioserial.PARITY_NONE,
+                                                    stopbits=aioserial.STOPBITS_ONE, bytesize=aioserial.EIGHTBITS)
+        self.serial.timeout = self.timeout
+        self.requests = 0
+        self.timeouts = 0
+        self.crc_errors = 0
+        self.exceptions = 0
+
+    async def transact(self, request, count):
+        """Send one read request; the register bytes, or None on a timeout or a bad frame."""
+        self.requests += 1
+        await asyncio.sleep(frame_gap(self.baud))
+        await self.serial.write_async(request)
+        response = await self.serial.read_async(3)
+        if len(response) == 3:
+            response += await self.serial.read_async(2 if response[1] & 0x80 else response[2] + 2)
+        try:
+            return parse_response(request[0], response, count)
+        except ModbusError as e:
+            self.exceptions += 1
+            logging.warning(f"Modbus on {self.port}: {e}")
+        except ValueError as e:
+            if response:
+                self.crc_errors += 1
+                logging.debug(f"Modbus on {self.port}: discarding response from meter {request[0]}: {e}")
+            else:
+                self.timeouts += 1
+        # Let a late or garbled answer finish, then drop it so it cannot be taken for the next response
+        await asyncio.sleep(frame_gap(self.baud) + TURNAROUND)
+        self.serial.reset_input_buffer()
+        return None
+
+    async def poll(self):
+        """One reading per meter that answered every read: {connector_id: values}, and when the last answer arrived."""
+        frame = {}
+        capture = None
+        for meter in self.meters:
+            blocks = []
+            for request, count, _ in meter.reads:
+                data = await self.transact(request, count)
+                if data is None:
+                    break
+                blocks.append(data)
+            if len(blocks) < len(meter.reads):
+                meter.timeouts += 1
+                if meter.timeouts == OFFLINE_AFTER:
+                    logging.error(f"Modbus meter {meter.address} on {self.port} (connector {meter.connector_id}) is not responding")
+                continue
+            if meter.timeouts >= OFFLINE_AFTER:
+                logging.info(f"Modbus meter {meter.address} on {self.port} (connector {meter.connector_id}) is back")
+            meter.timeouts = 0
+            capture = time.monotonic()
+            frame[meter.connector_id] = meter.decode(blocks)
+        return frame, capture
+
+    def stats(self):
+        return {"port": self.port, "requests": self.requests, "timeouts": self.timeouts,
+                "crc_errors": self.crc_errors, "exceptions": self.exceptions}
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Modbus {stats['port']}: {stats['requests']} requests, {stats['timeouts']} timeouts, "
+                     f"{stats['crc_errors']} bad frames, {stats['exceptions']} exception responses")
+
+    def close(self):
+        self.serial.close()
+
+
+class ModbusMeterSource:
+    """
+    Meter source for Modbus RTU meters: read_frame() returns the readings of
+    one bus poll, {connector_id: {'voltage', 'current', 'power', 'energy'}},
+    with energy from the meter's own register.
+    """
+
+    energy_register = True
+
+    def __init__(self, connector_ids, meters, baud=DEFAULT_BAUD, poll_interval=DEFAULT_POLL_INTERVAL, port=DEFAULT_PORT):
+        by_port = {}
+        for connector_id in connector_ids:
+            meter = meters.get(str(connector_id), meters.get(connector_id))
+            if meter is None:
+                logging.warning(f"No Modbus meter configured for connector {connector_id}")
+                continue
+            if not isinstance(meter, dict):
+                meter = {"address": meter}
+            by_port.setdefault(meter.get("port", port), []).append(
+                Meter(connector_id, int(meter["address"]), meter.get("registers", SDM_REGISTERS), max_gap(baud)))
+        self.buses = [ModbusBus(bus_port, bus_meters, baud) for bus_port, bus_meters in by_port.items()]
+        self.poll_interval = poll_interval
+        self.queue = None
+        self.tasks = []
+        self.last_frame_time = None
+
+    def _publish(self, frame, capture):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait((frame, capture))
+
+    async def _poll_bus(self, bus):
+        next_poll = time.monotonic()
+        next_stats = next_poll + LINK_STATS_INTERVAL
+        while True:
+            frame, capture = await bus.poll()
+            if frame:
+                self._publish(frame, capture)
+            now = time.monotonic()
+            if now >= next_stats:
+                next_stats = now + LINK_STATS_INTERVAL
+                bus.log_stats()
+            next_poll += self.poll_interval
+            if next_poll < now:  # The poll overran; keep the rate from here rather than bursting
+                next_poll = now
+            await asyncio.sleep(next_poll - now)
+
+    async def read_frame(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue(FRAME_QUEUE)
+            self.tasks = [asyncio.create_task(self._poll_bus(bus)) for bus in self.buses]
+        frame, self.last_frame_time = await self.queue.get()
+        return frame
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for bus in self.buses:
+            bus.log_stats()
+            bus.close()
+
+
+class ModbusSlaveEmulator(threading.Thread):
+    """
+    Modbus RTU meters on the master side of a pty, for the benchmark: answers
+    function 04 for `addresses` from an SDM-style register map, taking
+    `turnaround` plus the wire time at `baud` per answer. Addresses in
+    `silent` never answer.
+    """
+
+    def __init__(self, fd, addresses=(1, 2, 3), baud=DEFAULT_BAUD, turnaround=0.02, silent=()):
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.addresses = set(addresses)
+        self.baud = baud
+        self.turnaround = turnaround
+        self.silent = set(silent)
+        self.requests = 0
+        self.stopped = threading.Event()
+
+    def registers(self, address):
+        data = bytearray(2 * 0x0100)
+        for quantity, value in self.truth(address).items():
+            register, factor = SDM_REGISTERS[quantity]
+            struct.pack_into('>f', data, 2 * register, value / factor)
+        return data
+
+    def truth(self, address):
+        return {'voltage': 230.0 + address, 'current': 16.0, 'power': 3680.0 + address, 'energy': 123456.0 + address}
+
+    def run(self):
+        import os
+        import select
+        buffer = bytearray()
+        while not self.stopped.is_set():
+            if not select.select([self.fd], [], [], 0.05)[0]:
+                buffer.clear()  # Line silence ends any partial frame
+                continue
+            buffer += os.read(self.fd, 256)
+            while len(buffer) >= 8:
+                request, buffer = bytes(buffer[:8]), buffer[8:]
+                if crc16(request[:6]) != request[6] | request[7] << 8:
+                    buffer.clear()
+                    break
+                address, function, start, count = struct.unpack('>BBHH', request[:6])
+                if address not in self.addresses or address in self.silent:
+                    continue
+                self.requests += 1
+                if function != FC_READ_INPUT_REGISTERS or start + count > 0x0100:
+                    body = bytes((address, function | 0x80, 2))
+                else:
+                    body = bytes((address, function, 2 * count)) + bytes(self.registers(address)[2 * start:2 * (start + count)])
+                response = body + struct.pack('<H', crc16(body))
+                time.sleep(self.turnaround + len(response) * char_time(self.baud))
+                os.write(self.fd, response)
+
+
+def benchmark(polls=20):
+    """Poll cycle time for three SDM meters, one request per quantity against planned block reads, over a pty."""
+    import os
+
+    import aioserial
+
+    connector_ids = (1, 2, 3)
+
+    async def run(baud, gap, silent=()):
+        master, slave = os.openpty()
+        emulator = ModbusSlaveEmulator(master, connector_ids, baud=baud, silent=silent)
+        emulator.start()
+        serial = aioserial.AioSerial(port=os.ttyname(slave), baudrate=baud)
+        meters = [Meter(connector_id, connector_id, SDM_REGISTERS, gap) for connector_id in connector_ids]
+        bus = ModbusBus(os.ttyname(slave), meters, baud, serial=serial)
+        lag = 0.0
+
+        async def ticker():
+            nonlocal lag
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                lag = max(lag, time.monotonic() - started - 0.01)
+
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        for _ in range(polls):
+            frame, _ = await bus.poll()
+            for connector_id, values in frame.items():
+                truth = emulator.truth(connector_id)
+                assert all(abs(values[quantity] - truth[quantity]) < 0.01 for quantity in truth), values
+        elapsed = (time.perf_counter() - started) / polls
+        tick.cancel()
+        emulator.stopped.set()
+        emulator.join()
+        bus.close()
+        os.close(master)
+        os.close(slave)
+        return elapsed, len(meters[0].reads), lag, bus.stats()
+
+    for baud in (9600, 38400):
+        naive, naive_reads, _, _ = asyncio.run(run(baud, gap=-2))
+        planned, planned_reads, _, _ = asyncio.run(run(baud, gap=max_gap(baud)))
+        print(f"{baud:6d} baud, 3 meters: one read per quantity ({naive_reads}/meter) {naive * 1e3:6.1f} ms/poll, "
+              f"planned ({planned_reads}/meter) {planned * 1e3:6.1f} ms/poll ({naive / planned:.1f}x)")
+    elapsed, _, lag, stats = asyncio.run(run(DEFAULT_BAUD, gap=max_gap(DEFAULT_BAUD), silent=(2,)))
+    print(f"meter 2 silent: {elapsed * 1e3:.1f} ms/poll, {stats['timeouts']} timeouts, "
+          f"worst event loop lag {lag * 1e3:.1f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,315 @@
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+import hal
+from fault_rules import FAULT_RULES, TRIP, compile_rules
+
+# Shared memory layout: HEADER, then MAX_CONNECTORS control blocks, then RING_SLOTS sample slots
+RING_SLOTS = 1024
+MAX_CONNECTORS = 8
+# write count, fault checks, summed and max capture-to-check delay (s)
+HEADER = struct.Struct('<QQdd32x')
+# relay state and in-transaction flag (written by main.py), tripped flag (written by the meter process),
+# offered current limit in A (0 = none)
+CONTROL = struct.Struct('<BBBxf8x')
+# sequence, capture time (time.monotonic, shared by all processes), connector id, voltage, current, power, energy
+SLOT = struct.Struct('<QdIxxxxdddd8x')
+CONTROL_OFFSET = HEADER.size
+SLOTS_OFFSET = CONTROL_OFFSET + MAX_CONNECTORS * CONTROL.size
+SHM_SIZE = SLOTS_OFFSET + RING_SLOTS * SLOT.size
+
+CONSUMER_POLL = 0.01  # Seconds between ring polls in main.py
+PARENT_CHECK = 1.0  # Seconds between checks that main.py is still running
+LATENCY_LOG_INTERVAL = 300
+
+
+def fault_config(config):
+    """The config values the fault rules read, as a plain dict that can be sent to the meter process."""
+    keys = {rule["threshold"][0] for rule in FAULT_RULES} | {rule["hold_minutes"][0] for rule in FAULT_RULES if "hold_minutes" in rule}
+    return {key: config[key] for key in keys if key in config}
+
+
+class SampleRing:
+    """
+    Single-writer, lock-free ring of meter samples in shared memory.
+
+    Every slot carries its own sequence number as a seqlock: the writer marks
+    the slot odd while filling it and even when done, and a reader keeps a
+    sample only when the sequence was even and unchanged around its read.
+    Readers never block the writer; one that falls more than RING_SLOTS
+    behind skips ahead and counts the samples it lost.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.written = HEADER.unpack_from(buffer, 0)[0]
+
+    # Writer side (meter process)
+    def publish(self, capture_time, connector_id, voltage, current, power, energy):
+        index = self.written % RING_SLOTS
+        offset = SLOTS_OFFSET + index * SLOT.size
+        sequence = 2 * (self.written // RING_SLOTS) + 2
+        struct.pack_into('<Q', self.buffer, offset, sequence - 1)
+        SLOT.pack_into(self.buffer, offset, sequence - 1, capture_time, connector_id, voltage, current, power, energy)
+        struct.pack_into('<Q', self.buffer, offset, sequence)
+        self.written += 1
+        struct.pack_into('<Q', self.buffer, 0, self.written)
+
+    def record_check(self, delay):
+        _, checks, total, worst = HEADER.unpack_from(self.buffer, 0)
+        HEADER.pack_into(self.buffer, 0, self.written, checks + 1, total + delay, max(worst, delay))
+
+    def control(self, connector_id):
+        return CONTROL.unpack_from(self.buffer, CONTROL_OFFSET + (connector_id - 1) * CONTROL.size)
+
+    def set_tripped(self, connector_id, tripped):
+        struct.pack_into('<B', self.buffer, CONTROL_OFFSET + (connector_id - 1) * CONTROL.size + 2, 1 if tripped else 0)
+
+
+class RingReader:
+    """main.py's side of a SampleRing: new samples since the last read, plus latency counters."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = HEADER.unpack_from(buffer, 0)[0]
+        self.lost = 0
+        self.torn = 0
+        self.latencies = []
+
+    def read(self, now=None):
+        """Samples written since the last call, as (capture_time, connector_id, voltage, current, power, energy)."""
+        written = struct.unpack_from('<Q', self.buffer, 0)[0]
+        if written - self.position > RING_SLOTS:
+            self.lost += written - self.position - RING_SLOTS
+            self.position = written - RING_SLOTS
+        samples = []
+        while self.position < written:
+            offset = SLOTS_OFFSET + (self.position % RING_SLOTS) * SLOT.size
+            expected = 2 * (self.position // RING_SLOTS) + 2
+            sample = SLOT.unpack_from(self.buffer, offset)
+            if sample[0] != expected or struct.unpack_from('<Q', self.buffer, offset)[0] != expected:
+                self.torn += 1  # Overwritten while we were reading it
+            else:
+                samples.append(sample[1:])
+            self.position += 1
+        if samples:
+            now = time.monotonic() if now is None else now
+            self.latencies.extend(now - sample[0] for sample in samples)
+        return samples
+
+    def set_control(self, connector_id, relay_state, in_transaction, current_limit):
+        offset = CONTROL_OFFSET + (connector_id - 1) * CONTROL.size
+        struct.pack_into('<BB', self.buffer, offset, relay_state, in_transaction)
+        struct.pack_into('<f', self.buffer, offset + 4, current_limit or 0.0)
+
+    def latency_stats(self, reset=True):
+        """End-to-end (capture to consumed) latency in ms, and the meter process's capture-to-fault-check delay."""
+        latencies = sorted(self.latencies)
+        _, checks, total, worst = HEADER.unpack_from(self.buffer, 0)
+        stats = {"samples": len(latencies), "lost": self.lost, "torn": self.torn,
+                 "check_mean_ms": total / checks * 1e3 if checks else 0.0, "check_max_ms": worst * 1e3}
+        if latencies:
+            stats.update(p50_ms=latencies[len(latencies) // 2] * 1e3, p99_ms=latencies[int(len(latencies) * 0.99)] * 1e3,
+                         max_ms=latencies[-1] * 1e3)
+        if reset:
+            self.latencies = []
+        return stats
+
+
+def _acquire(shm_name, connector_ids, relay_pins, config, cpu, meter_config, conn):
+    """Meter process main: read frames, integrate energy, check the fault rules and publish samples."""
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:meter_process:%(message)s')
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError as e:
+            logging.warning(f"Could not pin the meter process to CPU {cpu}: {e}")
+    try:
+        os.nice(-5)
+    except OSError:
+        pass  # Needs privileges; the dedicated core matters more
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        asyncio.run(_acquire_loop(SampleRing(shm.buf), connector_ids, relay_pins, config, meter_config, conn))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shm.close()
+
+
+async def _acquire_loop(ring, connector_ids, relay_pins, config, meter_config, conn):
+    parent = os.getppid()
+    evaluator = compile_rules(config)
+    # Trips switch the relay straight from here; pigpio lets every process drive the pins
+    relays = {connector_id: hal.create_relay(pin) for connector_id, pin in relay_pins.items()} if not hal.use_simulator() else {}
+    limiters = {connector_id: hal.create_current_limiter(connector_id) for connector_id in connector_ids} if hal.use_simulator() else {}
+
+    def relay_state(connector_id):
+        relay_on, _, tripped, _ = ring.control(connector_id)
+        return relay_on and not tripped
+
+    source = hal.create_meter_source(connector_ids, relay_state=relay_state, config=meter_config)
+    energy = {}
+    last_frame_time = {}
+    next_parent_check = time.monotonic() + PARENT_CHECK
+    try:
+        while True:
+            frame = await source.read_frame()
+            if not frame:
+                continue
+            capture = source.last_frame_time
+            while conn.poll():  # New thresholds apply from the next frame on
+                evaluator = compile_rules(conn.recv(), previous=evaluator)
+            for connector_id, values in frame.items():
+                if not 1 <= connector_id <= MAX_CONNECTORS:
+                    continue
+                relay_on, in_transaction, tripped, limit = ring.control(connector_id)
+                elapsed = capture - last_frame_time.get(connector_id, capture)
+                last_frame_time[connector_id] = capture
+                if source.energy_register:
+                    energy[connector_id] = values['energy']
+                else:
+                    energy[connector_id] = energy.get(connector_id, 0.0) + values['power'] * elapsed / 3600
+                for event, rule in evaluator.evaluate(connector_id, values['voltage'], values['current'], bool(in_transaction), capture):
+                    if event == TRIP and rule.status == 'Faulted' and relay_on and not tripped:
+                        if connector_id in relays:
+                            relays[connector_id].set(0)
+                        ring.set_tripped(connector_id, True)
+                        logging.warning(f"Fault rule {rule.name} tripped connector {connector_id}; relay opened")
+                ring.record_check(time.monotonic() - capture)
+                if tripped and not relay_on:
+                    ring.set_tripped(connector_id, False)  # main.py has switched the relay off too
+                if connector_id in limiters and limit > 0 and limiters[connector_id].limit != limit:
+                    limiters[connector_id].set_current_limit(limit)
+                ring.publish(capture, connector_id, values['voltage'], values['current'], values['power'], energy[connector_id])
+            if capture >= next_parent_check:
+                next_parent_check = capture + PARENT_CHECK
+                if os.getppid() != parent:
+                    logging.error("main.py has gone; meter process exiting")
+                    return
+    finally:
+        source.close()
+
+
+class MeterProcess:
+    """
+    Runs meter acquisition and the fault rules in a separate process pinned to
+    one core (MeterProcessCpu, -1 = the last core) and hands samples to
+    main.py through a SampleRing. Faulted trips open the relay from that
+    process; main.py still evaluates the same rules for statuses and
+    StopTransaction.
+    """
+
+    def __init__(self, connector_ids, relay_pins, config, cpu=-1):
+        self.connector_ids = list(connector_ids)
+        cpus = os.cpu_count() or 1
+        self.cpu = (cpus + cpu if cpu < 0 else cpu) if cpus > 1 else None
+        self.shm = shared_memory.SharedMemory(create=True, size=SHM_SIZE)
+        self.shm.buf[:SHM_SIZE] = bytes(SHM_SIZE)
+        context = multiprocessing.get_context('spawn')  # Never fork the pigpio socket or the event loop
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_acquire, name="meter", daemon=True,
+                                       args=(self.shm.name, self.connector_ids, {int(k): v for k, v in relay_pins.items()},
+                                             fault_config(config), self.cpu, hal.meter_config(config), child_conn))
+        self.process.start()
+        atexit.register(self.stop)
+        if self.cpu is not None and hasattr(os, 'sched_setaffinity'):
+            # Keep everything else in this process off the meter core
+            os.sched_setaffinity(0, set(range(cpus)) - {self.cpu})
+        logging.info(f"Meter process {self.process.pid} started" + (f" on CPU {self.cpu}" if self.cpu is not None else ""))
+
+    def reader(self):
+        return RingReader(self.shm.buf)
+
+    def update_config(self, config):
+        self.conn.send(fault_config(config))
+
+    def alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(2)
+        try:
+            self.shm.unlink()
+            self.shm.close()
+        except FileNotFoundError:
+            pass
+        except BufferError:
+            pass  # A RingReader still holds the buffer; it is unmapped when the process exits
+
+
+def benchmark(seconds=10.0, interval=0.005, stall=0.05, stall_every=0.5):
+    """
+    Frame latency while the event loop stalls for `stall` s every `stall_every`
+    s (an I2C write, a CSV rewrite): meter frames read on the loop against
+    frames read by the meter process and consumed from the ring.
+    """
+    config = {"VoltageRestrictions_min": 200, "VoltageRestrictions_max": 260, "CurrentRestrictions_max": 20,
+              "CurrentRestrictions_min": 0.3, "CurrentTimingRestrictions_duration_minutes": 2}
+    os.environ.setdefault(hal.HAL_BACKEND_ENV, 'sim')
+    os.environ[hal.SIM_METER_INTERVAL_ENV] = str(interval)
+    connector_ids = (1, 2, 3)
+
+    async def stall_loop():
+        while True:
+            await asyncio.sleep(stall_every)
+            time.sleep(stall)
+
+    def percentiles(delays):
+        delays = sorted(delays)
+        return (f"p50 {delays[len(delays) // 2] * 1e3:.2f} ms, p99 {delays[int(len(delays) * 0.99)] * 1e3:.2f} ms, "
+                f"max {delays[-1] * 1e3:.2f} ms over {len(delays)} samples")
+
+    async def in_loop():
+        evaluator = compile_rules(config)
+        source = hal.SimulatedMeterSource(connector_ids, relay_state=lambda connector_id: 1, interval=interval)
+        delays = []
+        staller = asyncio.create_task(stall_loop())
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for connector_id, values in (await source.read_frame()).items():
+                evaluator.evaluate(connector_id, values['voltage'], values['current'], True, source.last_frame_time)
+                delays.append(time.monotonic() - source.last_frame_time)
+        staller.cancel()
+        return delays
+
+    async def from_process(process):
+        reader = process.reader()
+        for connector_id in connector_ids:
+            reader.set_control(connector_id, 1, 1, 0.0)
+        staller = asyncio.create_task(stall_loop())
+        await asyncio.sleep(1.0)  # Spawn and imports
+        reader.read()
+        reader.latency_stats()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            reader.read()
+            await asyncio.sleep(CONSUMER_POLL)
+        staller.cancel()
+        return reader
+
+    delays = asyncio.run(in_loop())
+    print(f"meter frames on the event loop (frame to fault check): {percentiles(delays)}")
+    process = MeterProcess(connector_ids, {}, config)
+    try:
+        reader = asyncio.run(from_process(process))
+        latencies = reader.latencies
+        stats = reader.latency_stats(reset=False)
+    finally:
+        reader = None
+        process.stop()
+    print(f"meter process (frame to fault check): mean {stats['check_mean_ms']:.2f} ms, max {stats['check_max_ms']:.2f} ms")
+    print(f"meter process (frame to main.py, end to end): {percentiles(latencies)}, "
+          f"lost {stats['lost']}, torn {stats['torn']}")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,423 @@
+"""
+Metering MCU link protocol.
+
+The MCU boots sending legacy ASCII lines (`M<id>,V,I,P[,M<id>,...]`) at
+LEGACY_BAUD. main.py then offers binary frames at the fastest rate in
+BAUD_RATES up to MeterLinkBaud:
+
+    host -> BAUD_REQUEST(baud)      at LEGACY_BAUD
+    MCU  -> BAUD_ACK(baud or 0)     at LEGACY_BAUD, then switches if baud != 0
+    host -> PING                    at the new rate
+    MCU  -> PONG                    and streams SAMPLES frames from then on
+
+An MCU that hears no PING within MCU_REVERT_TIME goes back to ASCII at
+LEGACY_BAUD; one that never answers is legacy firmware and keeps ASCII.
+After LINK_SILENCE without a valid frame (an MCU reset) the host drops back
+to LEGACY_BAUD and negotiates again. The energy register in SAMPLES is the
+MCU's cumulative, non-volatile Wh count; ASCII lines have none and main.py
+integrates power instead.
+
+Frame: SYNC | length | seq u16 | type u8 | payload | CRC16/MODBUS u16, where
+length counts seq + type + payload and the CRC covers length..payload. All
+integers are little-endian.
+"""
+import asyncio
+import logging
+import os
+import re
+import struct
+import threading
+import time
+
+SYNC = b'\xa5\x5a'
+LEGACY_BAUD = 9600
+BAUD_RATES = (230400, 115200, 57600, 19200)  # Offered fastest first
+NEGOTIATION_TIMEOUT = 0.5  # Seconds to wait for BAUD_ACK / PONG
+PING_ATTEMPTS = 3
+MCU_REVERT_TIME = 1.0
+LINK_STATS_INTERVAL = 300  # Seconds between link error counter log lines
+LINK_SILENCE = 5.0  # Seconds without a valid binary frame before assuming the MCU restarted in ASCII mode
+MIN_CURRENT = 0.3  # Below this the MCU reading is noise
+
+TYPE_SAMPLES = 0x01
+TYPE_BAUD_REQUEST = 0x10
+TYPE_BAUD_ACK = 0x11
+TYPE_PING = 0x12
+TYPE_PONG = 0x13
+
+# Per connector in a SAMPLES payload: id, voltage (0.1 V), current (0.01 A), power (0.1 W), energy register (Wh)
+SAMPLE = struct.Struct('<BHhiI')
+HEADER = struct.Struct('<HB')  # seq, type
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data, crc=0xFFFF):
+    """CRC-16/MODBUS (poly 0x8005 reflected, init 0xFFFF)."""
+    for byte in data:
+        crc = (crc >> 8) ^ CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def encode_frame(kind, payload=b'', seq=0):
+    body = bytes((HEADER.size + len(payload),)) + HEADER.pack(seq & 0xFFFF, kind) + payload
+    return SYNC + body + struct.pack('<H', crc16(body))
+
+
+def encode_samples(samples):
+    """{connector_id: (voltage, current, power, energy_wh)} to a SAMPLES payload."""
+    return b''.join(SAMPLE.pack(connector_id, round(voltage * 10), round(current * 100), round(power * 10), int(energy))
+                    for connector_id, (voltage, current, power, energy) in samples.items())
+
+
+def decode_samples(payload):
+    result = {}
+    for offset in range(0, len(payload) - SAMPLE.size + 1, SAMPLE.size):
+        connector_id, voltage, current, power, energy = SAMPLE.unpack_from(payload, offset)
+        current /= 100
+        power /= 10
+        if current < MIN_CURRENT:
+            current = 0
+            power = 0
+        result[connector_id] = {'voltage': voltage / 10, 'current': current, 'power': power, 'energy': energy}
+    return result
+
+
+def parse_meter_line(line):
+    """`M<id>,V,I,P[,M<id>,...]` to {connector_id: {'voltage', 'current', 'power', 'energy'}}; raises ValueError/IndexError."""
+    result = {}
+    for part in re.split(r',(?=M)', line):
+        values = part.split(',')
+        if len(values) != 4:
+            raise ValueError(f"expected M<id>,V,I,P, got {part!r}")
+        key = int(values[0].replace('M', ''))
+        voltage = float(values[1])
+        current = float(values[2])
+        power = float(values[3])
+        if current < MIN_CURRENT:
+            current = 0
+            power = 0
+        result[key] = {'voltage': voltage, 'current': current, 'power': power, 'energy': 0}
+    return result
+
+
+class FrameDecoder:
+    """
+    Incremental frame parser: feed() it raw bytes, get back (seq, type,
+    payload) for every complete frame with a good CRC. Bad frames are
+    dropped by resyncing on the next SYNC; sequence gaps count as lost.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.last_seq = None
+        self.frames = 0
+        self.crc_errors = 0
+        self.lost = 0
+        self.skipped = 0  # Bytes outside any frame (ASCII during negotiation, line noise)
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        while True:
+            start = buffer.find(SYNC)
+            if start < 0:
+                keep = 1 if buffer[-1:] == SYNC[:1] else 0
+                self.skipped += len(buffer) - keep
+                del buffer[:len(buffer) - keep]
+                break
+            if start:
+                self.skipped += start
+                del buffer[:start]
+            if len(buffer) < 3:
+                break
+            length = buffer[2]
+            end = 3 + length + 2
+            if len(buffer) < end:
+                break
+            body = bytes(buffer[2:3 + length])
+            if length < HEADER.size or crc16(body) != buffer[end - 2] | buffer[end - 1] << 8:
+                self.crc_errors += 1
+                del buffer[:1]
+                continue
+            del buffer[:end]
+            seq, kind = HEADER.unpack_from(body, 1)
+            if self.last_seq is not None:
+                gap = (seq - self.last_seq - 1) & 0xFFFF
+                if gap < 0x8000:  # Anything larger is a repeat or an MCU restart, not loss
+                    self.lost += gap
+            self.last_seq = seq
+            self.frames += 1
+            frames.append((seq, kind, body[1 + HEADER.size:]))
+        return frames
+
+
+class MeterLink:
+    """
+    The host end of the MCU link on a pyserial/aioserial port: negotiates
+    binary frames on first use, then read_frame() returns one reading for
+    every connector, {connector_id: {'voltage', 'current', 'power', 'energy'}},
+    or None when nothing (valid) arrived within the port timeout.
+    """
+
+    def __init__(self, port, max_baud=LEGACY_BAUD):
+        self.port = port
+        self.max_baud = max_baud
+        self.binary = False
+        self.negotiated = False
+        self.decoder = FrameDecoder()
+        self.pending = []
+        self.seq = 0
+        self.lines = 0  # ASCII lines parsed
+        self.malformed = 0  # ASCII lines that failed to parse
+        self.last_frame_time = None
+        self.next_stats = time.monotonic() + LINK_STATS_INTERVAL
+
+    @property
+    def energy_register(self):
+        """Binary frames carry the MCU's own energy register; ASCII lines need power integrated on the host."""
+        return self.binary
+
+    async def _send(self, kind, payload=b''):
+        self.seq = (self.seq + 1) & 0xFFFF
+        await self.port.write_async(encode_frame(kind, payload, self.seq))
+
+    async def _await_frame(self, kind, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            data = await self.port.read_async(max(1, self.port.in_waiting))
+            for _, frame_kind, payload in self.decoder.feed(data):
+                if frame_kind == kind:
+                    return payload
+        return None
+
+    async def negotiate(self):
+        self.negotiated = True
+        rates = [baud for baud in BAUD_RATES if LEGACY_BAUD < baud <= self.max_baud]
+        if not rates:
+            return
+        timeout = self.port.timeout
+        self.port.timeout = 0.05
+        try:
+            for baud in rates:
+                await self._send(TYPE_BAUD_REQUEST, struct.pack('<I', baud))
+                ack = await self._await_frame(TYPE_BAUD_ACK, NEGOTIATION_TIMEOUT)
+                if ack is None:
+                    logging.info(f"Meter MCU did not answer the binary protocol offer; using ASCII at {LEGACY_BAUD} baud")
+                    return
+                if struct.unpack('<I', ack)[0] != baud:
+                    continue
+                self.port.baudrate = baud
+                for _ in range(PING_ATTEMPTS):
+                    await self._send(TYPE_PING)
+                    if await self._await_frame(TYPE_PONG, NEGOTIATION_TIMEOUT) is not None:
+                        self.binary = True
+                        self.last_frame_time = time.monotonic()
+                        logging.info(f"Meter link: binary frames at {baud} baud")
+                        return
+                logging.warning(f"Meter MCU accepted {baud} baud but did not answer there; trying lower")
+                self.port.baudrate = LEGACY_BAUD
+                await asyncio.sleep(MCU_REVERT_TIME)
+            logging.info(f"Meter link: no faster rate worked; using ASCII at {LEGACY_BAUD} baud")
+        finally:
+            self.port.timeout = timeout
+            self.decoder = FrameDecoder()  # Counters start with the data stream, not the negotiation noise
+
+    async def read_frame(self):
+        if not self.negotiated:
+            await self.negotiate()
+        now = time.monotonic()
+        if now >= self.next_stats:
+            self.next_stats = now + LINK_STATS_INTERVAL
+            self.log_stats()
+        if not self.binary:
+            line = (await self.port.readline_async()).decode('utf-8', errors='replace').strip()
+            if not line:
+                return None
+            self.last_frame_time = time.monotonic()
+            try:
+                frame = parse_meter_line(line)
+            except (ValueError, IndexError) as e:
+                self.malformed += 1
+                logging.warning(f"Discarding malformed meter frame {line!r}: {e}")
+                return None
+            self.lines += 1
+            return frame
+        while not self.pending:
+            if time.monotonic() - (self.last_frame_time or now) > LINK_SILENCE:
+                logging.warning(f"No valid meter frame for {LINK_SILENCE:.0f}s; renegotiating the meter link")
+                self.log_stats()
+                self.binary = self.negotiated = False
+                self.last_frame_time = None
+                self.port.baudrate = LEGACY_BAUD
+                return None
+            data = await self.port.read_async(max(1, self.port.in_waiting))
+            if not data:
+                return None
+            self.pending = [payload for _, kind, payload in self.decoder.feed(data) if kind == TYPE_SAMPLES]
+        self.last_frame_time = time.monotonic()
+        return decode_samples(self.pending.pop(0))
+
+    def stats(self):
+        return {"mode": f"binary@{self.port.baudrate}" if self.binary else f"ascii@{LEGACY_BAUD}",
+                "frames": self.decoder.frames + self.lines, "crc_errors": self.decoder.crc_errors, "lost": self.decoder.lost,
+                "malformed": self.malformed}
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Meter link {stats['mode']}: {stats['frames']} frames, {stats['crc_errors']} CRC errors, "
+                     f"{stats['lost']} lost, {stats['malformed']} malformed lines")
+
+
+class McuEmulator(threading.Thread):
+    """
+    The MCU end of the link, on the master side of a pty, for the benchmark:
+    streams readings for `connector_ids` (ASCII until a binary rate is
+    negotiated, or always with binary=False), optionally flipping random bytes.
+    """
+
+    def __init__(self, fd, connector_ids=(1, 2, 3), binary=True, max_baud=115200, interval=0.0, frames=None,
+                 corrupt_rate=0.0, seed=1):
+        super().__init__(daemon=True)
+        import random
+        self.fd = fd
+        self.connector_ids = connector_ids
+        self.supports_binary = binary
+        self.max_baud = max_baud
+        self.interval = interval
+        self.frames = frames
+        self.corrupt_rate = corrupt_rate
+        self.random = random.Random(seed)
+        self.mode = 'ascii'
+        self.sent = 0
+        self.stopped = threading.Event()
+
+    def truth(self, connector_id):
+        return 230.0 + connector_id, 16.0, 3680.0 + connector_id
+
+    def corrupt(self, data):
+        if not self.corrupt_rate:
+            return data
+        data = bytearray(data)
+        for index in range(len(data)):
+            if self.random.random() < self.corrupt_rate:
+                data[index] ^= 1 << self.random.randrange(8)
+        return bytes(data)
+
+    def write(self, data):
+        """Write all of data, waiting while the host is not reading, unless stopped meanwhile."""
+        while data and not self.stopped.is_set():
+            try:
+                data = data[os.write(self.fd, data):]
+            except BlockingIOError:
+                time.sleep(0.001)
+
+    def run(self):
+        import select
+        os.set_blocking(self.fd, False)
+        decoder = FrameDecoder()
+        seq = 0
+        acked_at = None
+        while not self.stopped.is_set() and (self.frames is None or self.sent < self.frames):
+            if select.select([self.fd], [], [], 0)[0]:
+                for _, kind, payload in decoder.feed(os.read(self.fd, 4096)):
+                    if not self.supports_binary:
+                        continue
+                    if kind == TYPE_BAUD_REQUEST:
+                        baud = struct.unpack('<I', payload)[0]
+                        seq += 1
+                        self.write(encode_frame(TYPE_BAUD_ACK, struct.pack('<I', baud if baud <= self.max_baud else 0), seq))
+                        if baud <= self.max_baud:
+                            self.mode, acked_at = 'waiting', time.monotonic()
+                    elif kind == TYPE_PING and self.mode in ('waiting', 'binary'):
+                        seq += 1
+                        self.write(encode_frame(TYPE_PONG, b'', seq))
+                        self.mode = 'binary'
+            if self.mode == 'waiting':
+                if time.monotonic() - acked_at > MCU_REVERT_TIME:
+                    self.mode = 'ascii'
+                time.sleep(0.001)
+                continue
+            if self.mode == 'binary':
+                seq += 1
+                data = encode_frame(TYPE_SAMPLES, encode_samples(
+                    {connector_id: self.truth(connector_id) + (self.sent,) for connector_id in self.connector_ids}), seq)
+            else:
+                data = (','.join(f"M{connector_id},{voltage:.1f},{current:.2f},{power:.1f}" for connector_id in self.connector_ids
+                                 for voltage, current, power in (self.truth(connector_id),)) + "\n").encode()
+            self.write(self.corrupt(data))
+            self.sent += 1
+            if self.interval:
+                time.sleep(self.interval)
+
+
+def benchmark(frames=20000, corrupt_rate=0.001):
+    """Link capacity per format, decode throughput and corruption handling over a pty pair."""
+    import aioserial
+
+    def open_pair():
+        master, slave = os.openpty()
+        port = aioserial.AioSerial(port=os.ttyname(slave), baudrate=LEGACY_BAUD, timeout=0.2)
+        os.close(slave)
+        return master, port
+
+    def bad_readings(frame, emulator):
+        return sum(1 for connector_id, values in frame.items()
+                   if connector_id not in emulator.connector_ids
+                   or (values['voltage'], values['current'], values['power']) != emulator.truth(connector_id))
+
+    async def run(binary, count, corrupt=0.0):
+        master, port = open_pair()
+        emulator = McuEmulator(master, binary=binary, corrupt_rate=corrupt)
+        emulator.start()
+        link = MeterLink(port, max_baud=115200)
+        started = time.perf_counter()
+        await link.negotiate()
+        negotiation = time.perf_counter() - started
+        received = bad = 0
+        started = time.perf_counter()
+        while received < count and time.perf_counter() - started < 60:
+            frame = await link.read_frame()
+            if frame is not None:
+                received += 1
+                bad += bad_readings(frame, emulator)
+        elapsed = time.perf_counter() - started
+        emulator.stopped.set()
+        emulator.join()
+        port.close()
+        os.close(master)
+        return link, negotiation, received, bad, elapsed
+
+    line = ','.join(f"M{connector_id},230.0,16.00,3680.0" for connector_id in (1, 2, 3)) + "\n"
+    frame = encode_frame(TYPE_SAMPLES, encode_samples({connector_id: (230.0, 16.0, 3680.0, 0) for connector_id in (1, 2, 3)}))
+    print(f"3 connectors: ASCII line {len(line)} bytes, binary frame {len(frame)} bytes")
+    for label, size, baud in (("ASCII", len(line), LEGACY_BAUD), ("binary", len(frame), LEGACY_BAUD),
+                              ("binary", len(frame), 115200), ("binary", len(frame), 230400)):
+        print(f"  {label:6s} at {baud:6d} baud: at most {baud / 10 / size:6.0f} frames/s")
+
+    for binary in (False, True):
+        link, negotiation, received, bad, elapsed = asyncio.run(run(binary, frames))
+        print(f"pty, MCU {'with' if binary else 'without'} binary support: negotiated {link.stats()['mode']} in {negotiation:.2f}s, "
+              f"decoded {received / elapsed:.0f} frames/s ({elapsed / received * 1e6:.0f} us/frame)")
+    logging.disable(logging.WARNING)  # One line per malformed ASCII frame otherwise
+    for binary in (False, True):
+        link, _, received, bad, _ = asyncio.run(run(binary, frames, corrupt_rate))
+        stats = link.stats()
+        print(f"pty, {corrupt_rate:g} of bytes corrupted, {stats['mode']}: {received} frames accepted, {bad} wrong readings accepted, "
+              f"{stats['crc_errors']} CRC errors, {stats['lost']} lost, {stats['malformed']} malformed lines")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import math
+import time
+
+DUE_TOLERANCE = 0.05  # Seconds; deadlines this close together are served by one pass
+IDLE_RECHECK = 5.0  # Seconds between config re-checks while both streams are disabled
+
+
+def next_aligned_boundary(wall_now, interval):
+    """Next wall-clock time that is a whole multiple of `interval` seconds past midnight UTC."""
+    return math.floor(wall_now / interval + 1e-9) * interval + interval
+
+
+class MeterScheduler:
+    """
+    One sampling loop for both MeterValues streams.
+
+    Periodic sampling (MeterValueSampleInterval) runs on monotonic deadlines
+    that advance by exactly one interval per pass, so the work done in a pass
+    never shifts later passes. Clock-aligned sampling (ClockAlignedDataInterval)
+    fires on wall-clock boundaries (e.g. :00, :15, :30, :45 for 900 s); the
+    boundary is re-derived from the wall clock every pass, so NTP steps are
+    followed. When both are due together a single pass serves both.
+
+    `sample(periodic, aligned_timestamp)` is awaited once per pass with
+    `periodic` True when the periodic stream is due and `aligned_timestamp`
+    set to the wall-clock boundary (or None) when the aligned stream is due.
+    """
+
+    def __init__(self, sample_interval, aligned_interval, sample):
+        self.sample_interval = sample_interval
+        self.aligned_interval = aligned_interval
+        self.sample = sample
+        self.next_periodic = None
+        self.passes = 0
+
+    def _deadlines(self):
+        mono_now = time.monotonic()
+        wall_now = time.time()
+        sample_interval = self.sample_interval()
+        aligned_interval = self.aligned_interval()
+
+        periodic_deadline = None
+        if sample_interval and sample_interval > 0:
+            if self.next_periodic is None:
+                self.next_periodic = mono_now + sample_interval
+            elif self.next_periodic < mono_now - sample_interval:
+                # Fell more than one interval behind (e.g. suspended); skip missed passes
+                self.next_periodic = mono_now
+            periodic_deadline = self.next_periodic
+        else:
+            self.next_periodic = None
+
+        aligned_deadline = aligned_boundary = None
+        if aligned_interval and aligned_interval > 0:
+            aligned_boundary = next_aligned_boundary(wall_now, aligned_interval)
+            aligned_deadline = mono_now + (aligned_boundary - wall_now)
+        return periodic_deadline, aligned_deadline, aligned_boundary
+
+    async def run(self):
+        while True:
+            periodic_deadline, aligned_deadline, aligned_boundary = self._deadlines()
+            deadlines = [deadline for deadline in (periodic_deadline, aligned_deadline) if deadline is not None]
+            if not deadlines:
+                await asyncio.sleep(IDLE_RECHECK)
+                continue
+            wake_at = min(deadlines)
+            delay = wake_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            periodic_due = periodic_deadline is not None and periodic_deadline <= wake_at + DUE_TOLERANCE
+            aligned_due = aligned_deadline is not None and aligned_deadline <= wake_at + DUE_TOLERANCE
+            if periodic_due:
+                self.next_periodic = periodic_deadline + self.sample_interval()
+            self.passes += 1
+            try:
+                await self.sample(periodic_due, aligned_boundary if aligned_due else None)
+            except Exception as e:
+                logging.error(f"Meter sampling pass failed: {e}")
+            if aligned_due:
+                # Do not fire the same boundary twice if the pass finished early
+                remaining = aligned_boundary - time.time()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
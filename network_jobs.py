@@ -0,0 +1,131 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+MAX_FINISHED_JOBS = 50  # Finished jobs kept around for status queries
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class NetworkJob:
+    def __init__(self, job_id, name, function, args, kwargs):
+        self.id = job_id
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.message = ''
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name, "status": self.status, "message": self.message,
+                "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at}
+
+
+class NetworkJobRunner:
+    """
+    Runs network operations (nmcli hotspot/Wi-Fi changes) one at a time on a
+    single background worker. Web requests and the provisioning button both
+    submit here, so they can never reconfigure wlan0 concurrently.
+
+    Job functions receive the job's cancel event as the `cancel_event` keyword
+    and should check it between slow steps. Their boolean result decides
+    whether the job succeeded.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.jobs = OrderedDict()
+        self.ids = itertools.count(1)
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._worker, daemon=True)
+            self.thread.start()
+        return self
+
+    def submit(self, name, function, *args, **kwargs):
+        with self.condition:
+            job = NetworkJob(str(next(self.ids)), name, function, args, kwargs)
+            self.jobs[job.id] = job
+            self._prune()
+            self.condition.notify_all()
+        self.queue.put(job)
+        logging.info(f"Network job {job.id} ({name}) queued.")
+        return job
+
+    def get(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list(self):
+        with self.condition:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def cancel(self, job_id):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return False
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                self._finish(job, CANCELLED, 'Cancelled before start.')
+            return True
+
+    def wait_for_update(self, job_id, last_seen, timeout):
+        """Block until the job differs from `last_seen` (a to_dict result) or the timeout expires."""
+        with self.condition:
+            self.condition.wait_for(lambda: job_id not in self.jobs or self.jobs[job_id].to_dict() != last_seen, timeout)
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def _finish(self, job, status, message):
+        job.status = status
+        job.message = message
+        job.finished_at = time.time()
+        self.condition.notify_all()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            with self.condition:
+                if job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+                job.started_at = time.time()
+                self.condition.notify_all()
+            logging.info(f"Network job {job.id} ({job.name}) started.")
+            try:
+                result = job.function(*job.args, cancel_event=job.cancel_event, **job.kwargs)
+                if job.cancel_event.is_set():
+                    status, message = CANCELLED, 'Cancelled.'
+                elif result:
+                    status, message = SUCCEEDED, 'Completed.'
+                else:
+                    status, message = FAILED, 'Operation failed, see logs.'
+            except Exception as e:
+                logging.error(f"Network job {job.id} ({job.name}) raised: {e}")
+                status, message = FAILED, str(e)
+            with self.condition:
+                self._finish(job, status, message)
+            logging.info(f"Network job {job.id} ({job.name}) {status}.")
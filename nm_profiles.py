@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+# NetworkManager helpers shared by webserver.py and create_hotspot.py.
+# Connection profiles are created once and then brought up by name, which lets
+# NetworkManager swap wlan0 between hotspot and station mode in one step
+# instead of disconnect + rescan + connect-by-SSID.
+
+NMCLI = 'nmcli'  # Resolved through PATH, so tests can put a stub nmcli first
+WIFI_INTERFACE = 'wlan0'
+STATION_PROFILE_PREFIX = 'JP-Station-'
+HOTSPOT_PROFILE_NAME = 'Joulepoint-Charger-Hotspot'
+PROFILE_STATE_FILE = 'nm_profiles.json'  # Password fingerprints of profiles we created
+NMCLI_TIMEOUT = 45  # Seconds
+STATE_CACHE_SECONDS = 2  # Reuse `nmcli con show` output for this long
+SCAN_CACHE_SECONDS = 60  # Only rescan when the last scan is older than this
+
+_lock = threading.RLock()
+_cache = {}
+last_switch = {}
+
+
+def run_nmcli(*args, check=True):
+    return subprocess.run([NMCLI, *args], check=check, capture_output=True, text=True, timeout=NMCLI_TIMEOUT)
+
+
+def _cached(key, max_age, loader):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry[0] < max_age:
+            return entry[1]
+        value = loader()
+        _cache[key] = (time.monotonic(), value)
+        return value
+
+
+def invalidate(*keys):
+    with _lock:
+        for key in keys or list(_cache):
+            _cache.pop(key, None)
+
+
+def _split_terse(line):
+    # nmcli -t escapes ':' inside fields as '\:'
+    fields, current, escaped = [], '', False
+    for char in line:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == ':':
+            fields.append(current)
+            current = ''
+        else:
+            current += char
+    fields.append(current)
+    return fields
+
+
+def saved_profiles():
+    def load():
+        result = run_nmcli('-t', '-f', 'NAME,TYPE', 'connection', 'show')
+        return {_split_terse(line)[0] for line in result.stdout.splitlines() if line}
+    return _cached('profiles', STATE_CACHE_SECONDS, load)
+
+
+def active_profiles():
+    def load():
+        result = run_nmcli('-t', '-f', 'NAME,DEVICE', 'connection', 'show', '--active')
+        return {fields[0] for fields in map(_split_terse, result.stdout.splitlines()) if len(fields) > 1 and fields[1] == WIFI_INTERFACE}
+    return _cached('active', STATE_CACHE_SECONDS, load)
+
+
+def visible_ssids(max_age=SCAN_CACHE_SECONDS):
+    """SSIDs from the last scan; a rescan is only requested once the cached result is older than max_age."""
+    def load():
+        result = run_nmcli('-t', '-f', 'SSID', 'device', 'wifi', 'list', 'ifname', WIFI_INTERFACE, '--rescan', 'yes')
+        return {line.replace('\\:', ':') for line in result.stdout.splitlines() if line}
+    return _cached('scan', max_age, load)
+
+
+def current_mode():
+    active = active_profiles()
+    if HOTSPOT_PROFILE_NAME in active:
+        return 'hotspot'
+    if any(name.startswith(STATION_PROFILE_PREFIX) for name in active):
+        return 'station'
+    return None
+
+
+def _load_state():
+    try:
+        with open(PROFILE_STATE_FILE, 'r') as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return {}
+
+
+def _save_state(state):
+    temp_file = f'{PROFILE_STATE_FILE}.tmp'
+    with open(temp_file, 'w') as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_file, PROFILE_STATE_FILE)
+
+
+def _fingerprint(ssid, password):
+    return hashlib.sha256(f'{ssid}\0{password}'.encode('utf-8')).hexdigest()
+
+
+def _ensure_profile(name, ssid, password, extra_settings):
+    with _lock:
+        state = _load_state()
+        fingerprint = _fingerprint(ssid, password)
+        settings = ['802-11-wireless.ssid', ssid, 'wifi-sec.key-mgmt', 'wpa-psk', 'wifi-sec.psk', password, *extra_settings]
+        if name not in saved_profiles():
+            run_nmcli('connection', 'add', 'type', 'wifi', 'ifname', WIFI_INTERFACE, 'con-name', name, *settings)
+            logging.info(f"Created NetworkManager profile {name}.")
+        elif state.get(name) != fingerprint:
+            run_nmcli('connection', 'modify', name, *settings)
+            logging.info(f"Updated NetworkManager profile {name}.")
+        else:
+            return name
+        state[name] = fingerprint
+        _save_state(state)
+        invalidate('profiles')
+        return name
+
+
+def ensure_station_profile(ssid, password):
+    return _ensure_profile(f'{STATION_PROFILE_PREFIX}{ssid}', ssid, password,
+                           ['connection.autoconnect', 'yes'])
+
+
+def ensure_hotspot_profile(ssid, password):
+    return _ensure_profile(HOTSPOT_PROFILE_NAME, ssid, password,
+                           ['connection.autoconnect', 'no', '802-11-wireless.mode', 'ap',
+                            '802-11-wireless.band', 'bg', 'ipv4.method', 'shared'])
+
+
+def activate(profile):
+    """Bring a saved profile up on wlan0 and record how long the switch took."""
+    with _lock:
+        previous = current_mode()
+        started = time.monotonic()
+        try:
+            run_nmcli('connection', 'up', profile, 'ifname', WIFI_INTERFACE)
+        finally:
+            invalidate('active')
+        elapsed = time.monotonic() - started
+        last_switch.update({"from": previous, "to": profile, "seconds": round(elapsed, 3), "at": time.time()})
+        logging.info(f"Switched wlan0 from {previous} to {profile} in {elapsed:.2f}s.")
+        return elapsed
+
+
+def switch_to_hotspot(ssid, password):
+    with _lock:
+        if current_mode() == 'hotspot':
+            logging.info("Hotspot already active.")
+            return True
+        try:
+            activate(ensure_hotspot_profile(ssid, password))
+            return True
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(f"Failed to start hotspot: {getattr(e, 'stderr', e)}")
+            return False
+
+
+def switch_to_station(ssid, password, attempts=3, retry_delay=5, cancel_event=None):
+    with _lock:
+        try:
+            profile = ensure_station_profile(ssid, password)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(f"Failed to prepare WiFi profile for {ssid}: {getattr(e, 'stderr', e)}")
+            return False
+        if profile in active_profiles():
+            logging.info(f"Already connected to {ssid}.")
+            return True
+        for attempt in range(attempts):
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+            try:
+                activate(profile)
+                return True
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                logging.warning(f"Attempt {attempt + 1}: failed to bring up {profile}: {getattr(e, 'stderr', e)}")
+            try:
+                # Refresh the scan only when the cached one is stale or does not list the network
+                if ssid not in visible_ssids():
+                    invalidate('scan')
+                    visible_ssids()
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+                pass
+            if cancel_event is not None:
+                if cancel_event.wait(retry_delay):
+                    return False
+            else:
+                time.sleep(retry_delay)
+        return False
+
+
+def deactivate(profile):
+    with _lock:
+        if profile not in active_profiles():
+            return True
+        try:
+            run_nmcli('connection', 'down', profile)
+            return True
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            logging.error(f"Failed to bring down {profile}: {getattr(e, 'stderr', e)}")
+            return False
+        finally:
+            invalidate('active')
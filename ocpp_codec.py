@@ -0,0 +1,199 @@
+import asyncio
+import decimal
+import json
+import logging
+import time
+from dataclasses import asdict
+
+from ocpp.charge_point import camel_to_snake_case, remove_nones, snake_to_camel_case
+from ocpp.exceptions import FormatViolationError, OCPPError, PropertyConstraintViolationError, ProtocolError
+from ocpp.messages import Call, CallError, CallResult, MessageType, validate_payload
+from ocpp.v16 import ChargePoint as cp
+
+try:
+    import orjson
+except ImportError:  # The stdlib json module produces the same frames, just slower
+    orjson = None
+
+# Outbound actions whose payloads we build ourselves; once SELF_TEST_MESSAGES of
+# them have passed schema validation, later ones are sent without it.
+TRUSTED_OUTBOUND = frozenset({"Heartbeat", "MeterValues", "StatusNotification"})
+SELF_TEST_MESSAGES = 5
+
+CODEC = 'orjson' if orjson is not None else 'json'
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, default=_default).decode('utf-8')
+
+    loads = orjson.loads
+    DecodeError = orjson.JSONDecodeError
+else:
+    def dumps(value):
+        return json.dumps(value, separators=(',', ':'), default=_default)
+
+    loads = json.loads
+    DecodeError = json.JSONDecodeError
+
+
+def unpack(raw):
+    """ocpp.messages.unpack with the codec's parser: a Call, CallResult or CallError."""
+    try:
+        message = loads(raw)
+    except DecodeError:
+        raise FormatViolationError(details={"cause": "Message is not valid JSON", "ocpp_message": raw})
+    if not isinstance(message, list):
+        raise ProtocolError(details={"cause": f"OCPP message hasn't the correct format. It should be a list, but got '{type(message)}' instead"})
+    for cls in (Call, CallResult, CallError):
+        try:
+            if message[0] == cls.message_type_id:
+                return cls(*message[1:])
+        except IndexError:
+            raise ProtocolError(details={"cause": "Message does not contain MessageTypeId"})
+        except TypeError:
+            raise ProtocolError(details={"cause": "Message is missing elements."})
+    raise PropertyConstraintViolationError(details={"cause": f"MessageTypeId '{message[0]}' isn't valid"})
+
+
+class OutboundValidation:
+    """
+    Validates outbound payloads, except for trusted actions that have already
+    passed SELF_TEST_MESSAGES validations in a row. An action that ever fails
+    is validated for the rest of the process.
+    """
+
+    def __init__(self, trusted=TRUSTED_OUTBOUND, self_test_messages=SELF_TEST_MESSAGES):
+        self.trusted = set(trusted)
+        self.self_test_messages = self_test_messages
+        self.passed = {}
+        self.skipped = 0
+
+    def validate(self, message, ocpp_version):
+        action = message.action
+        if self.passed.get(action, 0) >= self.self_test_messages:
+            self.skipped += 1
+            return
+        try:
+            validate_payload(message, ocpp_version)
+        except OCPPError:
+            if action in self.trusted:
+                logging.error(f"Outbound {action} failed schema validation; it will always be validated from now on.")
+                self.trusted.discard(action)
+                self.passed.pop(action, None)
+            raise
+        if action in self.trusted:
+            self.passed[action] = self.passed.get(action, 0) + 1
+            if self.passed[action] == self.self_test_messages:
+                logging.info(f"Outbound {action} passed its schema self-test; skipping validation from now on.")
+
+
+class CodecChargePoint(cp):
+    """
+    ChargePoint that encodes and decodes OCPP-J frames with the fastest JSON
+    codec available and skips validation for trusted outbound payloads.
+    Inbound Calls and every CallResult are still validated by the library.
+    Also counts the OCPP bytes in each direction and when a frame was last sent.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbound_validation = OutboundValidation()
+        self.last_sent = time.monotonic()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    async def _send(self, message):
+        self.bytes_sent += len(message.encode('utf-8'))
+        self.last_sent = time.monotonic()
+        await super()._send(message)
+
+    async def route_message(self, raw_msg):
+        self.bytes_received += len(raw_msg)
+        try:
+            msg = unpack(raw_msg)
+        except OCPPError as e:
+            logging.exception(f"Unable to parse message: '{raw_msg}', it doesn't seem to be valid OCPP: {e}")
+            return
+        if msg.message_type_id == MessageType.Call:
+            try:
+                await self._handle_call(msg)
+            except OCPPError as error:
+                logging.exception(f"Error while handling request '{msg}'")
+                await self._send(msg.create_call_error(error).to_json())
+        elif msg.message_type_id in (MessageType.CallResult, MessageType.CallError):
+            self._response_queue.put_nowait(msg)
+
+    async def call(self, payload, suppress=True, unique_id=None):
+        """Same contract as ocpp.charge_point.ChargePoint.call."""
+        call = Call(unique_id=unique_id if unique_id is not None else str(self._unique_id_generator()),
+                    action=payload.__class__.__name__[:-7],
+                    payload=remove_nones(snake_to_camel_case(asdict(payload))))
+        self.outbound_validation.validate(call, self._ocpp_version)
+        frame = dumps([call.message_type_id, call.unique_id, call.action, call.payload])
+
+        # Only one Call may be outstanding at a time
+        async with self._call_lock:
+            await self._send(frame)
+            try:
+                response = await self._get_specific_response(call.unique_id, self._response_timeout)
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(f"Waited {self._response_timeout}s for response on {frame}.")
+
+        if response.message_type_id == MessageType.CallError:
+            logging.warning(f"Received a CALLError: {response}'")
+            if suppress:
+                return
+            raise response.to_exception()
+        response.action = call.action
+        validate_payload(response, self._ocpp_version)
+        cls = getattr(self._call_result, payload.__class__.__name__)
+        return cls(**camel_to_snake_case(response.payload))
+
+
+def benchmark(rounds=2000):
+    """Encode + validate cost per message type: library path against the codec path."""
+    from ocpp.v16 import call
+    from ocpp_schemas import prewarm
+
+    prewarm()
+    sampled_value = [{"value": "12345.6", "context": "Sample.Periodic", "format": "Raw",
+                      "measurand": "Energy.Active.Import.Register", "location": "EV", "unit": "Wh"},
+                     {"value": "16.02", "context": "Sample.Periodic", "format": "Raw", "measurand": "Current.Import", "unit": "A"}]
+    payloads = {
+        "BootNotification": call.BootNotificationPayload(charge_point_model="BharatAC", charge_point_vendor="Chinmoy"),
+        "Heartbeat": call.HeartbeatPayload(),
+        "StatusNotification": call.StatusNotificationPayload(connector_id=1, error_code="NoError", status="Charging"),
+        "MeterValues x10": call.MeterValuesPayload(connector_id=1, transaction_id=1001, meter_value=[
+            {"timestamp": f"2024-01-01T00:{minute:02d}:00", "sampled_value": sampled_value} for minute in range(10)]),
+    }
+    print(f"codec: {CODEC}")
+    for name, payload in payloads.items():
+        action = payload.__class__.__name__[:-7]
+        started = time.perf_counter()
+        for index in range(rounds):
+            message = Call(unique_id=str(index), action=action, payload=remove_nones(snake_to_camel_case(asdict(payload))))
+            validate_payload(message, "1.6")
+            library_frame = message.to_json()
+        library = (time.perf_counter() - started) / rounds
+
+        validation = OutboundValidation()
+        started = time.perf_counter()
+        for index in range(rounds):
+            message = Call(unique_id=str(index), action=action, payload=remove_nones(snake_to_camel_case(asdict(payload))))
+            validation.validate(message, "1.6")
+            frame = dumps([message.message_type_id, message.unique_id, message.action, message.payload])
+        codec = (time.perf_counter() - started) / rounds
+        assert loads(frame) == json.loads(library_frame)
+        print(f"{name:20s} library {library * 1e6:7.1f} us  codec {codec * 1e6:7.1f} us  "
+              f"({library / codec:.1f}x, validation {'skipped' if validation.skipped else 'kept'}, {len(frame)} bytes)")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,108 @@
+import decimal
+import json
+import logging
+import os
+import time
+
+SCHEMA_CACHE_FILE = "ocpp_schema_cache.json"
+OCPP_VERSION = "1.6"
+# Schemas needed before the first BootNotification is answered, warmed first
+BOOT_SCHEMAS = ("BootNotification", "BootNotificationResponse", "StatusNotification", "StatusNotificationResponse",
+                "Heartbeat", "HeartbeatResponse")
+# ocpp.messages.validate_payload parses these with Decimal floats, so their schemas must be too
+DECIMAL_SCHEMAS = {"SetChargingProfile", "RemoteStartTransaction", "GetCompositeScheduleResponse"}
+
+
+def library_version():
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return version("ocpp")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def schema_dir():
+    import ocpp.messages
+    return os.path.join(os.path.dirname(os.path.realpath(ocpp.messages.__file__)), "v16", "schemas")
+
+
+def read_schema_files():
+    texts = {}
+    directory = schema_dir()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), "r", encoding="utf-8-sig") as file:
+                texts[name[:-5]] = file.read()
+    return texts
+
+
+def load_schema_texts(cache_file=SCHEMA_CACHE_FILE):
+    """
+    All OCPP 1.6 schema texts by name. They are bundled into one cache file
+    the first time, so later starts read one file instead of ~80; the bundle
+    is rebuilt whenever the installed ocpp version changes.
+    """
+    version = library_version()
+    try:
+        with open(cache_file, "r") as file:
+            cached = json.load(file)
+        if cached.get("ocpp_version") == version:
+            return cached["schemas"]
+    except FileNotFoundError:
+        pass
+    except (IOError, ValueError, KeyError) as e:
+        logging.warning(f"Ignoring OCPP schema cache {cache_file}: {e}")
+    texts = read_schema_files()
+    temp_file = f"{cache_file}.tmp"
+    try:
+        with open(temp_file, "w") as file:
+            json.dump({"ocpp_version": version, "schemas": texts}, file)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        logging.warning(f"Could not write OCPP schema cache {cache_file}: {e}")
+    return texts
+
+
+def prewarm(names=None, cache_file=SCHEMA_CACHE_FILE):
+    """
+    Build the Draft4Validators the ocpp library would otherwise create on the
+    first message of each type, and place them in its validator cache.
+    Returns the number of validators built.
+    """
+    from jsonschema import Draft4Validator
+    from ocpp.messages import _validators
+
+    texts = load_schema_texts(cache_file)
+    built = 0
+    for name in (names if names is not None else texts):
+        text = texts.get(name)
+        cache_key = name + "_" + OCPP_VERSION
+        if text is None or cache_key in _validators:
+            continue
+        parse_float = decimal.Decimal if name in DECIMAL_SCHEMAS else float
+        _validators[cache_key] = Draft4Validator(json.loads(text, parse_float=parse_float))
+        built += 1
+    return built
+
+
+def benchmark(rounds=20):
+    """Time building every validator from the schema files against the bundled cache."""
+    import tempfile
+    from ocpp.messages import _validators
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache_file = os.path.join(directory, SCHEMA_CACHE_FILE)
+        for label, setup in (("schema files + writing the cache", lambda: os.path.exists(cache_file) and os.remove(cache_file)),
+                             ("bundled cache", lambda: None)):
+            elapsed = 0.0
+            for _ in range(rounds):
+                setup()
+                _validators.clear()
+                started = time.perf_counter()
+                count = prewarm(cache_file=cache_file)
+                elapsed += time.perf_counter() - started
+            print(f"{label}: {count} validators in {elapsed / rounds * 1e3:.1f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
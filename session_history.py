@@ -0,0 +1,236 @@
+import logging
+import os
+import struct
+import time
+import zlib
+from array import array
+
+HISTORY_DIR = "session_history"
+MEMORY_CAP = 512  # Samples per series kept in RAM; older samples are spilled to disk
+STOP_TXN_MAX_ENTRIES = 200  # transactionData entries sent with StopTransaction at most
+SCALE = 100  # Values are stored as fixed-point hundredths (0.01 V / A / W / Wh)
+
+# Measurands the history can record, and the meter field each one reads
+MEASURAND_FIELDS = {
+    "Energy.Active.Import.Register": "energy",
+    "Voltage": "voltage",
+    "Current.Import": "current",
+    "Power.Active.Import": "power",
+}
+
+CHUNK_HEADER = struct.Struct('<II')  # sample count, compressed length
+
+
+class SampleSeries:
+    """
+    Samples of one context (Sample.Periodic or Sample.Clock) for one session.
+
+    Time offsets and fixed-point values are stored as deltas from the previous
+    sample in int32 arrays, 4 bytes per field. When MEMORY_CAP samples are
+    held, they are appended to the spill file as one zlib chunk (the deltas
+    compress well on steady sessions) and RAM is cleared again.
+    """
+
+    __slots__ = ('fields', 'start', 'times', 'columns', 'last_time', 'last_values', 'spill_path', 'spilled',
+                 'memory_cap')
+
+    def __init__(self, fields, start, spill_path, memory_cap=MEMORY_CAP):
+        self.fields = tuple(fields)
+        self.start = start
+        self.times = array('i')
+        self.columns = [array('i') for _ in self.fields]
+        self.last_time = 0
+        self.last_values = [0] * len(self.fields)
+        self.spill_path = spill_path
+        self.spilled = 0
+        self.memory_cap = memory_cap
+
+    def __len__(self):
+        return self.spilled + len(self.times)
+
+    def add(self, timestamp, meter_value):
+        offset = int(round(timestamp - self.start))
+        self.times.append(offset - self.last_time)
+        self.last_time = offset
+        for index, field in enumerate(self.fields):
+            value = int(round(float(meter_value.get(field, 0)) * SCALE))
+            self.columns[index].append(value - self.last_values[index])
+            self.last_values[index] = value
+        if len(self.times) >= self.memory_cap:
+            self.spill()
+
+    def spill(self):
+        if not self.times:
+            return
+        data = zlib.compress(self.times.tobytes() + b''.join(column.tobytes() for column in self.columns))
+        try:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'ab') as file:
+                file.write(CHUNK_HEADER.pack(len(self.times), len(data)))
+                file.write(data)
+        except OSError as e:
+            # Keep the samples in RAM rather than losing them; try again at the next cap
+            logging.error(f"Failed to spill session history to {self.spill_path}: {e}")
+            self.memory_cap += MEMORY_CAP
+            return
+        self.spilled += len(self.times)
+        self.times = array('i')
+        self.columns = [array('i') for _ in self.fields]
+
+    def _chunks(self):
+        if self.spilled:
+            with open(self.spill_path, 'rb') as file:
+                while True:
+                    header = file.read(CHUNK_HEADER.size)
+                    if len(header) < CHUNK_HEADER.size:
+                        break
+                    count, length = CHUNK_HEADER.unpack(header)
+                    raw = zlib.decompress(file.read(length))
+                    arrays = []
+                    for index in range(len(self.fields) + 1):
+                        column = array('i')
+                        column.frombytes(raw[index * 4 * count:(index + 1) * 4 * count])
+                        arrays.append(column)
+                    yield arrays[0], arrays[1:]
+        yield self.times, self.columns
+
+    def samples(self, wanted=None):
+        """
+        Yield (index, timestamp, {field: value}) in time order, undoing the
+        delta encoding; only indices in `wanted` are yielded when it is given.
+        """
+        offset = 0
+        values = [0] * len(self.fields)
+        index = 0
+        for times, columns in self._chunks():
+            for row, delta in enumerate(times):
+                offset += delta
+                for column_index, column in enumerate(columns):
+                    values[column_index] += column[row]
+                if wanted is None or index in wanted:
+                    yield index, self.start + offset, {field: values[i] / SCALE for i, field in enumerate(self.fields)}
+                index += 1
+
+    def memory_bytes(self):
+        return sum(column.itemsize * column.buffer_info()[1] for column in [self.times] + self.columns)
+
+
+class SessionHistory:
+    """
+    Per-transaction readings for StopTransaction.transactionData, honouring
+    StopTxnSampledData (Sample.Periodic) and StopTxnAlignedData (Sample.Clock).
+    RAM use is bounded by MEMORY_CAP per series whatever the session length.
+    """
+
+    def __init__(self, transaction_id, sampled_measurands=(), aligned_measurands=(), start=None,
+                 directory=HISTORY_DIR, memory_cap=MEMORY_CAP):
+        self.transaction_id = transaction_id
+        self.start = int(time.time() if start is None else start)  # Whole seconds, so clock-aligned times stay exact
+        self.measurands = {}
+        self.series = {}
+        for context, measurands in (("Sample.Periodic", sampled_measurands), ("Sample.Clock", aligned_measurands)):
+            measurands = [measurand for measurand in measurands if measurand in MEASURAND_FIELDS]
+            if measurands:
+                self.measurands[context] = measurands
+                spill_path = os.path.join(directory, f"{transaction_id}-{context.split('.')[1].lower()}.bin")
+                self.series[context] = SampleSeries([MEASURAND_FIELDS[measurand] for measurand in measurands],
+                                                    self.start, spill_path, memory_cap)
+
+    def add(self, context, timestamp, meter_value):
+        series = self.series.get(context)
+        if series is not None:
+            series.add(timestamp, meter_value)
+
+    def __len__(self):
+        return sum(len(series) for series in self.series.values())
+
+    def entries(self, max_entries=STOP_TXN_MAX_ENTRIES):
+        """
+        (context, measurands, timestamp, meter_value) tuples in time order,
+        evenly downsampled to at most `max_entries` while keeping each series'
+        first and last sample.
+        """
+        total = len(self)
+        result = []
+        for context, series in self.series.items():
+            count = len(series)
+            if count == 0:
+                continue
+            keep = max(1, max_entries * count // total) if total > max_entries else count
+            if keep >= count:
+                wanted = None
+            elif keep == 1:
+                wanted = {count - 1}
+            else:
+                wanted = {index * (count - 1) // (keep - 1) for index in range(keep)}
+            for _, timestamp, meter_value in series.samples(wanted):
+                result.append((context, self.measurands[context], timestamp, meter_value))
+        result.sort(key=lambda entry: entry[2])
+        return result
+
+    def memory_bytes(self):
+        return sum(series.memory_bytes() for series in self.series.values())
+
+    def disk_bytes(self):
+        return sum(os.path.getsize(series.spill_path) for series in self.series.values() if series.spilled)
+
+    def discard(self):
+        for series in self.series.values():
+            if series.spilled:
+                try:
+                    os.remove(series.spill_path)
+                except OSError as e:
+                    logging.error(f"Failed to remove {series.spill_path}: {e}")
+
+
+def remove_spill_files(transaction_id, directory=HISTORY_DIR):
+    """Delete spill files left by a process that stopped before the transaction ended."""
+    for context in ("periodic", "clock"):
+        try:
+            os.remove(os.path.join(directory, f"{transaction_id}-{context}.bin"))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Failed to remove stale session history of transaction {transaction_id}: {e}")
+
+
+def measure_long_session(days=7, sample_interval=60, aligned_interval=900):
+    """Record a `days`-long session and report RAM, disk and StopTransaction build cost."""
+    import math
+    import tempfile
+    import tracemalloc
+
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as directory:
+        history = SessionHistory(1, ["Energy.Active.Import.Register", "Current.Import", "Voltage"],
+                                 ["Energy.Active.Import.Register"], start=0.0, directory=directory)
+        baseline = tracemalloc.get_traced_memory()[0]
+        energy = 0.0
+        samples = days * 86400 // sample_interval
+        started = time.perf_counter()
+        for step in range(samples):
+            now = step * sample_interval
+            current = 16.0 + 0.3 * math.sin(step / 10)
+            energy += 230.0 * current * sample_interval / 3600
+            meter_value = {"energy": energy, "current": current, "voltage": 230.0 + math.sin(step / 50), "power": 230.0 * current}
+            history.add("Sample.Periodic", now, meter_value)
+            if now % aligned_interval == 0:
+                history.add("Sample.Clock", now, meter_value)
+        record_seconds = time.perf_counter() - started
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        started = time.perf_counter()
+        entries = history.entries()
+        build_seconds = time.perf_counter() - started
+        print(f"{days} day session: {len(history)} samples, {record_seconds / len(history) * 1e6:.1f} us/sample")
+        print(f"RAM: {history.memory_bytes() / 1024:.1f} KiB in arrays, {(current_bytes - baseline) / 1024:.1f} KiB traced "
+              f"(peak {(peak_bytes - baseline) / 1024:.1f} KiB)")
+        print(f"disk: {history.disk_bytes() / 1024:.1f} KiB spilled "
+              f"({history.disk_bytes() / max(1, len(history)):.1f} bytes/sample)")
+        print(f"transactionData: {len(entries)} entries built in {build_seconds * 1e3:.1f} ms, "
+              f"last energy {entries[-1][3]['energy']:.2f} Wh (exact {energy:.2f})")
+        history.discard()
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    measure_long_session()
@@ -0,0 +1,313 @@
+import csv
+import io
+import json
+import logging
+import os
+import struct
+import threading
+
+from smart_charging import parse_time
+
+SESSIONS_FILE = "sessions.ndjson"
+INDEX_SUFFIX = ".idx"
+# start and stop (epoch seconds), transaction id, byte offset and length of the record line
+INDEX_ENTRY = struct.Struct('<ddqQI4x')
+BLOCK_ENTRIES = 1024  # Index entries summarised per block; whole blocks are skipped by time or transaction id
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_CHUNK = 64 * 1024  # Bytes per chunk of a streamed export
+RECORD_FIELDS = ('transaction_id', 'connector_id', 'id_tag', 'start_time', 'stop_time', 'meter_start', 'meter_stop',
+                 'energy', 'reason')
+
+
+class SessionStore:
+    """
+    Completed charging sessions, one JSON record per line in SESSIONS_FILE,
+    with a fixed-width binary index next to it (INDEX_ENTRY per record, in
+    the order the records were written).
+
+    main.py appends; webserver.py reads the same files. Queries walk the
+    index BLOCK_ENTRIES at a time and skip blocks whose time span or
+    transaction id range cannot match, so only matching records are read
+    and memory stays flat however many years of sessions are kept. Neither
+    file is ever rewritten: a record whose index entry was lost in a crash
+    is indexed again by repair(), and a torn last line is cut off.
+    """
+
+    def __init__(self, path=SESSIONS_FILE):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.file = None
+        self.index_file = None
+        self.blocks = []  # (min start, max stop, min transaction id, max transaction id) of each full block
+        self.blocks_lock = threading.Lock()  # webserver.py queries from several threads
+
+    def repair(self):
+        """Bring the index in line with the record file after an unclean shutdown."""
+        try:
+            data_size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            data_size = 0
+        try:
+            with open(self.index_path, 'r+b') as index:
+                index.seek(0, os.SEEK_END)
+                count = index.tell() // INDEX_ENTRY.size
+                # Drop entries of records that never reached the disk
+                while count:
+                    index.seek((count - 1) * INDEX_ENTRY.size)
+                    *_, offset, length = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+                    if offset + length <= data_size:
+                        break
+                    count -= 1
+                index.truncate(count * INDEX_ENTRY.size)
+                indexed = offset + length if count else 0
+        except FileNotFoundError:
+            indexed = 0
+        if indexed >= data_size:
+            return
+        entries = []
+        with open(self.path, 'r+b') as file:
+            file.seek(indexed)
+            offset = indexed
+            for line in file:
+                if not line.endswith(b'\n'):
+                    logging.warning(f"Cutting off a torn session record at byte {offset} of {self.path}")
+                    file.truncate(offset)
+                    break
+                try:
+                    record = json.loads(line)
+                    entries.append(self.index_entry(record, offset, len(line)))
+                except (ValueError, KeyError, TypeError):
+                    logging.warning(f"Skipping damaged session record at byte {offset} of {self.path}")
+                offset += len(line)
+        with open(self.index_path, 'ab') as index:
+            index.write(b''.join(entries))
+        if entries:
+            logging.info(f"Indexed {len(entries)} session records missing from {self.index_path}")
+
+    @staticmethod
+    def index_entry(record, offset, length):
+        return INDEX_ENTRY.pack(_epoch(record.get('start_time')), _epoch(record.get('stop_time')),
+                                int(record['transaction_id']), offset, length)
+
+    def append(self, transaction_id, connector_id, id_tag, start_time, stop_time, meter_start, meter_stop, reason):
+        """Record a completed session; the times are OCPP dateTime strings."""
+        record = {'transaction_id': transaction_id, 'connector_id': connector_id, 'id_tag': id_tag,
+                  'start_time': start_time, 'stop_time': stop_time, 'meter_start': meter_start,
+                  'meter_stop': meter_stop, 'energy': meter_stop - meter_start, 'reason': reason}
+        line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+        try:
+            if self.file is None:
+                self.repair()
+                self.file = open(self.path, 'ab')
+                self.index_file = open(self.index_path, 'ab')
+            offset = self.file.tell()
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            # The index is not fsync'd: repair() rebuilds any entry lost with it
+            self.index_file.write(self.index_entry(record, offset, len(line)))
+            self.index_file.flush()
+        except OSError as e:
+            logging.error(f"Failed to record session {transaction_id} in {self.path}: {e}")
+
+    def get(self, transaction_id):
+        """The latest record with this transaction id, or None."""
+        found = None
+        for record in self.records(transaction_id=transaction_id):
+            found = record
+        return json.loads(found[1]) if found is not None else None
+
+    def query(self, since=None, until=None, transaction_id=None, connector_id=None, id_tag=None, cursor=0,
+              limit=PAGE_SIZE):
+        """
+        One page of sessions overlapping [since, until) (epoch seconds) that
+        match the other filters, in the order they were recorded, and the
+        cursor of the next page (None after the last one).
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        sessions = []
+        for position, line in self.records(since, until, transaction_id, connector_id, id_tag, cursor):
+            if len(sessions) == limit:
+                return sessions, position
+            sessions.append(json.loads(line))
+        return sessions, None
+
+    def export(self, fmt='ndjson', since=None, until=None, transaction_id=None, connector_id=None, id_tag=None):
+        """Yield every matching session as NDJSON lines or CSV rows (with a header), in chunks of about EXPORT_CHUNK bytes."""
+        records = self.records(since, until, transaction_id, connector_id, id_tag)
+        chunk, size = [], 0
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(RECORD_FIELDS)
+        for _, line in records:
+            if fmt == 'csv':
+                record = json.loads(line)
+                writer.writerow([record.get(field, '') for field in RECORD_FIELDS])
+                if buffer.tell() < EXPORT_CHUNK:
+                    continue
+                line = buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            chunk.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK:
+                yield b''.join(chunk)
+                chunk, size = [], 0
+        if fmt == 'csv':
+            chunk.append(buffer.getvalue().encode())
+        if chunk:
+            yield b''.join(chunk)
+
+    def records(self, since=None, until=None, transaction_id=None, connector_id=None, id_tag=None, cursor=0):
+        """Yield (index position, raw record line) of the matching records, from index position `cursor` on."""
+        since = float('-inf') if since is None else since
+        until = float('inf') if until is None else until
+        transaction_id = None if transaction_id is None else int(transaction_id)
+        connector_id = None if connector_id is None else int(connector_id)
+        try:
+            index = open(self.index_path, 'rb')
+            data = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with index, data:
+            data_size = os.fstat(data.fileno()).st_size
+            count = os.fstat(index.fileno()).st_size // INDEX_ENTRY.size
+            for block in range(max(0, cursor) // BLOCK_ENTRIES, (count + BLOCK_ENTRIES - 1) // BLOCK_ENTRIES):
+                first = block * BLOCK_ENTRIES
+                summary = self.blocks[block] if block < len(self.blocks) else None
+                if summary is not None and (summary[0] >= until or summary[1] < since or transaction_id is not None
+                                            and not summary[2] <= transaction_id <= summary[3]):
+                    continue
+                index.seek(first * INDEX_ENTRY.size)
+                chunk = index.read(min(BLOCK_ENTRIES, count - first) * INDEX_ENTRY.size)
+                entries = list(INDEX_ENTRY.iter_unpack(chunk))
+                if summary is None and len(entries) == BLOCK_ENTRIES:
+                    with self.blocks_lock:
+                        if block == len(self.blocks):
+                            self.blocks.append((min(entry[0] for entry in entries), max(entry[1] for entry in entries),
+                                                min(entry[2] for entry in entries), max(entry[2] for entry in entries)))
+                matches = [(position, offset, length)
+                           for position, (start, stop, entry_id, offset, length) in enumerate(entries, first)
+                           if position >= cursor and start < until and stop >= since and offset + length <= data_size
+                           and (transaction_id is None or entry_id == transaction_id)]
+                if not matches:
+                    continue
+                # One read for the block's matching records; a block spans at most BLOCK_ENTRIES records
+                base = matches[0][1]
+                data.seek(base)
+                span = data.read(matches[-1][1] + matches[-1][2] - base) if len(matches) > 1 else None
+                for position, offset, length in matches:
+                    line = span[offset - base:offset - base + length] if span is not None else data.read(length)
+                    if connector_id is not None or id_tag is not None:
+                        record = json.loads(line)
+                        if connector_id is not None and record.get('connector_id') != connector_id:
+                            continue
+                        if id_tag is not None and record.get('id_tag') != id_tag:
+                            continue
+                    yield position, line
+
+    def close(self):
+        for file in (self.file, self.index_file):
+            if file is not None:
+                file.close()
+        self.file = self.index_file = None
+
+
+def _epoch(value):
+    """OCPP dateTime string (naive times are UTC) or epoch seconds to epoch seconds; 0 when missing or unreadable."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return parse_time(value) or 0.0
+    except ValueError:
+        return 0.0
+
+
+def benchmark(sessions=100000, lookups=200):
+    """Query and export cost on years of sessions, against scanning a CSV of the same sessions."""
+    import random
+    import tempfile
+    import time
+    import tracemalloc
+    from datetime import datetime, timedelta, timezone
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(os.path.join(directory, SESSIONS_FILE))
+        csv_path = os.path.join(directory, "charging_sessions.csv")
+        origin = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        lines, entries, rows = [], [], []
+        offset = 0
+        for transaction_id in range(1, sessions + 1):
+            start = origin + timedelta(minutes=30 * transaction_id)
+            record = {'transaction_id': transaction_id, 'connector_id': transaction_id % 3 + 1,
+                      'id_tag': f"TAG{transaction_id % 97}", 'start_time': start.strftime('%Y-%m-%dT%H:%M:%S'),
+                      'stop_time': (start + timedelta(minutes=25)).strftime('%Y-%m-%dT%H:%M:%S'),
+                      'meter_start': 0, 'meter_stop': 7000, 'energy': 7000, 'reason': 'Local'}
+            line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+            lines.append(line)
+            entries.append(SessionStore.index_entry(record, offset, len(line)))
+            rows.append([record[field] for field in RECORD_FIELDS])
+            offset += len(line)
+        with open(store.path, 'wb') as file:
+            file.write(b''.join(lines))
+        with open(store.index_path, 'wb') as file:
+            file.write(b''.join(entries))
+        with open(csv_path, 'w', newline='') as file:
+            csv.writer(file).writerows([RECORD_FIELDS] + rows)
+        del lines, entries, rows
+        span = f"{origin.date()} to {(origin + timedelta(minutes=30 * sessions)).date()}"
+        print(f"{sessions} sessions ({span}), {os.path.getsize(store.path) // 1024} KiB records, "
+              f"{os.path.getsize(store.index_path) // 1024} KiB index")
+
+        started = time.perf_counter()
+        store.append(sessions + 1, 1, "TAG", "2030-01-01T00:00:00", "2030-01-01T01:00:00", 0, 1000, "Local")
+        print(f"append: {(time.perf_counter() - started) * 1e3:.2f} ms (fsync'd)")
+
+        def csv_find(transaction_id):
+            with open(csv_path, newline='') as file:
+                for row in csv.reader(file):
+                    if row[0] == str(transaction_id):
+                        return row
+
+        def csv_range(since, until):
+            with open(csv_path, newline='') as file:
+                reader = csv.reader(file)
+                next(reader)
+                return [row for row in reader if row[3] < until and row[4] >= since][:PAGE_SIZE]
+
+        store.query(transaction_id=1)  # Build the block summaries, as the first webserver query would
+        targets = [random.randint(1, sessions) for _ in range(lookups)]
+        days = [origin + timedelta(days=random.randint(0, sessions // 48)) for _ in range(lookups)]
+        cases = (
+            ("by transaction id", lambda index: store.get(targets[index]), lambda index: csv_find(targets[index])),
+            ("one day, first page",
+             lambda index: store.query(days[index].timestamp(), (days[index] + timedelta(days=1)).timestamp()),
+             lambda index: csv_range(days[index].strftime('%Y-%m-%dT%H:%M:%S'),
+                                     (days[index] + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S'))),
+        )
+        for name, indexed, scanned in cases:
+            results = []
+            for label, function, rounds in (("index", indexed, lookups), ("CSV scan", scanned, max(1, lookups // 20))):
+                started = time.perf_counter()
+                for index in range(rounds):
+                    function(index)
+                results.append(f"{label} {(time.perf_counter() - started) / rounds * 1e3:7.2f} ms")
+            print(f"  {name:20s} " + ", ".join(results))
+
+        for fmt in ('ndjson', 'csv'):
+            started = time.perf_counter()
+            size = sum(len(chunk) for chunk in store.export(fmt))
+            elapsed = time.perf_counter() - started
+            tracemalloc.start()
+            for _ in store.export(fmt):
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  export {fmt:6s} {size // 1024:6d} KiB in {elapsed:.2f}s, peak {peak // 1024} KiB of Python memory")
+        store.close()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,390 @@
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+
+PROFILES_FILE = "charging_profiles.json"
+NOMINAL_VOLTAGE = 230.0  # Volts per phase, to convert W schedules to A
+DEFAULT_PHASES = 3  # OCPP 1.6: a period without numberPhases means three phases
+MIN_CHARGING_CURRENT = 6.0  # IEC 61851: the lowest current the control pilot can offer
+PROFILE_REFRESH = 1.0  # Seconds between re-evaluations of the profile stacks
+LIMIT_HYSTERESIS = 0.5  # Amps; smaller changes are not pushed to the power electronics
+DEMAND_HEADROOM = 2.0  # Amps above its draw granted to an EV that is not using its share
+RAMP_MARGIN = 1.0  # Amps; an EV drawing within this of its limit is assumed to want more
+
+CHARGE_POINT_MAX_PROFILE = "ChargePointMaxProfile"
+TX_DEFAULT_PROFILE = "TxDefaultProfile"
+TX_PROFILE = "TxProfile"
+RECURRENCY_SECONDS = {"Daily": 86400, "Weekly": 7 * 86400}
+
+
+def parse_time(value):
+    """OCPP dateTime string to epoch seconds, or None."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def format_time(epoch):
+    return datetime.utcfromtimestamp(epoch).isoformat()
+
+
+def to_amps(limit, unit, phases):
+    return limit / (NOMINAL_VOLTAGE * (phases or DEFAULT_PHASES)) if unit == 'W' else limit
+
+
+def from_amps(amps, unit, phases=DEFAULT_PHASES):
+    # Composite schedule periods carry no numberPhases, so the CSMS reads them as three phases too
+    return amps * NOMINAL_VOLTAGE * phases if unit == 'W' else amps
+
+
+class ChargingProfiles:
+    """
+    Installed charging profiles, persisted to PROFILES_FILE so they survive a
+    restart. Profiles are kept in the snake_case form the ocpp library hands
+    to handlers, plus the connector they were set on and when they arrived.
+    With path=None the profiles are kept in memory only.
+    """
+
+    def __init__(self, path=PROFILES_FILE):
+        self.path = path
+        self.profiles = []
+        self.version = 0  # Bumped on every change so evaluators can cache
+        if path is None:
+            return
+        try:
+            with open(path, 'r') as file:
+                self.profiles = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (IOError, json.JSONDecodeError) as e:
+            logging.error(f"Failed to load charging profiles from {path}: {e}")
+
+    def save(self):
+        if self.path is None:
+            return
+        temp_file = f'{self.path}.tmp'
+        try:
+            with open(temp_file, 'w') as file:
+                json.dump(self.profiles, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file, self.path)
+        except OSError as e:
+            logging.error(f"Failed to save charging profiles to {self.path}: {e}")
+
+    def _changed(self):
+        self.version += 1
+        self.save()
+
+    def install(self, connector_id, profile, config, transaction_id=None):
+        """Validate and store a cs_charging_profiles payload. Returns 'Accepted' or 'Rejected'."""
+        purpose = profile.get("charging_profile_purpose")
+        schedule = profile.get("charging_schedule") or {}
+        periods = schedule.get("charging_schedule_period") or []
+        unit = schedule.get("charging_rate_unit")
+        allowed_units = {'A' if unit_name == 'Current' else 'W' for unit_name in
+                         config.get("ChargingScheduleAllowedChargingRateUnit", ("Current", "Power"))}
+        if purpose == CHARGE_POINT_MAX_PROFILE and connector_id != 0:
+            return 'Rejected'
+        if purpose == TX_PROFILE:
+            if connector_id == 0 or transaction_id is None:
+                return 'Rejected'  # A TxProfile needs a running transaction on its connector
+            if profile.get("transaction_id") not in (None, transaction_id):
+                return 'Rejected'
+        if not periods or unit not in allowed_units:
+            return 'Rejected'
+        if profile.get("stack_level", 0) > config.get("ChargeProfileMaxStackLevel", 10):
+            return 'Rejected'
+        if len(periods) > config.get("ChargingScheduleMaxPeriods", 24):
+            return 'Rejected'
+        if profile.get("charging_profile_kind") == "Recurring" and not schedule.get("start_schedule"):
+            return 'Rejected'
+
+        profile = dict(profile, connector_id=connector_id, received_at=time.time())
+        if purpose == TX_PROFILE:
+            profile["transaction_id"] = transaction_id
+        profile["charging_schedule"] = dict(schedule, charging_schedule_period=sorted(periods, key=lambda period: period["start_period"]))
+        # A profile replaces one with the same id, or the same connector, purpose and stack level
+        remaining = [existing for existing in self.profiles
+                     if existing["charging_profile_id"] != profile["charging_profile_id"] and
+                     (existing["connector_id"], existing["charging_profile_purpose"], existing["stack_level"]) !=
+                     (connector_id, purpose, profile["stack_level"])]
+        if len(remaining) >= config.get("MaxChargingProfilesInstalled", 10):
+            return 'Rejected'
+        self.profiles = remaining + [profile]
+        self._changed()
+        logging.info(f"Installed {purpose} {profile['charging_profile_id']} (stack {profile['stack_level']}) on connector {connector_id}")
+        return 'Accepted'
+
+    def clear(self, profile_id=None, connector_id=None, purpose=None, stack_level=None):
+        """Remove matching profiles (all of them when no criteria are given). Returns True if any were removed."""
+        def matches(profile):
+            if profile_id is not None:
+                return profile["charging_profile_id"] == profile_id
+            return ((connector_id is None or profile["connector_id"] == connector_id) and
+                    (purpose is None or profile["charging_profile_purpose"] == purpose) and
+                    (stack_level is None or profile["stack_level"] == stack_level))
+        remaining = [profile for profile in self.profiles if not matches(profile)]
+        if len(remaining) == len(self.profiles):
+            return False
+        self.profiles = remaining
+        self._changed()
+        return True
+
+    def stack(self, connector_id, purpose):
+        """Profiles for one connector and purpose, highest stack level first."""
+        return sorted((profile for profile in self.profiles
+                       if profile["connector_id"] == connector_id and profile["charging_profile_purpose"] == purpose),
+                      key=lambda profile: profile["stack_level"], reverse=True)
+
+
+def schedule_start(profile, now, tx_start):
+    schedule = profile["charging_schedule"]
+    kind = profile.get("charging_profile_kind")
+    if kind == "Relative":
+        return tx_start if tx_start is not None else now
+    start = parse_time(schedule.get("start_schedule"))
+    if kind == "Recurring":
+        period = RECURRENCY_SECONDS.get(profile.get("recurrency_kind"), 86400)
+        if now >= start:
+            start += math.floor((now - start) / period) * period
+        return start
+    return start if start is not None else profile["received_at"]
+
+
+def profile_limit(profile, now, tx_start=None):
+    """The profile's limit in amps at `now`, or None when it is not in effect."""
+    valid_from = parse_time(profile.get("valid_from"))
+    valid_to = parse_time(profile.get("valid_to"))
+    if (valid_from is not None and now < valid_from) or (valid_to is not None and now >= valid_to):
+        return None
+    start = schedule_start(profile, now, tx_start)
+    offset = now - start
+    schedule = profile["charging_schedule"]
+    duration = schedule.get("duration")
+    if offset < 0 or (duration is not None and offset >= duration):
+        return None
+    current = None
+    for period in schedule["charging_schedule_period"]:
+        if period["start_period"] > offset:
+            break
+        current = period
+    if current is None:
+        return None
+    return to_amps(current["limit"], schedule.get("charging_rate_unit"), current.get("number_phases"))
+
+
+def profile_breakpoints(profile, window_start, window_end, tx_start=None):
+    """Times within the window at which the profile's limit may change."""
+    points = [parse_time(profile.get("valid_from")), parse_time(profile.get("valid_to"))]
+    schedule = profile["charging_schedule"]
+    start = schedule_start(profile, window_start, tx_start)
+    cycle = RECURRENCY_SECONDS.get(profile.get("recurrency_kind"), 86400) if profile.get("charging_profile_kind") == "Recurring" else None
+    while start <= window_end:
+        points.extend(start + period["start_period"] for period in schedule["charging_schedule_period"])
+        if schedule.get("duration") is not None:
+            points.append(start + schedule["duration"])
+        if cycle is None:
+            break
+        start += cycle
+    return [point for point in points if point is not None and window_start < point < window_end]
+
+
+class LoadManager:
+    """
+    Turns the installed profiles into per-connector current limits and shares
+    the site limit between charging connectors on every meter frame.
+
+    The profile stacks only change at schedule boundaries, so they are
+    evaluated at most every PROFILE_REFRESH seconds (or when a profile
+    changes); the per-frame work is the allocation itself.
+    """
+
+    def __init__(self, profiles, limiters, config):
+        self.profiles = profiles
+        self.limiters = limiters  # connector_id: object with set_current_limit(amps)
+        self.config = config  # Callable returning the current config snapshot
+        self.transactions = {}  # connector_id: (transaction_id, start epoch), in start order
+        self.limits = {}  # Last allocated limit per connector
+        self.pushed = {}  # Last limit sent to each limiter
+        self.caps = {}
+        self.site_limit = None
+        self.refreshed_at = None
+        self.refreshed_version = None
+
+    def transaction_started(self, connector_id, transaction_id, start=None):
+        self.transactions[connector_id] = (transaction_id, time.time() if start is None else start)
+        self.refreshed_at = None
+
+    def transaction_stopped(self, connector_id):
+        self.transactions.pop(connector_id, None)
+        self.limits.pop(connector_id, None)
+        # TxProfiles only live as long as their transaction
+        self.profiles.clear(connector_id=connector_id, purpose=TX_PROFILE)
+        self.refreshed_at = None
+
+    def stack_limit(self, connector_id, purpose, now):
+        transaction = self.transactions.get(connector_id)
+        tx_start = transaction[1] if transaction is not None else None
+        for profile in self.profiles.stack(connector_id, purpose):
+            if purpose == TX_PROFILE and (transaction is None or profile.get("transaction_id") != transaction[0]):
+                continue
+            limit = profile_limit(profile, now, tx_start)
+            if limit is not None:
+                return limit
+        return None
+
+    def connector_profile_limit(self, connector_id, now):
+        """TxProfile when one applies, otherwise TxDefaultProfile (this connector's before connector 0's)."""
+        if connector_id in self.transactions:
+            limit = self.stack_limit(connector_id, TX_PROFILE, now)
+            if limit is not None:
+                return limit
+        limit = self.stack_limit(connector_id, TX_DEFAULT_PROFILE, now)
+        return limit if limit is not None else self.stack_limit(0, TX_DEFAULT_PROFILE, now)
+
+    def site_profile_limit(self, now):
+        return self.stack_limit(0, CHARGE_POINT_MAX_PROFILE, now)
+
+    def refresh(self, now=None):
+        """Re-evaluate the profile stacks into self.site_limit and self.caps."""
+        now = time.time() if now is None else now
+        config = self.config()
+        connector_max = config.get("ConnectorMaxCurrent", 32.0)
+        site_limits = [limit for limit in (self.site_profile_limit(now), config.get("SiteCurrentLimit", 0) or None) if limit is not None]
+        self.site_limit = min(site_limits) if site_limits else None
+        for connector_id in self.limiters:
+            limit = self.connector_profile_limit(connector_id, now)
+            self.caps[connector_id] = connector_max if limit is None else min(limit, connector_max)
+        self.refreshed_at = time.monotonic()
+        self.refreshed_version = self.profiles.version
+
+    def allocate_frame(self, draws):
+        """
+        Share the site limit between charging connectors given each one's
+        measured current (`draws`: connector_id -> A) and push any limit that
+        moved by LIMIT_HYSTERESIS or more. Called once per meter frame.
+        """
+        if (self.refreshed_at is None or self.refreshed_version != self.profiles.version or
+                time.monotonic() - self.refreshed_at >= PROFILE_REFRESH):
+            self.refresh()
+        active = [connector_id for connector_id in self.transactions if connector_id in self.limiters]
+        if not active:
+            return self.limits
+        caps = [self.caps[connector_id] for connector_id in active]
+        demands = []
+        for connector_id, cap in zip(active, caps):
+            draw = draws.get(connector_id, 0.0)
+            previous = self.limits.get(connector_id, cap)
+            # An EV near its limit may want more; one well below it gets its draw plus headroom
+            demands.append(cap if draw >= previous - RAMP_MARGIN else min(cap, max(MIN_CHARGING_CURRENT, draw + DEMAND_HEADROOM)))
+        allocation = allocate(self.site_limit, caps, demands)
+        for connector_id, limit in zip(active, allocation):
+            self.limits[connector_id] = limit
+            pushed = self.pushed.get(connector_id)
+            if pushed is None or abs(limit - pushed) >= LIMIT_HYSTERESIS or (limit == 0) != (pushed == 0):
+                self.pushed[connector_id] = limit
+                self.limiters[connector_id].set_current_limit(limit)
+        return self.limits
+
+    def composite_schedule(self, connector_id, duration, unit='A', now=None):
+        """GetCompositeSchedule: (start epoch, [(offset, limit), ...]) over `duration` seconds."""
+        now = int(time.time() if now is None else now)
+        end = now + duration
+        transaction = self.transactions.get(connector_id)
+        tx_start = transaction[1] if transaction is not None else None
+        relevant = [profile for profile in self.profiles.profiles
+                    if profile["connector_id"] in (0, connector_id)]
+        points = {now}
+        for profile in relevant:
+            points.update(int(math.ceil(point)) for point in profile_breakpoints(profile, now, end, tx_start))
+        config = self.config()
+        periods = []
+        for point in sorted(points):
+            limits = [self.site_profile_limit(point)]
+            if connector_id != 0:
+                limits.append(self.connector_profile_limit(connector_id, point))
+            limits = [limit for limit in limits if limit is not None]
+            if limits:
+                limit = min(limits)
+            elif connector_id == 0:
+                limit = config.get("SiteCurrentLimit", 0) or config.get("ConnectorMaxCurrent", 32.0) * len(self.limiters)
+            else:
+                limit = config.get("ConnectorMaxCurrent", 32.0)
+            limit = round(from_amps(limit, unit), 1)
+            if not periods or periods[-1][1] != limit:
+                periods.append((point - now, limit))
+        return now, periods
+
+
+def allocate(site_limit, caps, demands):
+    """
+    Water-filling split of `site_limit` amps: each connector gets at most its
+    demand, spare capacity is shared evenly up to each cap, and connectors that
+    cannot be offered MIN_CHARGING_CURRENT are paused (0 A), latest first. A
+    cap below MIN_CHARGING_CURRENT (e.g. a 0 A profile) always pauses.
+    """
+    count = len(caps)
+    limits = [0.0] * count
+    eligible = [index for index in range(count) if caps[index] >= MIN_CHARGING_CURRENT]
+    if site_limit is None or sum(caps[index] for index in eligible) <= site_limit:
+        for index in eligible:
+            limits[index] = caps[index]
+        return limits
+    admitted = eligible[:int(site_limit // MIN_CHARGING_CURRENT)]
+    remaining = site_limit
+    for index in admitted:
+        limits[index] = MIN_CHARGING_CURRENT  # Everyone admitted gets the minimum first
+        remaining -= MIN_CHARGING_CURRENT
+    for targets in (demands, caps):
+        # Spread what is left, first up to each demand, then up to each cap
+        order = sorted(admitted, key=lambda index: min(targets[index], caps[index]) - limits[index])
+        for position, index in enumerate(order):
+            want = min(targets[index], caps[index]) - limits[index]
+            if want <= 0:
+                continue
+            give = min(want, remaining / (len(admitted) - position))
+            limits[index] += give
+            remaining -= give
+        if remaining <= 1e-9:
+            break
+    return [min(limit, cap) for limit, cap in zip(limits, caps)]
+
+
+def benchmark(ticks=100000):
+    """Allocation cost per meter frame for 3 and 32 charging connectors."""
+    class Limiter:
+        def set_current_limit(self, amps):
+            pass
+
+    class Config(dict):
+        pass
+
+    for connectors in (3, 32):
+        profiles = ChargingProfiles(path=None)
+        config = Config(SiteCurrentLimit=connectors * 10.0, ConnectorMaxCurrent=32.0)
+        manager = LoadManager(profiles, {connector_id: Limiter() for connector_id in range(1, connectors + 1)}, lambda: config)
+        profiles.install(0, {"charging_profile_id": 1, "stack_level": 0, "charging_profile_purpose": CHARGE_POINT_MAX_PROFILE,
+                             "charging_profile_kind": "Absolute", "charging_schedule": {
+                                 "charging_rate_unit": "A", "charging_schedule_period": [{"start_period": 0, "limit": connectors * 12.0}]}},
+                         {"ChargeProfileMaxStackLevel": 10})
+        for connector_id in range(1, connectors + 1):
+            manager.transaction_started(connector_id, connector_id)
+        draws = {connector_id: 8.0 + connector_id % 5 for connector_id in range(1, connectors + 1)}
+        started = time.perf_counter()
+        for tick in range(ticks):
+            draws[1 + tick % connectors] = 16.0 if tick % 100 < 50 else 6.5
+            manager.allocate_frame(draws)
+        elapsed = time.perf_counter() - started
+        print(f"{connectors} connectors: {elapsed / ticks * 1e6:.2f} us/frame, "
+              f"site {manager.site_limit:.0f} A, allocated {sum(manager.limits.values()):.1f} A")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import sys
+import time
+
+STARTUP_PROFILE_FILE = "startup_profile.json"
+# Regression budget for `python startup_profile.py`: seconds from process start to Boot accepted
+BOOT_BUDGET_SECONDS = 5.0
+
+
+def process_age():
+    """Seconds since this process was started (before the interpreter loaded), or 0 where /proc is missing."""
+    try:
+        with open('/proc/self/stat', 'r') as file:
+            start_ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as file:
+            uptime = float(file.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+_origin = time.monotonic() - process_age()
+_marks = {}
+
+
+def mark(name):
+    """Record that startup reached `name`; only the first occurrence counts, and True is returned for it."""
+    if name in _marks:
+        return False
+    _marks[name] = round(time.monotonic() - _origin, 3)
+    return True
+
+
+def report(path=STARTUP_PROFILE_FILE):
+    """Log the startup marks and write them to `path` for the regression benchmark."""
+    logging.info("Startup profile: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in _marks.items()))
+    try:
+        with open(path, 'w') as file:
+            json.dump({"marks": _marks, "written_at": time.time()}, file)
+    except OSError as e:
+        logging.warning(f"Could not write startup profile {path}: {e}")
+
+
+def _importtime(code):
+    import subprocess
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative_us, name = line.split('|')  # "import time: self | cumulative | name"
+            yield len(name) - len(name.lstrip()), name.strip(), int(cumulative_us) / 1000
+
+
+def import_times(module='main', top=10):
+    """
+    Cumulative import time (ms) of the slowest direct imports of `module`, via
+    python -X importtime. Modules the bare interpreter already loads (site
+    hooks) are left out.
+    """
+    baseline = {name for _, name, _ in _importtime('pass')}
+    times = [(milliseconds, name) for depth, name, milliseconds in _importtime(f'import {module}')
+             if depth <= 3 and name not in baseline]  # The module itself and its direct imports
+    return sorted(times, reverse=True)[:top]
+
+
+def run_boot(timeout=30.0):
+    """
+    Start main.py against a local CSMS that accepts the BootNotification and
+    return the startup marks it recorded.
+    """
+    import asyncio
+    import shutil
+    import subprocess
+    import tempfile
+
+    import websockets
+
+    async def csms(websocket, *args):
+        try:
+            async for raw in websocket:
+                message = json.loads(raw)
+                if message[0] != 2:
+                    continue
+                now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+                payload = {"status": "Accepted", "currentTime": now, "interval": 300} if message[2] == "BootNotification" else {}
+                if message[2] == "Heartbeat":
+                    payload = {"currentTime": now}
+                await websocket.send(json.dumps([3, message[1], payload]))
+        except websockets.exceptions.ConnectionClosed:
+            pass  # main.py is terminated once it has reported
+
+    async def run(directory):
+        async with websockets.serve(csms, '127.0.0.1', 0, subprotocols=["ocpp1.6j"]) as server:
+            port = server.sockets[0].getsockname()[1]
+            with open(os.path.join(directory, 'charger.json'), 'w') as file:
+                json.dump({"server_url": f"ws://127.0.0.1:{port}", "charger_id": "STARTUP"}, file)
+            environment = dict(os.environ, JP_HAL_BACKEND=os.environ.get('JP_HAL_BACKEND', 'sim'))
+            process = subprocess.Popen([sys.executable, 'main.py'], cwd=directory, env=environment,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            profile_path = os.path.join(directory, STARTUP_PROFILE_FILE)
+            try:
+                deadline = time.monotonic() + timeout
+                while not os.path.exists(profile_path):
+                    if time.monotonic() > deadline or process.poll() is not None:
+                        raise RuntimeError("main.py did not reach Boot accepted")
+                    await asyncio.sleep(0.05)
+                await asyncio.sleep(0.1)
+                with open(profile_path, 'r') as file:
+                    return json.load(file)["marks"]
+            finally:
+                process.terminate()
+                process.wait()
+
+    source = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        for name in os.listdir(source):
+            if name.endswith('.py') or name in ('config.json', 'templates'):
+                path = os.path.join(source, name)
+                if os.path.isdir(path):
+                    shutil.copytree(path, os.path.join(directory, name))
+                else:
+                    shutil.copy(path, directory)
+        return asyncio.run(run(directory))
+
+
+def benchmark(budget=BOOT_BUDGET_SECONDS, runs=3):
+    """Startup report and regression check; exits non-zero when Boot accepted exceeds `budget` seconds."""
+    print("slowest imports of main (cumulative):")
+    for milliseconds, name in import_times():
+        print(f"  {milliseconds:8.1f} ms  {name}")
+    results = []
+    for run in range(runs):
+        marks = run_boot()
+        results.append(marks)
+        print(f"run {run + 1}: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in marks.items()))
+    boot = sorted(marks.get("boot accepted", float('inf')) for marks in results)[len(results) // 2]
+    print(f"median time to Boot accepted: {boot:.3f}s (budget {budget:.3f}s)")
+    if boot > budget:
+        print("REGRESSION: startup exceeded its budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else BOOT_BUDGET_SECONDS)
@@ -0,0 +1,17 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault("JP_HAL_BACKEND", "sim")  # Never touch GPIO, serial or I2C from the tests
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in a scratch directory holding a copy of config.json, so journals, caches and CSVs stay out of the tree."""
+    shutil.copy(os.path.join(REPO_DIR, "config.json"), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,75 @@
+import json
+import os
+import time
+
+import config_store
+from config_store import CONFIG_SCHEMA, ConfigStore
+
+
+def write_config(path, values):
+    with open(path, "w") as file:
+        json.dump(values, file)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_missing_keys_get_schema_defaults(tmp_path):
+    path = tmp_path / "config.json"
+    write_config(path, {"HeartbeatInterval": "45", "MeterValuesMaxBatch": 0, "CustomKey": "kept"})
+    snapshot = ConfigStore(str(path)).snapshot
+    assert snapshot["HeartbeatInterval"] == 45
+    assert snapshot["MeterValuesMaxBatch"] == CONFIG_SCHEMA["MeterValuesMaxBatch"][1]  # Below its minimum
+    assert snapshot["CustomKey"] == "kept"
+    assert snapshot["MeterValuesMaxBatchLatency"] == CONFIG_SCHEMA["MeterValuesMaxBatchLatency"][1]
+    assert snapshot["StopTxnSampledData"] == ()
+    assert set(CONFIG_SCHEMA) <= set(snapshot.keys())
+
+
+def test_changes_are_saved_once_per_burst_and_atomically(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    write_config(path, {"HeartbeatInterval": 30})
+    store = ConfigStore(str(path))
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(config_store.os, "replace", lambda source, target: (replaced.append(target), replace(source, target)))
+
+    assert store.set("HeartbeatInterval", "60") == "Accepted"
+    assert store.set("MeterValueSampleInterval", 15) == "Accepted"
+    assert store.set("HeartbeatInterval", "-1") == "Rejected"
+    assert store.set("NumberOfConnectors", 4) == "Rejected"  # Read-only
+    assert store.set("NoSuchKey", 1) == "NotSupported"
+    assert json.loads(path.read_text()) == {"HeartbeatInterval": 30}  # Nothing written before SAVE_DELAY
+
+    store.flush_pending()
+    assert replaced == [str(path)]
+    saved = json.loads(path.read_text())
+    assert (saved["HeartbeatInterval"], saved["MeterValueSampleInterval"]) == (60, 15)
+    assert os.listdir(tmp_path) == ["config.json"]  # The temp file was renamed into place
+    store.flush_pending()
+    assert replaced == [str(path)]
+
+
+def test_edited_file_is_reloaded(tmp_path):
+    path = tmp_path / "config.json"
+    write_config(path, {"HeartbeatInterval": 30, "VoltageRestrictions_max": 250})
+    store = ConfigStore(str(path)).watch()
+    before = store.snapshot
+
+    def edit():
+        # Written again until seen, as the watcher thread may not be watching yet
+        write_config(path, {"HeartbeatInterval": 90, "VoltageRestrictions_max": "not a number"})
+        time.sleep(0.05)
+        return store.snapshot is not before
+
+    wait_until(edit)
+    assert store.snapshot["HeartbeatInterval"] == 90
+    assert store.snapshot["VoltageRestrictions_max"] == 250.0  # An invalid edit keeps the last good value
+
+    # A half-written file keeps the current snapshot
+    path.write_text('{"HeartbeatInterval": ')
+    assert store.reload() is store.snapshot and store.snapshot["HeartbeatInterval"] == 90
@@ -0,0 +1,102 @@
+import gzip
+import hashlib
+import json
+import logging
+import threading
+
+import pytest
+
+import diag_log
+from diag_log import DiagnosticsLog, bundle, serve_uploads, upload
+
+T0 = 1_700_000_000.0
+
+
+@pytest.fixture
+def diagnostics(tmp_path):
+    """A DiagnosticsLog fed through its own logger, so pytest's root handlers stay in place."""
+    created = []
+
+    def make(**kwargs):
+        log = DiagnosticsLog(directory=str(tmp_path / "logs"), console=False, **kwargs)
+        logger = logging.Logger(f"diag-test-{len(created)}", logging.DEBUG)
+        logger.addHandler(log.queue_handler)
+        log.listener.start()
+        created.append(log)
+        return log, logger
+
+    yield make
+    for log in created:
+        log.listener.stop()
+
+
+def emit(logger, message, created, level=logging.INFO, lineno=1):
+    """Log `message` as if at `created`, from call site `lineno`."""
+    record = logger.makeRecord(logger.name, level, "site.py", lineno, message, None, None)
+    record.created = created
+    logger.handle(record)
+
+
+def test_upload_streams_gzip_with_the_requested_time_range(diagnostics, tmp_path, monkeypatch):
+    monkeypatch.setattr(diag_log, "UPLOAD_CHUNK", 1024)
+    log, logger = diagnostics(sample_burst=100000)
+    for index in range(5000):
+        emit(logger, f"sample {index} {hashlib.sha256(str(index).encode()).hexdigest()}", T0 + index, lineno=index % 7)
+    log.listener.stop()
+    log.listener.start()  # Everything queued is on disk now
+
+    sent = []
+
+    def chunks():
+        for chunk in bundle({"config": {"HeartbeatInterval": 30}}, log, since=T0 + 1000, until=T0 + 1999):
+            sent.append(len(chunk))
+            yield chunk
+
+    received = tmp_path / "received"
+    received.mkdir()
+    server = serve_uploads(str(received))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        location = f"http://127.0.0.1:{server.server_address[1]}/diagnostics/"
+        upload(location, "bundle.gz", chunks())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(sent) > 1  # Streamed a chunk at a time, not built in one piece
+
+    lines = [json.loads(line) for line in gzip.decompress((received / "bundle.gz").read_bytes()).splitlines()]
+    assert lines[0] == {"type": "config", "data": {"HeartbeatInterval": 30}}
+    logs = lines[1:]
+    assert all(line["type"] == "log" for line in logs)
+    assert [line["ts"] for line in logs] == [T0 + index for index in range(1000, 2000)]
+    assert logs[0]["message"].startswith("sample 1000 ")
+
+
+def test_ring_stays_bounded(diagnostics):
+    log, logger = diagnostics(ring_size=100, sample_burst=100000)
+    for index in range(1000):
+        emit(logger, f"sample {index}", T0 + index)
+    log.listener.stop()
+    log.listener.start()
+    assert len(log.ring) == 100
+    assert log.ring[0]["message"] == "sample 900" and log.ring[-1]["message"] == "sample 999"
+    # Without log files, the bundle falls back to the ring
+    log_without_files = DiagnosticsLog(directory="/proc/no-such-dir", ring_size=10, console=False)
+    log_without_files.ring.extend(log.ring)
+    assert len(list(log_without_files.records())) == 10
+
+
+def test_sampling_drops_chatty_call_sites_but_not_warnings(diagnostics):
+    log, logger = diagnostics(sample_burst=5, sample_window=60)
+    for index in range(20):
+        emit(logger, f"chatty {index}", T0 + index)
+        emit(logger, f"problem {index}", T0 + index, level=logging.WARNING, lineno=2)
+    emit(logger, "chatty again", T0 + 61)
+    log.listener.stop()
+    log.listener.start()
+
+    chatty = [entry for entry in log.ring if entry["message"].startswith("chatty")]
+    assert [entry["message"] for entry in chatty] == [f"chatty {index}" for index in range(5)] + ["chatty again"]
+    assert chatty[-1]["suppressed"] == 15
+    assert len([entry for entry in log.ring if entry["level"] == "WARNING"]) == 20
+    assert log.stats()["sampled_out"] == 15
@@ -0,0 +1,52 @@
+from fault_rules import RELEASE, TRIP, compile_rules
+
+CONFIG = {"VoltageRestrictions_min": 210, "VoltageRestrictions_max": 250, "CurrentRestrictions_max": 32,
+          "CurrentRestrictions_min": 0.3, "CurrentTimingRestrictions_duration_minutes": 1}
+
+
+def events(evaluator, *frames, connector_id=1, in_transaction=True):
+    """Feed (voltage, current[, now]) frames; the (event, rule name) pairs they produce, in order."""
+    produced = []
+    for frame in frames:
+        voltage, current, now = frame if len(frame) == 3 else frame + (0.0,)
+        produced += [(event, rule.name) for event, rule in evaluator.evaluate(connector_id, voltage, current, in_transaction, now)]
+    return produced
+
+
+def test_over_voltage_trips_after_debounce_and_releases_with_hysteresis():
+    evaluator = compile_rules(CONFIG)
+    assert events(evaluator, (260, 10), (260, 10)) == []
+    assert events(evaluator, (260, 10)) == [(TRIP, "over_voltage")]
+    assert evaluator.is_faulted(1) and not evaluator.is_faulted(2)
+    assert events(evaluator, (260, 10), (247, 10)) == []  # Still within the 5 V hysteresis
+    assert events(evaluator, (244, 10)) == [(RELEASE, "over_voltage")]
+    assert not evaluator.is_faulted(1)
+
+
+def test_a_good_frame_restarts_the_debounce():
+    evaluator = compile_rules(CONFIG)
+    assert events(evaluator, (200, 10), (200, 10), (230, 10), (200, 10), (200, 10)) == []
+    assert events(evaluator, (200, 10)) == [(TRIP, "under_voltage")]
+
+
+def test_transaction_rules_only_apply_during_a_transaction():
+    evaluator = compile_rules(CONFIG)
+    assert events(evaluator, (230, 40), (230, 40), in_transaction=False) == []
+    assert events(evaluator, (230, 40), (230, 40)) == [(TRIP, "over_current")]
+    # Ending the transaction releases the rule instead of leaving the connector faulted
+    assert events(evaluator, (230, 40), in_transaction=False) == [(RELEASE, "over_current")]
+
+
+def test_idle_current_must_hold_for_the_configured_time():
+    evaluator = compile_rules(CONFIG)
+    assert events(evaluator, (230, 0.1, 0.0), (230, 0.1, 59.0)) == []
+    assert events(evaluator, (230, 0.1, 60.0)) == [(TRIP, "idle_current")]
+    assert not evaluator.is_faulted(1)  # Suspends the session, the connector is not faulted
+
+
+def test_recompiling_keeps_state_and_applies_new_thresholds():
+    evaluator = compile_rules(CONFIG)
+    events(evaluator, (260, 10), (260, 10), (260, 10))
+    evaluator = compile_rules(dict(CONFIG, VoltageRestrictions_max=270), previous=evaluator)
+    assert evaluator.is_faulted(1)
+    assert events(evaluator, (264, 10)) == [(RELEASE, "over_voltage")]
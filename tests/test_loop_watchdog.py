@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import loop_watchdog
+from loop_watchdog import LoopWatchdog
+
+
+class Relay:
+    def __init__(self, relay_state):
+        self.relay_state = relay_state
+
+    def open_relay(self):
+        self.relay_state = 1
+
+    def close_relay(self):
+        self.relay_state = 0
+
+
+def stall(relays, can_energise=None, restart=False, seconds=2.0):
+    """Block a running loop until the watchdog trips (0.8 s); returns the watchdog and the relay states mid-stall."""
+    async def run():
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), warn_after=0.5, trip_after=0.8, restart=restart).start()
+        watchdog.relays = relays
+        watchdog.can_energise = can_energise
+        await asyncio.sleep(0.5)
+        started = time.monotonic()
+        while not watchdog.trips and time.monotonic() - started < seconds:
+            time.sleep(0.01)  # A blocking call on the loop
+        time.sleep(0.1)
+        during = {connector_id: relay.relay_state for connector_id, relay in relays.items()}
+        await asyncio.sleep(0.6)
+        watchdog.close()
+        return watchdog, during
+
+    return asyncio.run(run())
+
+
+def test_stall_opens_relays_and_recovery_restores_only_those_allowed():
+    relays = {1: Relay(1), 2: Relay(1), 3: Relay(0)}
+    watchdog, during = stall(relays, can_energise=lambda connector_id: connector_id == 1)
+    assert watchdog.trips == 1 and watchdog.stalls == 1
+    assert during == {1: 0, 2: 0, 3: 0}
+    # Connector 2 is faulted or stopped by now, and 3 was never on
+    assert {connector_id: relay.relay_state for connector_id, relay in relays.items()} == {1: 1, 2: 0, 3: 0}
+    assert watchdog.tripped is None
+
+
+def test_relays_stay_open_without_a_check():
+    relays = {1: Relay(1)}
+    stall(relays)
+    assert relays[1].relay_state == 0
+
+
+def test_healthy_loop_feeds_and_never_trips():
+    async def run():
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), warn_after=0.5, trip_after=0.8, restart=False)
+        watchdog.feed_interval = 0.1
+        watchdog.start()
+        await asyncio.sleep(1.0)
+        watchdog.close()
+        return watchdog
+
+    watchdog = asyncio.run(run())
+    assert watchdog.trips == 0 and watchdog.stalls == 0
+    assert watchdog.feeds >= 3
+
+
+def test_restart_exits_with_stall_code(monkeypatch):
+    exits = []
+    monkeypatch.setattr(loop_watchdog.os, "_exit", exits.append)
+    relays = {1: Relay(1)}
+    stall(relays, can_energise=lambda connector_id: True, restart=True)
+    assert exits == [loop_watchdog.STALL_EXIT_CODE]
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import struct
+
+import pytest
+
+import meter_modbus
+from meter_modbus import (OFFLINE_AFTER, SDM_REGISTERS, Meter, ModbusBus, ModbusError, ModbusSlaveEmulator,
+                          max_gap, parse_response, plan_reads, read_request)
+from meter_protocol import crc16
+
+BAUD = 9600
+
+
+class FakeSerial:
+    """Bus stand-in that answers like ModbusSlaveEmulator, except for the addresses in `silent`."""
+
+    def __init__(self, silent=()):
+        self.slaves = ModbusSlaveEmulator(None)
+        self.silent = set(silent)
+        self.timeout = None
+        self.pending = b''
+
+    async def write_async(self, request):
+        address, function, start, count = struct.unpack('>BBHH', request[:6])
+        if address in self.silent:
+            self.pending = b''
+            return
+        body = bytes((address, function, 2 * count)) + bytes(self.slaves.registers(address)[2 * start:2 * (start + count)])
+        self.pending = body + struct.pack('<H', crc16(body))
+
+    async def read_async(self, size=1):
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self.pending = b''
+
+    def close(self):
+        pass
+
+
+def bus(silent=()):
+    meters = [Meter(address, address, SDM_REGISTERS, max_gap(BAUD)) for address in (1, 2, 3)]
+    return ModbusBus("/dev/null", meters, BAUD, serial=FakeSerial(silent))
+
+
+@pytest.fixture(autouse=True)
+def no_bus_delays(monkeypatch):
+    monkeypatch.setattr(meter_modbus, "TURNAROUND", 0)
+    monkeypatch.setattr(meter_modbus, "frame_gap", lambda baud: 0)
+
+
+def test_plan_reads_bridges_small_holes_only():
+    reads = plan_reads(SDM_REGISTERS, gap=max_gap(BAUD))
+    # Voltage, current and power sit 4 registers apart and share one read; energy at 0x48 is too far away
+    assert [(start, count) for start, count, _ in reads] == [(0x0000, 0x000E), (0x0048, 2)]
+    assert [(start, count) for start, count, _ in plan_reads(SDM_REGISTERS, gap=0)] == \
+        [(0x0000, 2), (0x0006, 2), (0x000C, 2), (0x0048, 2)]
+
+
+def test_parse_response_rejects_bad_frames():
+    body = bytes((1, 4, 4)) + bytes(4)
+    good = body + struct.pack('<H', crc16(body))
+    assert parse_response(1, good, 2) == bytes(4)
+    with pytest.raises(ValueError, match="CRC"):
+        parse_response(1, good[:-1] + bytes((good[-1] ^ 1,)), 2)
+    with pytest.raises(ValueError):
+        parse_response(2, good, 2)  # Another slave's answer
+    with pytest.raises(ValueError):
+        parse_response(1, b'', 2)  # Nothing before the timeout
+    exception = bytes((1, 0x84, 2))
+    with pytest.raises(ModbusError):
+        parse_response(1, exception + struct.pack('<H', crc16(exception)), 2)
+
+
+def test_poll_reads_every_meter():
+    modbus = bus()
+    frame, capture = asyncio.run(modbus.poll())
+    assert capture is not None
+    assert sorted(frame) == [1, 2, 3]
+    assert frame[2] == pytest.approx({'voltage': 232.0, 'current': 16.0, 'power': 3682.0, 'energy': 123458.0})
+    assert modbus.stats()["timeouts"] == 0
+    assert read_request(2, 0, 14) in [request for meter in modbus.meters for request, _, _ in meter.reads]
+
+
+def test_silent_slave_is_reported_without_losing_the_others(caplog):
+    modbus = bus(silent={2})
+
+    async def poll(times):
+        return [await modbus.poll() for _ in range(times)]
+
+    with caplog.at_level(logging.INFO):
+        polls = asyncio.run(poll(OFFLINE_AFTER))
+    assert all(sorted(frame) == [1, 3] for frame, _ in polls)
+    assert modbus.stats()["timeouts"] == OFFLINE_AFTER  # The first read of meter 2 times out; the rest are skipped
+    offline = [record for record in caplog.records if "not responding" in record.getMessage()]
+    assert len(offline) == 1 and offline[0].levelno == logging.ERROR and "meter 2" in offline[0].getMessage()
+
+    modbus.serial.silent.clear()
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        frame, _ = asyncio.run(modbus.poll())
+    assert sorted(frame) == [1, 2, 3]
+    assert any("meter 2" in record.getMessage() and "is back" in record.getMessage() for record in caplog.records)
+
+
+def test_low_current_reads_as_zero_power():
+    meter = Meter(1, 1, SDM_REGISTERS, max_gap(BAUD))
+    blocks = []
+    for _, count, quantities in meter.reads:
+        data = bytearray(2 * count)
+        for quantity, offset, factor in quantities:
+            struct.pack_into('>f', data, 2 * offset, {'voltage': 230.0, 'current': 0.1, 'power': 23.0, 'energy': 5.0}[quantity])
+        blocks.append(bytes(data))
+    assert meter.decode(blocks) == pytest.approx({'voltage': 230.0, 'current': 0, 'power': 0, 'energy': 5000.0})
@@ -0,0 +1,131 @@
+import asyncio
+
+import meter_protocol
+from meter_protocol import (LEGACY_BAUD, TYPE_BAUD_ACK, TYPE_BAUD_REQUEST, TYPE_PING, TYPE_PONG, TYPE_SAMPLES,
+                            FrameDecoder, MeterLink, encode_frame, encode_samples)
+
+READING = {1: (230.0, 16.0, 3680.0, 1234)}
+
+
+def samples_frame(seq, reading=READING):
+    return encode_frame(TYPE_SAMPLES, encode_samples(reading), seq)
+
+
+class FakePort:
+    """In-memory aioserial port with an MCU behind it that answers the binary offer only if `binary`."""
+
+    def __init__(self, binary=True, ascii_lines=()):
+        self.binary = binary
+        self.baudrate = LEGACY_BAUD
+        self.timeout = 0.05
+        self.incoming = bytearray()
+        self.ascii_lines = list(ascii_lines)
+        self.mcu = FrameDecoder()
+
+    @property
+    def in_waiting(self):
+        return len(self.incoming)
+
+    async def write_async(self, data):
+        for seq, kind, payload in self.mcu.feed(data):
+            if not self.binary:
+                continue  # Legacy firmware ignores the offer
+            if kind == TYPE_BAUD_REQUEST:
+                self.incoming += encode_frame(TYPE_BAUD_ACK, payload, seq)
+            elif kind == TYPE_PING:
+                self.incoming += encode_frame(TYPE_PONG, b'', seq)
+
+    async def read_async(self, size=1):
+        if not self.incoming:
+            await asyncio.sleep(self.timeout)
+            return b''
+        data = bytes(self.incoming[:size])
+        del self.incoming[:size]
+        return data
+
+    async def readline_async(self):
+        if not self.ascii_lines:
+            await asyncio.sleep(self.timeout)
+            return b''
+        return self.ascii_lines.pop(0)
+
+
+def test_decoder_drops_bad_crc_and_resyncs():
+    decoder = FrameDecoder()
+    damaged = bytearray(samples_frame(2))
+    damaged[8] ^= 0x01  # One flipped bit in the payload
+    frames = decoder.feed(samples_frame(1) + bytes(damaged) + samples_frame(3))
+    assert [seq for seq, _, _ in frames] == [1, 3]
+    assert decoder.crc_errors >= 1
+    assert decoder.lost == 1  # Sequence 2 never arrived intact
+
+
+def test_decoder_handles_frames_split_across_reads():
+    decoder = FrameDecoder()
+    data = b'M1,230.0,16.00,3680.0\n' + samples_frame(7)
+    frames = []
+    for index in range(len(data)):
+        frames += decoder.feed(data[index:index + 1])
+    assert [(seq, kind) for seq, kind, _ in frames] == [(7, TYPE_SAMPLES)]
+    assert meter_protocol.decode_samples(frames[0][2])[1] == {'voltage': 230.0, 'current': 16.0, 'power': 3680.0,
+                                                             'energy': 1234}
+
+
+def test_legacy_mcu_keeps_ascii(monkeypatch):
+    monkeypatch.setattr(meter_protocol, "NEGOTIATION_TIMEOUT", 0.1)
+    port = FakePort(binary=False, ascii_lines=[b'M1,230.0,16.00,3680.0\n', b'M1,garbage\n'])
+    link = MeterLink(port, max_baud=115200)
+
+    async def run():
+        return await link.read_frame(), await link.read_frame()
+
+    good, bad = asyncio.run(run())
+    assert not link.binary and port.baudrate == LEGACY_BAUD
+    assert good == {1: {'voltage': 230.0, 'current': 16.0, 'power': 3680.0, 'energy': 0}}
+    assert bad is None and link.malformed == 1
+    assert link.stats()["mode"] == f"ascii@{LEGACY_BAUD}"
+
+
+def test_binary_link_rejects_corrupted_frames():
+    port = FakePort(binary=True)
+    link = MeterLink(port, max_baud=115200)
+
+    async def run():
+        await link.negotiate()
+        damaged = bytearray(samples_frame(2, {1: (999.0, 99.0, 99999.0, 1)}))
+        damaged[-1] ^= 0xFF  # Bad CRC
+        port.incoming += samples_frame(1) + bytes(damaged) + samples_frame(3)
+        readings = []
+        for _ in range(3):
+            readings.append(await link.read_frame())
+        return readings
+
+    readings = asyncio.run(run())
+    assert link.binary and port.baudrate == 115200
+    assert [reading for reading in readings if reading is not None] == \
+        [{1: {'voltage': 230.0, 'current': 16.0, 'power': 3680.0, 'energy': 1234}}] * 2
+    assert link.stats()["crc_errors"] >= 1
+
+
+def test_silent_binary_link_falls_back_and_renegotiates(monkeypatch):
+    monkeypatch.setattr(meter_protocol, "LINK_SILENCE", 0.1)
+    port = FakePort(binary=True)
+    link = MeterLink(port, max_baud=115200)
+
+    async def run():
+        await link.negotiate()
+        assert link.binary
+        port.binary = False  # The MCU reset and is back to ASCII at LEGACY_BAUD
+        while link.binary:
+            assert await link.read_frame() is None
+        return link
+
+    asyncio.run(run())
+    assert not link.negotiated and port.baudrate == LEGACY_BAUD
+
+
+def test_baud_offer_is_limited_to_max_baud():
+    port = FakePort(binary=True)
+    link = MeterLink(port, max_baud=57600)
+    asyncio.run(link.negotiate())
+    assert link.binary and port.baudrate == 57600
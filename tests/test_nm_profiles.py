@@ -0,0 +1,100 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+import nm_profiles
+
+# Stand-in for nmcli: records every call and keeps the saved and active profiles in a JSON file next to it
+STUB = '''#!{python}
+import json, os, sys
+directory = os.path.dirname(os.path.abspath(__file__))
+state_path = os.path.join(directory, "state.json")
+state = json.load(open(state_path)) if os.path.exists(state_path) else {{"profiles": [], "active": []}}
+args = sys.argv[1:]
+with open(os.path.join(directory, "calls.log"), "a") as log:
+    log.write(json.dumps(args) + "\\n")
+if args[-3:] == ["connection", "show", "--active"]:
+    print("\\n".join(f"{{name}}:wlan0" for name in state["active"]))
+elif args[-2:] == ["connection", "show"]:
+    print("\\n".join(f"{{name}}:802-11-wireless" for name in state["profiles"]))
+elif args[3:6] == ["device", "wifi", "list"]:
+    print("Home\\nNeighbour")
+elif args[:2] == ["connection", "add"]:
+    state["profiles"].append(args[args.index("con-name") + 1])
+elif args[:2] == ["connection", "up"]:
+    if args[2] not in state["profiles"] or args[2] in state.get("out_of_range", []):
+        sys.exit(10)
+    state["active"] = [args[2]]
+elif args[:2] == ["connection", "down"]:
+    state["active"].remove(args[2])
+json.dump(state, open(state_path, "w"))
+'''
+
+
+@pytest.fixture
+def nmcli(tmp_path, monkeypatch):
+    """Put the stub nmcli first on PATH; returns a function giving the calls since the last one."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    stub = bin_dir / "nmcli"
+    stub.write_text(STUB.format(python=sys.executable))
+    stub.chmod(stub.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.chdir(tmp_path)
+    nm_profiles.invalidate()
+    nm_profiles.last_switch.clear()
+    log = bin_dir / "calls.log"
+
+    def calls():
+        lines = log.read_text().splitlines() if log.exists() else []
+        log.write_text("")
+        return [json.loads(line) for line in lines]
+
+    return calls
+
+
+def test_second_switch_brings_the_saved_profile_up_by_name(nmcli):
+    assert nm_profiles.switch_to_station("Home", "secret", retry_delay=0)
+    first = nmcli()
+    assert ["connection", "up", "JP-Station-Home", "ifname", "wlan0"] in first
+    assert any(call[:2] == ["connection", "add"] for call in first)
+
+    assert nm_profiles.switch_to_hotspot("Joulepoint-Charger-Hotspot", "raspberry")
+    assert nm_profiles.current_mode() == "hotspot"
+    nmcli()
+
+    nm_profiles.invalidate()  # As after STATE_CACHE_SECONDS
+    assert nm_profiles.switch_to_station("Home", "secret", retry_delay=0)
+    second = nmcli()
+    assert ["connection", "up", "JP-Station-Home", "ifname", "wlan0"] in second
+    assert not [call for call in second if call[:2] in (["connection", "add"], ["connection", "modify"])]
+    assert not [call for call in second if "--rescan" in call or call[:3] == ["device", "wifi", "connect"]]
+    assert nm_profiles.last_switch["from"] == "hotspot" and nm_profiles.last_switch["to"] == "JP-Station-Home"
+    assert nm_profiles.last_switch["seconds"] >= 0
+
+
+def test_changed_password_modifies_the_profile(nmcli):
+    assert nm_profiles.switch_to_station("Home", "secret", retry_delay=0)
+    nm_profiles.deactivate("JP-Station-Home")
+    nmcli()
+    nm_profiles.invalidate()
+    assert nm_profiles.switch_to_station("Home", "changed", retry_delay=0)
+    assert [call[:3] for call in nmcli() if call[:2] == ["connection", "modify"]] == [["connection", "modify", "JP-Station-Home"]]
+
+
+def test_failed_activation_rescans_before_retrying(nmcli):
+    nm_profiles.ensure_station_profile("Home", "secret")
+    with open(os.path.join("bin", "state.json")) as file:
+        state = json.load(file)
+    state["out_of_range"] = ["JP-Station-Home"]  # `con up` fails while the network is not around
+    with open(os.path.join("bin", "state.json"), "w") as file:
+        json.dump(state, file)
+    nmcli()
+    assert not nm_profiles.switch_to_station("Home", "secret", attempts=2, retry_delay=0)
+    calls = nmcli()
+    assert len([call for call in calls if call[:2] == ["connection", "up"]]) == 2
+    assert len([call for call in calls if "--rescan" in call]) == 1  # The second attempt reuses the scan
+    assert nm_profiles.last_switch == {}
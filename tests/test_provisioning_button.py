@@ -0,0 +1,55 @@
+import hal
+import webserver
+from webserver import LONG_PRESS_SECONDS, ProvisioningButton
+
+SECOND = 1_000_000  # pigpio ticks are microseconds
+
+
+def button():
+    presses = []
+    button_input = hal.SimulatedInput(webserver.EMERGENCY_STOP_PIN, pull='up')
+    provisioning = ProvisioningButton(button_input, on_short_press=lambda: presses.append("short"),
+                                      on_long_press=lambda: presses.append("long")).start()
+    return button_input, provisioning, presses
+
+
+def press(button_input, start, seconds):
+    button_input.set_level(ProvisioningButton.PRESSED, tick=start)
+    button_input.set_level(1 - ProvisioningButton.PRESSED, tick=start + int(seconds * SECOND))
+
+
+def test_press_length_decides_between_hotspot_and_saved_network():
+    button_input, _, presses = button()
+    press(button_input, 10 * SECOND, 0.4)
+    assert presses == ["short"]
+    press(button_input, 20 * SECOND, LONG_PRESS_SECONDS)
+    assert presses == ["short", "long"]
+
+
+def test_press_across_tick_wraparound():
+    button_input, _, presses = button()
+    start = 2 ** 32 - SECOND
+    button_input.set_level(ProvisioningButton.PRESSED, tick=start)
+    button_input.set_level(1 - ProvisioningButton.PRESSED, tick=(start + 4 * SECOND) & 0xFFFFFFFF)
+    assert presses == ["long"]
+
+
+def test_repeated_levels_and_stopped_button_do_nothing():
+    button_input, provisioning, presses = button()
+    provisioning._on_edge(1, 0)  # pigpio repeats the level it reported last
+    provisioning._on_edge(2, 0)  # Watchdog timeout, no level change
+    assert presses == []
+    provisioning.stop()
+    press(button_input, 0, LONG_PRESS_SECONDS)
+    assert presses == [] and button_input.watchers == []
+
+
+def test_release_of_a_press_held_before_start_is_ignored():
+    presses = []
+    button_input = hal.SimulatedInput(webserver.EMERGENCY_STOP_PIN, pull='down')  # Reads PRESSED from the start
+    ProvisioningButton(button_input, on_short_press=lambda: presses.append("short"),
+                       on_long_press=lambda: presses.append("long")).start()
+    button_input.set_level(1)
+    assert presses == []
+    press(button_input, 0, 0.2)
+    assert presses == ["short"]
@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+
+import websockets
+
+import main
+import startup_profile
+from config_store import ConfigStore
+
+
+def running(coroutine_name):
+    return [task for task in asyncio.all_tasks() if task.get_coro().__qualname__ == f"ChargePoint.{coroutine_name}"]
+
+
+def test_reconnect_stops_the_previous_connection_and_reports_startup_once(workdir, monkeypatch):
+    monkeypatch.setattr(main, "config_store", ConfigStore(os.path.join(workdir, main.CONFIG_FILE)))
+    monkeypatch.setattr(startup_profile, "_marks", {})
+    reports = []
+    monkeypatch.setattr(startup_profile, "report", lambda: reports.append(dict(startup_profile._marks)))
+    connections = []
+
+    async def csms(ws):
+        connections.append(ws)
+        async for message in ws:
+            message = json.loads(message)
+            if message[0] != 2:
+                continue
+            payload = {}
+            if message[2] == "BootNotification":
+                payload = {"status": "Accepted", "currentTime": "2024-01-01T00:00:00Z", "interval": 300}
+            await ws.send(json.dumps([3, message[1], payload]))
+            if message[2] == "BootNotification" and len(connections) == 1:
+                await ws.close()  # The CSMS drops the first connection once the charger has booted
+
+    async def scenario():
+        async with websockets.serve(csms, "127.0.0.1", 0, subprotocols=["ocpp1.6j"]) as server:
+            port = server.sockets[0].getsockname()[1]
+            with open(main.CHARGER_CONFIG_FILE, "w") as file:
+                json.dump({"server_url": f"ws://127.0.0.1:{port}", "charger_id": "CP", "reconnection_delay": 0.1}, file)
+            charger = asyncio.create_task(main.main())
+            try:
+                while len(connections) < 2 or not reports:
+                    assert not charger.done(), charger
+                    await asyncio.sleep(0.05)
+                await asyncio.sleep(0.2)  # Let the second connection boot as well
+                return {name: len(running(name)) for name in
+                        ("monitor_emergency_stop_pin", "read_serial_data", "heartbeat", "process_function_call_queue")}
+            finally:
+                charger.cancel()
+                await asyncio.gather(charger, return_exceptions=True)
+
+    tasks = asyncio.run(scenario())
+    assert tasks == {"monitor_emergency_stop_pin": 1, "read_serial_data": 1, "heartbeat": 1, "process_function_call_queue": 1}
+    assert len(reports) == 1 and "boot accepted" in reports[0]
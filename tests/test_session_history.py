@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from session_history import SessionHistory, remove_spill_files
+
+START = 1_700_000_000
+SAMPLED = ("Energy.Active.Import.Register", "Power.Active.Import", "SoC")  # SoC has no meter field and is ignored
+
+
+def reading(index):
+    return {"energy": 1000 + index * 12.34, "power": 7400.0 - (index % 7) * 0.01, "voltage": 230.0, "current": 32.0}
+
+
+def record(history, count, context="Sample.Periodic", step=60):
+    for index in range(count):
+        history.add(context, START + index * step, reading(index))
+
+
+def test_samples_round_trip_through_ram_and_spill_files(tmp_path):
+    history = SessionHistory("tx", SAMPLED, start=START, directory=tmp_path, memory_cap=16)
+    record(history, 50)
+    assert len(history) == 50
+    assert history.disk_bytes() > 0  # Three chunks spilled, two samples still in RAM
+    entries = history.entries(max_entries=100)
+    assert [timestamp for _, _, timestamp, _ in entries] == [START + index * 60 for index in range(50)]
+    for index, (context, measurands, _, values) in enumerate(entries):
+        assert context == "Sample.Periodic" and measurands == ["Energy.Active.Import.Register", "Power.Active.Import"]
+        assert values == pytest.approx({"energy": reading(index)["energy"], "power": reading(index)["power"]})
+
+
+def test_entries_are_downsampled_keeping_first_and_last(tmp_path):
+    history = SessionHistory("tx", SAMPLED, ("Voltage",), start=START, directory=tmp_path, memory_cap=64)
+    record(history, 1000)
+    record(history, 10, context="Sample.Clock", step=900)
+    entries = history.entries(max_entries=50)
+    assert len(entries) <= 50
+    periodic = [timestamp for context, _, timestamp, _ in entries if context == "Sample.Periodic"]
+    assert periodic[0] == START and periodic[-1] == START + 999 * 60
+    assert any(context == "Sample.Clock" for context, _, _, _ in entries)
+    assert [timestamp for _, _, timestamp, _ in entries] == sorted(timestamp for _, _, timestamp, _ in entries)
+
+
+def test_ram_stays_bounded_for_long_sessions(tmp_path):
+    history = SessionHistory("tx", SAMPLED, start=START, directory=tmp_path, memory_cap=32)
+    record(history, 31)
+    bound = history.memory_bytes()  # Just below the cap, the most RAM a series holds
+    record(history, 5000)
+    assert history.memory_bytes() <= bound
+
+
+def test_discard_and_remove_spill_files(tmp_path):
+    history = SessionHistory("tx", SAMPLED, start=START, directory=tmp_path, memory_cap=8)
+    record(history, 20)
+    assert os.listdir(tmp_path) == ["tx-periodic.bin"]
+    history.discard()
+    assert os.listdir(tmp_path) == []
+
+    # A history left behind by a crash is removed by key, and a later session under another key starts empty
+    stale = SessionHistory("session-1-1", SAMPLED, start=START, directory=tmp_path, memory_cap=8)
+    record(stale, 20)
+    fresh = SessionHistory("session-1-2", SAMPLED, start=START, directory=tmp_path, memory_cap=8)
+    assert len(fresh) == 0 and fresh.entries() == []
+    remove_spill_files("session-1-1", directory=tmp_path)
+    assert os.listdir(tmp_path) == []
+
+
+def test_no_measurands_records_nothing(tmp_path):
+    history = SessionHistory("tx", (), (), start=START, directory=tmp_path)
+    record(history, 10)
+    assert len(history) == 0 and history.entries() == []
@@ -0,0 +1,84 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import session_store
+from session_store import INDEX_ENTRY, RECORD_FIELDS, SessionStore
+
+START = 1_700_000_000  # 2023-11-14T22:13:20Z
+
+
+def iso(epoch):
+    return datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def fill(store, count):
+    """Sessions 1..count, an hour apart, alternating connectors 1 and 2 and cycling through three tags."""
+    for transaction_id in range(1, count + 1):
+        start = START + transaction_id * 3600
+        store.append(transaction_id, transaction_id % 2 + 1, f"TAG{transaction_id % 3}", iso(start), iso(start + 1800),
+                     1000 * transaction_id, 1000 * transaction_id + 7000, "Local")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store, "BLOCK_ENTRIES", 8)  # Several blocks, so block skipping is exercised
+    store = SessionStore(str(tmp_path / "sessions.ndjson"))
+    yield store
+    store.close()
+
+
+def test_cursor_pages_through_a_filtered_query(store):
+    fill(store, 40)
+    since, until = START + 5 * 3600, START + 33 * 3600
+    pages, cursor = [], 0
+    while cursor is not None:
+        sessions, cursor = store.query(since, until, connector_id=1, cursor=cursor, limit=3)
+        pages.append([session["transaction_id"] for session in sessions])
+    # Sessions overlapping [since, until) on connector 1: the even ones; 4 ended before `since`, 33 starts at `until`
+    assert [transaction_id for page in pages for transaction_id in page] == list(range(6, 33, 2))
+    assert all(len(page) == 3 for page in pages[:-1])
+    assert store.query(transaction_id=17)[0][0]["id_tag"] == "TAG2"
+    assert store.get(41) is None
+
+
+def test_index_is_rebuilt_after_a_torn_record(store, tmp_path):
+    fill(store, 12)
+    store.close()
+    # A crash lost the last three index entries and left half a record behind
+    with open(store.index_path, 'r+b') as index:
+        index.truncate(9 * INDEX_ENTRY.size)
+    with open(store.path, 'ab') as data:
+        data.write(b'{"transaction_id":13,"connector')
+    clean_size = os.path.getsize(store.path) - len(b'{"transaction_id":13,"connector')
+
+    reopened = SessionStore(store.path)
+    reopened.repair()
+    assert os.path.getsize(reopened.path) == clean_size
+    assert os.path.getsize(reopened.index_path) == 12 * INDEX_ENTRY.size
+    assert [session["transaction_id"] for session in reopened.query(limit=100)[0]] == list(range(1, 13))
+    reopened.append(13, 1, "TAG1", iso(START), iso(START + 60), 0, 500, "Local")
+    assert reopened.get(13)["energy"] == 500
+    reopened.close()
+
+
+def test_exports_match_the_query(store, monkeypatch):
+    monkeypatch.setattr(session_store, "EXPORT_CHUNK", 256)  # Many chunks
+    fill(store, 30)
+    expected, _ = store.query(id_tag="TAG1", limit=100)
+    assert len(expected) == 10
+
+    ndjson = b''.join(store.export('ndjson', id_tag="TAG1"))
+    assert [json.loads(line) for line in ndjson.splitlines()] == expected
+
+    chunks = list(store.export('csv', id_tag="TAG1"))
+    assert len(chunks) > 1
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+    assert rows[0] == list(RECORD_FIELDS)
+    assert rows[1:] == [[str(session[field]) for field in RECORD_FIELDS] for session in expected]
+
+    assert list(store.export('csv', transaction_id=999)) == [(','.join(RECORD_FIELDS) + '\r\n').encode()]
@@ -0,0 +1,119 @@
+import pytest
+
+from smart_charging import (CHARGE_POINT_MAX_PROFILE, MIN_CHARGING_CURRENT, TX_DEFAULT_PROFILE, TX_PROFILE,
+                            ChargingProfiles, LoadManager, allocate, to_amps)
+
+NOW = 1_700_000_000
+CONFIG = {"ConnectorMaxCurrent": 32.0, "SiteCurrentLimit": 0}
+
+
+class Limiter:
+    def __init__(self):
+        self.limits = []
+
+    def set_current_limit(self, amps):
+        self.limits.append(amps)
+
+
+def profile(profile_id, purpose, limits, stack_level=0, unit='A', kind="Absolute", duration=None):
+    """`limits`: [(start_period, limit), ...] from NOW, or from the transaction start for Relative profiles."""
+    schedule = {"charging_rate_unit": unit,
+                "charging_schedule_period": [{"start_period": start, "limit": limit} for start, limit in limits]}
+    if kind == "Absolute":
+        schedule["start_schedule"] = "2023-11-14T22:13:20Z"  # NOW
+    if duration is not None:
+        schedule["duration"] = duration
+    return {"charging_profile_id": profile_id, "stack_level": stack_level, "charging_profile_purpose": purpose,
+            "charging_profile_kind": kind, "charging_schedule": schedule}
+
+
+def manager(connectors=(1, 2), config=CONFIG):
+    return LoadManager(ChargingProfiles(path=None), {connector_id: Limiter() for connector_id in connectors}, lambda: config)
+
+
+def test_unconstrained_connectors_get_their_caps():
+    assert allocate(None, [32, 16], [32, 16]) == [32, 16]
+    assert allocate(100, [32, 16, 32], [10, 16, 32]) == [32, 16, 32]
+
+
+def test_site_limit_is_shared_up_to_demand_then_cap():
+    limits = allocate(40, [32, 32, 32], [8, 32, 32])
+    assert sum(limits) == pytest.approx(40)
+    assert limits[0] == pytest.approx(8)
+    assert limits[1] == pytest.approx(16) and limits[2] == pytest.approx(16)
+
+
+def test_connectors_below_the_minimum_are_paused_latest_first():
+    assert allocate(12, [32, 32, 32], [32, 32, 32]) == [6.0, 6.0, 0.0]
+    assert allocate(5, [32, 32], [32, 32]) == [0.0, 0.0]
+
+
+def test_paused_connector_takes_no_share_of_the_site_limit():
+    assert allocate(30, [32, 0, 32], [32, 0, 32]) == [15.0, 0.0, 15.0]
+
+
+def test_allocation_never_exceeds_a_cap_below_the_minimum():
+    limits = allocate(20, [32, 4, 32], [32, 4, 32])
+    assert limits == [10.0, 0.0, 10.0]
+    assert allocate(100, [32, 4], [32, 4]) == [32, 0.0]
+
+
+@pytest.mark.parametrize("site_limit", [7, 13, 20, 45, 70])
+def test_allocations_stay_within_caps_and_site_limit(site_limit):
+    caps = [32, 10, 3, 16, 0]
+    limits = allocate(site_limit, caps, [32, 10, 3, 8, 0])
+    assert sum(limits) <= site_limit + 1e-9
+    for limit, cap in zip(limits, caps):
+        assert limit <= cap
+        assert limit == 0 or limit >= MIN_CHARGING_CURRENT
+
+
+def test_missing_number_phases_means_three():
+    assert to_amps(11040, 'W', None) == pytest.approx(16)
+    assert to_amps(3680, 'W', 1) == pytest.approx(16)
+    assert to_amps(16, 'A', None) == 16
+
+
+def test_composite_schedule_stacks_tx_default_and_charge_point_max():
+    loads = manager()
+    assert loads.profiles.install(0, profile(1, TX_DEFAULT_PROFILE, [(0, 20), (600, 10)]), {}) == 'Accepted'
+    # A connector's own TxDefaultProfile wins over connector 0's, and a higher stack level over a lower one
+    assert loads.profiles.install(1, profile(2, TX_DEFAULT_PROFILE, [(0, 24)]), {}) == 'Accepted'
+    assert loads.profiles.install(1, profile(3, TX_DEFAULT_PROFILE, [(0, 18)], stack_level=1, duration=300), {}) == 'Accepted'
+    assert loads.profiles.install(0, profile(4, CHARGE_POINT_MAX_PROFILE, [(0, 40), (900, 16)]), {}) == 'Accepted'
+
+    start, periods = loads.composite_schedule(1, 1200, now=NOW)
+    assert start == NOW
+    assert periods == [(0, 18), (300, 24), (900, 16)]
+    _, periods = loads.composite_schedule(2, 1200, now=NOW)
+    assert periods == [(0, 20), (600, 10)]
+    _, periods = loads.composite_schedule(0, 1200, now=NOW)
+    assert periods == [(0, 40), (900, 16)]
+
+
+def test_tx_profile_overrides_default_only_for_its_transaction():
+    loads = manager()
+    loads.profiles.install(1, profile(1, TX_DEFAULT_PROFILE, [(0, 20)]), {})
+    assert loads.profiles.install(1, profile(2, TX_PROFILE, [(0, 8)], kind="Relative"), {}) == 'Rejected'
+    loads.transaction_started(1, 1001, start=NOW)
+    assert loads.profiles.install(1, profile(2, TX_PROFILE, [(0, 8), (60, 12)], kind="Relative"), {}, transaction_id=1001) == 'Accepted'
+    assert loads.composite_schedule(1, 120, now=NOW)[1] == [(0, 8), (60, 12)]
+    loads.transaction_stopped(1)
+    assert loads.composite_schedule(1, 120, now=NOW)[1] == [(0, 20)]
+
+
+def test_composite_schedule_in_watts_uses_three_phases():
+    loads = manager()
+    loads.profiles.install(1, profile(1, TX_DEFAULT_PROFILE, [(0, 11040)], unit='W'), {})
+    assert loads.composite_schedule(1, 60, unit='W', now=NOW)[1] == [(0, 11040.0)]
+    assert loads.composite_schedule(1, 60, unit='A', now=NOW)[1] == [(0, 16.0)]
+
+
+def test_zero_amp_profile_pauses_a_connector_under_a_site_limit():
+    loads = manager((1, 2, 3), dict(CONFIG, SiteCurrentLimit=30))
+    loads.profiles.install(2, profile(1, TX_DEFAULT_PROFILE, [(0, 0)]), {})
+    for connector_id in (1, 2, 3):
+        loads.transaction_started(connector_id, 1000 + connector_id)
+    limits = loads.allocate_frame({1: 30.0, 2: 0.0, 3: 30.0})
+    assert limits == {1: 15.0, 2: 0.0, 3: 15.0}
+    assert loads.limiters[2].limits == [0.0]
@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from timeseries_store import (BLOCK_HEADER, RAW_FIELDS, SCALE, TimeSeriesStore, _parse_day, _put_varints, _varints,
+                              decode_block, encode_block)
+
+DAY = _parse_day('20260310', '%Y%m%d')  # Midnight UTC
+
+
+def decode(block):
+    header = BLOCK_HEADER.unpack(block[:BLOCK_HEADER.size])
+    return header, decode_block(header, block[BLOCK_HEADER.size:], len(RAW_FIELDS))
+
+
+def test_varints_round_trip():
+    numbers = [0, 1, -1, 63, -64, 64, 127, 128, -129, 2 ** 31, -(2 ** 31), 2 ** 53, -(2 ** 53)]
+    out = bytearray()
+    _put_varints(out, numbers)
+    assert list(_varints(out)) == numbers
+    assert len(out) < 8 * len(numbers)
+    out = bytearray()
+    _put_varints(out, [0, 1, -1, 63])
+    assert len(out) == 4  # Small deltas of either sign take one byte
+
+
+def test_block_round_trip_with_irregular_times_and_a_clock_step_back():
+    rows = [(1_700_000_000_000, 23000, 1600, 368000, 10),
+            (1_700_000_001_000, 23012, 1598, 367500, 112),
+            (1_700_000_002_500, 22990, 0, 0, 112),
+            (1_699_999_999_000, 23100, -5, -1150, 112),  # NTP stepped the clock back
+            (1_700_000_010_000, 2 ** 40, 3200, 736000, 2 ** 45)]
+    header, decoded = decode(encode_block(2, rows))
+    assert decoded == rows
+    assert header[:4] == (2, 5, 1_699_999_999_000, 1_700_000_010_000)
+    # Steady one-second samples cost a few bytes each
+    steady = [(1_700_000_000_000 + index * 1000, 23000 + index % 3, 1600, 368000, 10 * index) for index in range(600)]
+    block = encode_block(1, steady)
+    assert decode(block)[1] == steady
+    assert len(block) < 600 * 6
+
+
+def test_samples_round_trip_through_the_store(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), flush_interval=60)
+    store.last_flush = DAY
+    due = []
+    for second in range(150):
+        due.append(store.record(1, DAY + second, 230.04, 16.0, 3680.64, 1000.0 + second))
+        store.record(1, DAY + second + 0.5, 999.0, 99.0, 99.0, 99.0)  # Within RESOLUTION, dropped
+        if due[-1]:
+            store.write(store.take(DAY + second))
+    assert [second for second, flag in enumerate(due) if flag] == [60, 120]
+    rows = list(store.samples(1, DAY, DAY + 150))  # 121 written, the rest still buffered
+    assert len(rows) == 150 and store.writes == 2
+    assert rows[10] == pytest.approx((DAY + 10, 230.04, 16.0, 3680.64, 1010.0))
+    assert list(store.samples(2, DAY, DAY + 150)) == []
+
+
+def test_rollups_split_at_minute_and_day_boundaries(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), flush_interval=60)
+    # 23:58:30 to 00:01:29: 90 s, then a full minute, then 90 s into the next day
+    for second in range(-90, 90):
+        power = 1000.0 if second % 60 else 5000.0  # A peak on each minute boundary
+        store.record(1, DAY + second, 230.0, 10.0, power, 2000.0 + second)
+    store.flush(DAY + 90)
+    assert sorted(os.listdir(tmp_path)) == ["raw-20260309.seg", "raw-20260310.seg"]
+
+    store.maintain(DAY + 90)  # 10 March is not over yet; 9 March is, but its last flush may still be pending
+    assert not any(name.startswith("1min") for name in os.listdir(tmp_path))
+    store.maintain(DAY + 2 * 60)
+    rollups = list(store.rollups(1, DAY - 86400, DAY + 86400))
+    assert [row[0] - DAY for row in rollups] == [-120, -60]  # 23:58 (30 samples) and 23:59 (60 samples)
+    assert rollups[0][1:] == pytest.approx((230.0, 10.0, 1000.0, 1000.0, 2000.0 - 61))
+    assert rollups[1][3] == pytest.approx((59 * 1000.0 + 5000.0) / 60, abs=1 / SCALE)  # Average power of 23:59, in SCALE steps
+    assert rollups[1][4] == pytest.approx(5000.0) and rollups[1][5] == pytest.approx(2000.0 - 1)
+
+    store.maintain(DAY + 86400 + 2 * 60)
+    rollups = list(store.rollups(1, DAY - 86400, DAY + 86400))
+    assert [row[0] - DAY for row in rollups] == [-120, -60, 0, 60]
+    assert rollups[2][5] == pytest.approx(2000.0 + 59)  # Energy is the last register of the minute
+    store.maintain(DAY + 86400 + 3 * 60)
+    assert len(list(store.rollups(1, DAY - 86400, DAY + 86400))) == 4  # Each day is rolled up once
+
+
+def test_retention_and_query_tiers(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), flush_interval=60, raw_days=2, rollup_days=30)
+    for day in range(59, -1, -1):  # Oldest first, as a sample older than the last one is dropped
+        start = DAY - day * 86400
+        for second in range(0, 120):
+            store.record(1, start + second, 230.0, 16.0, 3680.0, day * 1000.0 + second)
+        store.flush(start + 120)
+    store.maintain(DAY + 3600)
+
+    raw = sorted(name for name in os.listdir(tmp_path) if name.startswith("raw"))
+    assert raw == ["raw-20260308.seg", "raw-20260309.seg", "raw-20260310.seg"]  # Today and RAW_DAYS before it
+    months = sorted(name for name in os.listdir(tmp_path) if name.startswith("1min"))
+    assert months == ["1min-202602.seg", "1min-202603.seg"]  # January ended more than 30 days ago
+
+    rows = list(store.query(1, DAY - 5 * 86400, DAY + 86400, now=DAY + 3600))
+    rolled = [row for row in rows if "power_max" in row]
+    full = [row for row in rows if "power_max" not in row]
+    assert [row["time"] for row in rolled] == [DAY - day * 86400 + minute for day in (5, 4, 3) for minute in (0, 60)]
+    assert len(full) == 3 * 120 and full[0]["time"] == DAY - 2 * 86400
+
+
+def test_torn_tail_is_skipped_and_cut_off(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    store.record(1, DAY, 230.0, 16.0, 3680.0, 1.0)
+    store.flush(DAY)
+    path = store.raw_path('20260310')
+    with open(path, 'ab') as file:
+        file.write(encode_block(1, [(int(DAY * 1000) + 5000, 1, 2, 3, 4)])[:-3])  # Power cut mid-append
+    assert len(list(store.samples(1, DAY, DAY + 60))) == 1
+
+    reopened = TimeSeriesStore(str(tmp_path))
+    reopened.record(1, DAY + 10, 231.0, 16.0, 3696.0, 2.0)
+    reopened.flush(DAY + 10)
+    assert [row[1] for row in reopened.samples(1, DAY, DAY + 60)] == [230.0, 231.0]
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+import websockets
+
+import main
+from config_store import ConfigStore
+from session_history import HISTORY_DIR
+
+
+class Csms:
+    """OCPP 1.6 central system stand-in that answers at once, except for the actions in `hold`."""
+
+    def __init__(self, hold=()):
+        self.hold = set(hold)
+        self.released = asyncio.Event()
+        self.calls = []  # (action, payload) in arrival order
+        self.transaction_id = 1000
+
+    def result(self, action):
+        if action == "StartTransaction":
+            self.transaction_id += 1
+            return {"transactionId": self.transaction_id, "idTagInfo": {"status": "Accepted"}}
+        if action in ("Authorize", "StopTransaction"):
+            return {"idTagInfo": {"status": "Accepted"}}
+        return {}
+
+    async def answer_when_released(self, ws, unique_id, action):
+        await self.released.wait()
+        await ws.send(json.dumps([3, unique_id, self.result(action)]))
+
+    async def handle(self, ws):
+        async for message in ws:
+            message = json.loads(message)
+            if message[0] != 2:
+                continue
+            _, unique_id, action, payload = message
+            self.calls.append((action, payload))
+            if action in self.hold:
+                asyncio.create_task(self.answer_when_released(ws, unique_id, action))
+            else:
+                await ws.send(json.dumps([3, unique_id, self.result(action)]))
+
+    def payloads(self, action):
+        return [payload for called, payload in self.calls if called == action]
+
+
+async def connected(csms, scenario):
+    """Run `scenario(cp)` with a ChargePoint connected to `csms`."""
+    async with websockets.serve(csms.handle, "127.0.0.1", 0, subprotocols=["ocpp1.6j"]) as server:
+        port = server.sockets[0].getsockname()[1]
+        async with websockets.connect(f"ws://127.0.0.1:{port}/CP", subprotocols=["ocpp1.6j"]) as ws:
+            cp = main.ChargePoint("CP", ws, hardware=main.Hardware(main.get_config_store().snapshot))
+            reader = asyncio.create_task(cp.start())
+            try:
+                return await scenario(cp)
+            finally:
+                reader.cancel()
+
+
+async def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def charger(workdir, monkeypatch):
+    monkeypatch.setattr(main, "config_store", ConfigStore(os.path.join(workdir, main.CONFIG_FILE)))
+    monkeypatch.setattr(main, "AUTHORIZE_TIMEOUT", 0.2)
+    monkeypatch.setattr(main, "START_CONFIRM_WAIT", 0.2)
+    return workdir
+
+
+def test_stop_before_start_confirmed_keeps_connector_until_confirmation(charger):
+    csms = Csms(hold={"StartTransaction"})
+
+    async def scenario(cp):
+        connector = cp.connectors[1]
+        assert await cp.start_transaction(1, "TAG1")
+        assert connector.relay.relay_state == 1
+        connector.energy = 1500
+
+        # StartTransaction.conf is late: the stop gives up waiting, de-energises and keeps the session journaled
+        await asyncio.wait_for(cp.stop_transaction(1, "Local"), 2)
+        assert connector.relay.relay_state == 0
+        assert connector.status == "Finishing"
+        assert cp.journal.open_transactions()[1]["stop"]["meter_stop"] == 1500
+        assert not csms.payloads("StopTransaction")
+        # Another session would overwrite the journal entry of this one
+        assert not await cp.start_transaction(1, "TAG2")
+
+        csms.released.set()
+        await wait_until(lambda: connector.transaction is None)
+        assert csms.payloads("StopTransaction") == [
+            {"meterStop": 1500, "timestamp": csms.payloads("StopTransaction")[0]["timestamp"],
+             "transactionId": 1001, "reason": "Local", "idTag": "TAG1"}]
+        assert connector.status == "Available"
+        assert cp.journal.open_transactions() == {}
+        assert cp.sessions.get(1001)["meter_stop"] == 1500
+
+    asyncio.run(connected(csms, scenario))
+
+
+def test_recovery_closes_unconfirmed_stop_and_removes_its_history(charger):
+    async def disconnect_before_confirmation(cp):
+        assert await cp.start_transaction(1, "TAG1")
+        cp.connectors[1].energy = 700
+        await cp.stop_transaction(1, "EVDisconnected")
+        return cp.journal.open_transactions()[1]
+
+    entry = asyncio.run(connected(Csms(hold={"StartTransaction"}), disconnect_before_confirmation))
+    assert entry["transaction_id"] is None and entry["history"]
+    # A spill file written before the power cut; it must not end up in a later session on this connector
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    spill_file = os.path.join(HISTORY_DIR, f"{entry['history']}-periodic.bin")
+    with open(spill_file, "wb") as file:
+        file.write(b"stale")
+
+    csms = Csms()
+
+    async def recover(cp):
+        await cp._recover_transactions()
+        return cp
+
+    cp = asyncio.run(connected(csms, recover))
+    assert [action for action, _ in csms.calls if action in ("StartTransaction", "StopTransaction")] == \
+        ["StartTransaction", "StopTransaction"]
+    assert csms.payloads("StartTransaction")[0]["timestamp"] == entry["start_time"]
+    stop = csms.payloads("StopTransaction")[0]
+    assert (stop["transactionId"], stop["meterStop"], stop["reason"]) == (1001, 700, "EVDisconnected")
+    assert cp.journal.open_transactions() == {}
+    assert not os.path.exists(spill_file)
+    assert cp.sessions.get(1001)["reason"] == "EVDisconnected"
+
+
+def test_sessions_on_a_connector_do_not_share_history(charger):
+    keys = []
+
+    async def two_sessions(cp):
+        for id_tag in ("TAG1", "TAG2"):
+            assert await cp.start_transaction(1, id_tag)
+            await wait_until(lambda: cp.connectors[1].transaction.transaction_id is not None)
+            keys.append(cp.journal.open_transactions()[1]["history"])
+            await cp.stop_transaction(1, "Local")
+            await asyncio.sleep(0.002)
+
+    asyncio.run(connected(Csms(), two_sessions))
+    assert len(set(keys)) == 2
+
+
+def test_start_is_refused_while_energising_is_forbidden(charger):
+    csms = Csms()
+
+    async def scenario(cp):
+        connector = cp.connectors[1]
+        cp.emergency_status = 1
+        assert not await cp.start_transaction(1, "TAG1")
+        cp.emergency_status = 0
+
+        # A fault that trips while the CSMS is being asked
+        async def authorize_during_fault(id_tag):
+            for _ in range(5):
+                cp.fault_evaluator.evaluate(1, 400.0, 10.0, False, time.monotonic())
+            return True
+
+        cp.authorize = authorize_during_fault
+        assert not await cp.start_transaction(1, "TAG1")
+        assert connector.transaction is None and connector.relay.relay_state == 0
+        assert connector.status == "Available"
+        assert cp.journal.open_transactions() == {}
+
+    asyncio.run(connected(csms, scenario))
+    assert not csms.payloads("Authorize") and not csms.payloads("StartTransaction")
@@ -0,0 +1,434 @@
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+TIMESERIES_DIR = "meter_history"
+SCALE = 100  # Values are stored as fixed-point hundredths (0.01 V / A / W / Wh), as in session_history
+RAW_FIELDS = ('voltage', 'current', 'power', 'energy')
+ROLLUP_FIELDS = ('voltage', 'current', 'power', 'power_max', 'energy')  # Minute averages, peak power, last register
+ROLLUP_SECONDS = 60
+RESOLUTION = 1.0  # Seconds between recorded samples of a connector
+FLUSH_INTERVAL = 60  # Seconds of samples buffered in RAM before they are written
+RAW_DAYS = 7  # Days kept at full resolution
+ROLLUP_DAYS = 180  # Days kept as 1-minute rollups
+MAINTENANCE_INTERVAL = 3600  # Seconds between rollup/retention passes
+PAGE_SIZE = 4096  # Flash page assumed by the write-amplification estimate in benchmark()
+
+# Segment files are a sequence of blocks: this header, then the payload. The
+# payload holds each row as zigzag varints: the time delta-of-delta (ms) and
+# the delta of every value from the previous row.
+BLOCK_HEADER = struct.Struct('<HHqqII')  # connector, rows, min and max time (ms), payload length, CRC-32 of the payload
+
+
+def _put_varints(out, numbers):
+    for number in numbers:
+        number = number << 1 if number >= 0 else (-number << 1) - 1
+        while number > 0x7f:
+            out.append(number & 0x7f | 0x80)
+            number >>= 7
+        out.append(number)
+
+
+def _varints(data):
+    number = shift = 0
+    for byte in data:
+        number |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield (number >> 1) ^ -(number & 1)
+        number = shift = 0
+
+
+def encode_block(connector_id, rows):
+    """Header and payload for a connector's (time ms, *fixed-point values) rows, in the order given."""
+    payload = bytearray()
+    times = [row[0] for row in rows]
+    previous = (min(times),) + (0,) * (len(rows[0]) - 1)  # The clock may have stepped back within a block
+    previous_delta = 0
+    for row in rows:
+        delta = row[0] - previous[0]
+        _put_varints(payload, [delta - previous_delta] + [value - last for value, last in zip(row[1:], previous[1:])])
+        previous, previous_delta = row, delta
+    return BLOCK_HEADER.pack(connector_id, len(rows), min(times), max(times), len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_block(header, payload, width):
+    _, count, first, *_ = header
+    numbers = _varints(payload)
+    rows = []
+    time_ms, delta = first, 0
+    values = [0] * width
+    for _ in range(count):
+        delta += next(numbers)
+        time_ms += delta
+        for index in range(width):
+            values[index] += next(numbers)
+        rows.append((time_ms, *values))
+    return rows
+
+
+def read_blocks(path, width, connector_id=None, since_ms=None, until_ms=None):
+    """
+    Yield (connector id, rows) of each block of a segment file that may hold
+    rows of `connector_id` (any when None) in [since_ms, until_ms); other
+    blocks are skipped unread. Stops at a torn tail.
+    """
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with file:
+        while True:
+            raw_header = file.read(BLOCK_HEADER.size)
+            if len(raw_header) < BLOCK_HEADER.size:
+                return
+            header = BLOCK_HEADER.unpack(raw_header)
+            block_connector, _, low, high, length, crc = header
+            if (connector_id is not None and block_connector != connector_id) or \
+                    (since_ms is not None and high < since_ms) or (until_ms is not None and low >= until_ms):
+                file.seek(length, os.SEEK_CUR)
+                continue
+            payload = file.read(length)
+            if len(payload) < length:
+                return
+            if zlib.crc32(payload) != crc:
+                logging.warning(f"Skipping a corrupted block in {path}")
+                continue
+            yield block_connector, decode_block(header, payload, width)
+
+
+def read_headers(path):
+    """Yield (header, end offset) of each complete block of a segment file, without reading the payloads."""
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with file:
+        size = os.fstat(file.fileno()).st_size
+        end = 0
+        while end + BLOCK_HEADER.size <= size:
+            file.seek(end)
+            header = BLOCK_HEADER.unpack(file.read(BLOCK_HEADER.size))
+            if end + BLOCK_HEADER.size + header[4] > size:
+                return
+            end += BLOCK_HEADER.size + header[4]
+            yield header, end
+
+
+def valid_length(path):
+    """Bytes of a segment file up to the end of its last complete block."""
+    end = 0
+    for _, end in read_headers(path):
+        pass
+    return end
+
+
+def _day(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y%m%d')
+
+
+def _parse_day(value, fmt):
+    return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc).timestamp()
+
+
+class TimeSeriesStore:
+    """
+    Per-connector meter history on the SD card, in two tiers:
+
+        raw-<YYYYMMDD>.seg   one sample per RESOLUTION per connector, kept RAW_DAYS
+        1min-<YYYYMM>.seg    1-minute rollups, kept ROLLUP_DAYS
+
+    record() keeps samples in RAM and reports when FLUSH_INTERVAL has passed;
+    flush() then writes them as one block per connector, all in a single
+    fsync'd append, so the card sees one small write a minute instead of one
+    per sample. take() and write() split a flush so the append can run on a
+    worker thread. maintain() rolls each
+    complete day up into its month
+    file and deletes files past their retention, so nothing is rewritten in
+    place. Blocks carry their time span and a CRC: range queries skip blocks
+    outside the range, and a torn or corrupted block is skipped.
+    """
+
+    def __init__(self, directory=TIMESERIES_DIR, resolution=RESOLUTION, flush_interval=FLUSH_INTERVAL,
+                 raw_days=RAW_DAYS, rollup_days=ROLLUP_DAYS):
+        self.directory = directory
+        self.resolution = resolution
+        self.flush_interval = flush_interval
+        self.raw_days = raw_days
+        self.rollup_days = rollup_days
+        self.pending = {}  # connector_id: rows recorded since the last flush
+        self.last_sample = {}  # connector_id: time of its last recorded sample
+        self.last_flush = time.time()
+        self.checked = set()  # Segment files whose tail was validated by this process
+        self.lock = threading.Lock()  # maintain() runs on a worker thread
+        self.maintain_lock = threading.Lock()  # A pass still running after a reconnect is not started twice
+        self.bytes_written = 0
+        self.writes = 0
+
+    def record(self, connector_id, timestamp, voltage, current, power, energy):
+        """Buffer a sample; True once a flush is due."""
+        if timestamp - self.last_sample.get(connector_id, 0.0) < self.resolution:
+            return False
+        self.last_sample[connector_id] = timestamp
+        rows = self.pending.get(connector_id)
+        if rows is None:
+            rows = self.pending[connector_id] = []
+        rows.append((int(timestamp * 1000), round(voltage * SCALE), round(current * SCALE), round(power * SCALE),
+                     round(energy * SCALE)))
+        return timestamp - self.last_flush >= self.flush_interval
+
+    def flush(self, now=None):
+        """Write the buffered samples, one block per connector and day."""
+        self.write(self.take(now))
+
+    def take(self, now=None):
+        """Hand over the buffered samples for write(); cheap, so it runs where record() does."""
+        self.last_flush = time.time() if now is None else now
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def write(self, pending):
+        """Encode and append samples from take(). Blocking, so main.py runs it on a worker thread."""
+        days = {}
+        for connector_id, rows in pending.items():
+            blocks = {}
+            for row in rows:
+                blocks.setdefault(_day(row[0] / 1000), []).append(row)
+            for day, block in blocks.items():
+                days.setdefault(day, []).append(encode_block(connector_id, block))
+        for day, blocks in days.items():
+            self._append(self.raw_path(day), b''.join(blocks))
+
+    def _append(self, path, data):
+        try:
+            with self.lock:
+                if path not in self.checked:
+                    os.makedirs(self.directory, exist_ok=True)
+                    if os.path.exists(path):
+                        length = valid_length(path)
+                        if length != os.path.getsize(path):
+                            logging.warning(f"Cutting off a torn block at byte {length} of {path}")
+                            os.truncate(path, length)
+                    self.checked.add(path)
+                with open(path, 'ab') as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                self.bytes_written += len(data)
+                self.writes += 1
+        except OSError as e:
+            logging.error(f"Failed to write meter history to {path}: {e}")
+
+    def raw_path(self, day):
+        return os.path.join(self.directory, f"raw-{day}.seg")
+
+    def rollup_path(self, month):
+        return os.path.join(self.directory, f"1min-{month}.seg")
+
+    def _files(self, prefix):
+        """(period start epoch, path) of a tier's files, oldest first."""
+        fmt = '%Y%m%d' if prefix == 'raw' else '%Y%m'
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return files
+        for name in names:
+            parts = name[:-4].split('-')
+            if not name.endswith('.seg') or len(parts) != 2 or parts[0] != prefix:
+                continue
+            try:
+                files.append((_parse_day(parts[1], fmt), os.path.join(self.directory, name)))
+            except ValueError:
+                continue
+        return sorted(files)
+
+    def samples(self, connector_id, since, until):
+        """Yield (time, voltage, current, power, energy) at full resolution in [since, until), including unwritten samples."""
+        since_ms, until_ms = int(since * 1000), int(until * 1000)
+        for start, path in self._files('raw'):
+            if start + 86400 <= since or start >= until:
+                continue
+            for _, rows in read_blocks(path, len(RAW_FIELDS), connector_id, since_ms, until_ms):
+                for row in rows:
+                    if since_ms <= row[0] < until_ms:
+                        yield (row[0] / 1000, *(value / SCALE for value in row[1:]))
+        for row in list(self.pending.get(connector_id, ())):
+            if since_ms <= row[0] < until_ms:
+                yield (row[0] / 1000, *(value / SCALE for value in row[1:]))
+
+    def rollups(self, connector_id, since, until):
+        """Yield (minute start, voltage, current, power, power_max, energy) in [since, until)."""
+        since_ms, until_ms = int(since * 1000), int(until * 1000)
+        for start, path in self._files('1min'):
+            if start >= until or _next_month(start) <= since:
+                continue
+            for _, rows in read_blocks(path, len(ROLLUP_FIELDS), connector_id, since_ms, until_ms):
+                for row in rows:
+                    if since_ms <= row[0] < until_ms:
+                        yield (row[0] / 1000, *(value / SCALE for value in row[1:]))
+
+    def query(self, connector_id, since, until, now=None):
+        """
+        Yield {'time', field: value} dicts: full resolution where it is still
+        kept, 1-minute rollups (with power_max) before that.
+        """
+        now = time.time() if now is None else now
+        horizon = max(since, _parse_day(_day(now), '%Y%m%d') - self.raw_days * 86400)
+        if since < horizon:
+            for row in self.rollups(connector_id, since, min(until, horizon)):
+                yield dict(zip(('time',) + ROLLUP_FIELDS, row))
+        for row in self.samples(connector_id, horizon, until):
+            yield dict(zip(('time',) + RAW_FIELDS, row))
+
+    def maintain(self, now=None):
+        """Roll complete days up into 1-minute rows and delete files past retention. Safe to run on a worker thread."""
+        if not self.maintain_lock.acquire(blocking=False):
+            return
+        try:
+            self._maintain(time.time() if now is None else now)
+        finally:
+            self.maintain_lock.release()
+
+    def _maintain(self, now):
+        today = _parse_day(_day(now), '%Y%m%d')
+        rolled = set()
+        for _, path in self._files('1min'):
+            # roll_up() writes one block per connector and day, so the block headers tell which days are done
+            rolled.update(_day(header[2] / 1000) for header, _ in read_headers(path))
+        for start, path in self._files('raw'):
+            day = _day(start)
+            # A day is rolled up once its last samples have surely been flushed
+            if start + 86400 + 2 * self.flush_interval <= now and day not in rolled:
+                self.roll_up(path, day)
+            if start < today - self.raw_days * 86400:
+                self._remove(path)
+        for start, path in self._files('1min'):
+            if _next_month(start) <= now - self.rollup_days * 86400:
+                self._remove(path)
+
+    def roll_up(self, raw_path, day):
+        connectors = {}  # connector: {minute (ms): [samples, V sum, I sum, P sum, peak P, (time, energy) of the last]}
+        for connector_id, rows in read_blocks(raw_path, len(RAW_FIELDS)):
+            minutes = connectors.setdefault(connector_id, {})
+            for time_ms, voltage, current, power, energy in rows:
+                minute = time_ms - time_ms % (ROLLUP_SECONDS * 1000)
+                slot = minutes.get(minute)
+                if slot is None:
+                    minutes[minute] = [1, voltage, current, power, power, (time_ms, energy)]
+                    continue
+                slot[0] += 1
+                slot[1] += voltage
+                slot[2] += current
+                slot[3] += power
+                slot[4] = max(slot[4], power)
+                slot[5] = max(slot[5], (time_ms, energy))
+        blocks = [encode_block(connector_id, [(minute, slot[1] // slot[0], slot[2] // slot[0], slot[3] // slot[0], slot[4],
+                                               slot[5][1]) for minute, slot in sorted(minutes.items())])
+                  for connector_id, minutes in sorted(connectors.items())]
+        if blocks:
+            self._append(self.rollup_path(day[:6]), b''.join(blocks))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.checked.discard(path)
+        except OSError as e:
+            logging.error(f"Failed to remove expired meter history {path}: {e}")
+
+    def close(self):
+        self.flush()
+
+
+def _next_month(start):
+    moment = datetime.fromtimestamp(start, timezone.utc)
+    return moment.replace(year=moment.year + moment.month // 12, month=moment.month % 12 + 1, day=1, hour=0, minute=0,
+                          second=0).timestamp()
+
+
+def benchmark(connectors=3, hours=24, rollup_days=180):
+    """Bytes per sample, flash write amplification, record cost and query speed against JSON lines."""
+    import json
+    import random
+    import tempfile
+
+    def pages(appends):
+        # Flash pages programmed: every page an fsync'd append touches, plus one for the file system metadata
+        return sum((offset + length - 1) // PAGE_SIZE - offset // PAGE_SIZE + 2 for offset, length in appends)
+
+    start = _parse_day('20260101', '%Y%m%d')
+    seconds = hours * 3600
+    samples = []
+    energy = [0.0] * connectors
+    for second in range(seconds):
+        for connector in range(connectors):
+            # 20 minutes charging at 16 A, 10 minutes idle, with meter noise
+            current = 16 + random.gauss(0, 0.05) if (second // 600 + connector) % 3 else 0.0
+            voltage = 230 + random.gauss(0, 0.4)
+            energy[connector] += voltage * current / 3600
+            samples.append((connector + 1, start + second, voltage, current, voltage * current, energy[connector]))
+    payload = len(samples) * 40  # Time and four values as float64
+    print(f"{connectors} connectors, {hours} h at 1 sample/s: {len(samples)} samples")
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TimeSeriesStore(directory)
+        store.last_flush = start
+        appends = []
+        append = store._append
+
+        def tracked(path, data):
+            appends.append((os.path.getsize(path) if os.path.exists(path) else 0, len(data)))
+            append(path, data)
+        store._append = tracked
+        started = time.perf_counter()
+        for sample in samples:
+            if store.record(*sample):
+                store.flush(sample[1])
+        store.flush()
+        elapsed = time.perf_counter() - started
+        disk = sum(os.path.getsize(path) for _, path in store._files('raw'))
+        print(f"  segments                    {disk / len(samples):6.2f} B/sample on disk, {len(appends):6d} writes, "
+              f"{pages(appends) * PAGE_SIZE / len(samples):7.1f} B/sample to flash; "
+              f"record() {elapsed / len(samples) * 1e6:.2f} us/sample")
+
+        for label, per_write in (("per sample", 1), (f"every {FLUSH_INTERVAL}s", FLUSH_INTERVAL * connectors)):
+            json_appends = []
+            size = 0
+            lines = [len(json.dumps({"connector_id": sample[0], "timestamp": sample[1], "voltage": sample[2],
+                                     "current": sample[3], "power": sample[4], "energy": sample[5]})) + 1
+                     for sample in samples]
+            for first in range(0, len(lines), per_write):
+                length = sum(lines[first:first + per_write])
+                json_appends.append((size, length))
+                size += length
+            print(f"  JSON lines, fsync {label:9s} {size / len(samples):6.2f} B/sample on disk, {len(json_appends):6d} writes, "
+                  f"{pages(json_appends) * PAGE_SIZE / len(samples):7.1f} B/sample to flash")
+
+        started = time.perf_counter()
+        store.maintain(start + seconds + 86400)
+        print(f"  roll-up of {hours} h for {connectors} connectors: {time.perf_counter() - started:.2f}s, "
+              f"{sum(os.path.getsize(path) for _, path in store._files('1min')) / connectors / hours:.0f} B per connector-hour")
+
+        # Half a year of rollups for connector 1
+        for day in range(rollup_days):
+            day_start = int((start - (day + 1) * 86400) * 1000)
+            rows = [(day_start + minute * 60000, 23000, 1600, 368000, 368000, day * 883200 + minute * 613)
+                    for minute in range(1440)]
+            store._append(store.rollup_path(_day(day_start / 1000)[:6]), encode_block(1, rows))
+        for label, function in (
+                ("1 h, full resolution", lambda: list(store.samples(1, start + 3600, start + 7200))),
+                (f"{hours} h, full resolution", lambda: list(store.samples(1, start, start + seconds))),
+                ("1 day of rollups, 5 months ago", lambda: list(store.rollups(1, start - 150 * 86400, start - 149 * 86400))),
+                (f"{rollup_days} days of rollups", lambda: list(store.rollups(1, start - rollup_days * 86400, start)))):
+            started = time.perf_counter()
+            rows = function()
+            print(f"  query {label:32s} {len(rows):7d} rows in {(time.perf_counter() - started) * 1e3:7.1f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+import time
+
+JOURNAL_FILE = "transactions.journal"
+# Seconds between energy checkpoints of a running transaction
+METER_CHECKPOINT_INTERVAL = 60
+# Rewrite the journal with only the open transactions once it grows past this
+COMPACT_BYTES = 64 * 1024
+
+
+class TransactionJournal:
+    """
+    Append-only, fsync'd record of transactions that have not been closed at
+    the CSMS, one JSON object per line:
+
+        start     a transaction was accepted by the CSMS, or charging started
+                  locally with a null transaction_id still to be confirmed;
+                  names the session history's spill files
+        confirmed StartTransaction.conf gave the locally started transaction its id
+        meter     last known energy register (Wh) of a running transaction
+        stopping  StopTransaction was decided, with its meterStop/timestamp/reason
+        stopped   the CSMS has answered StopTransaction
+
+    Replaying the lines gives the open transactions by connector, so a power
+    cut loses at most METER_CHECKPOINT_INTERVAL of energy. A torn last line
+    is ignored.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.last_checkpoint = {}  # connector_id: time of the last meter line
+        self.file = None
+        self.entries = self.replay()  # connector_id: open transaction
+
+    def replay(self):
+        entries = {}
+        try:
+            with open(self.path, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        op = record.pop("op")
+                        connector_id = int(record["connector_id"])
+                    except (ValueError, KeyError, TypeError):
+                        logging.warning(f"Skipping damaged line in {self.path}: {line.strip()!r}")
+                        continue
+                    if op == "start":
+                        record["connector_id"] = connector_id
+                        record.setdefault("energy", record.get("meter_start", 0))
+                        entries[connector_id] = record
+                    elif op == "confirmed":
+                        if connector_id in entries and entries[connector_id]["transaction_id"] is None:
+                            entries[connector_id]["transaction_id"] = record.get("transaction_id")
+                            if "stop" in entries[connector_id]:
+                                entries[connector_id]["stop"]["transaction_id"] = record.get("transaction_id")
+                    elif connector_id in entries and entries[connector_id]["transaction_id"] == record.get("transaction_id"):
+                        if op == "stopped":
+                            del entries[connector_id]
+                        elif op == "meter":
+                            entries[connector_id].update(energy=record["energy"], timestamp=record["timestamp"])
+                        elif op == "stopping":
+                            entries[connector_id]["stop"] = record
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def open_transactions(self):
+        """Copies of the transactions that were not closed at the CSMS, by connector."""
+        return {connector_id: dict(entry) for connector_id, entry in self.entries.items()}
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        try:
+            if self.file is None:
+                created = not os.path.exists(self.path)
+                self.file = open(self.path, 'a')
+                if created:
+                    self._fsync_dir()
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            logging.error(f"Failed to write transaction journal {self.path}: {e}")
+
+    def started(self, connector_id, transaction_id, id_tag, meter_start, start_time, history=None):
+        """`history` names the session's spill files, so whoever closes the entry can remove them."""
+        entry = {"connector_id": connector_id, "transaction_id": transaction_id, "id_tag": id_tag,
+                 "meter_start": meter_start, "start_time": start_time, "timestamp": time.time()}
+        if history is not None:
+            entry["history"] = history
+        self._append(dict(entry, op="start"))
+        self.entries[connector_id] = dict(entry, energy=meter_start)
+        self.last_checkpoint[connector_id] = entry["timestamp"]
+
+    def confirmed(self, connector_id, transaction_id):
+        """Record the id StartTransaction.conf gave a transaction that was started with none."""
+        entry = self.entries.get(connector_id)
+        if entry is None or entry["transaction_id"] is not None:
+            return
+        self._append({"op": "confirmed", "connector_id": connector_id, "transaction_id": transaction_id})
+        entry["transaction_id"] = transaction_id
+        if "stop" in entry:
+            entry["stop"]["transaction_id"] = transaction_id
+
+    def meter(self, connector_id, energy, now=None):
+        """Checkpoint the energy register, at most once per METER_CHECKPOINT_INTERVAL."""
+        entry = self.entries.get(connector_id)
+        now = time.time() if now is None else now
+        if entry is None or "stop" in entry or now - self.last_checkpoint.get(connector_id, 0) < METER_CHECKPOINT_INTERVAL:
+            return
+        energy = int(energy)
+        self._append({"op": "meter", "connector_id": connector_id, "transaction_id": entry["transaction_id"],
+                      "energy": energy, "timestamp": now})
+        entry.update(energy=energy, timestamp=now)
+        self.last_checkpoint[connector_id] = now
+
+    def stopping(self, connector_id, meter_stop, timestamp, reason):
+        entry = self.entries.get(connector_id)
+        if entry is None:
+            return
+        stop = {"connector_id": connector_id, "transaction_id": entry["transaction_id"],
+                "meter_stop": meter_stop, "timestamp": timestamp, "reason": reason}
+        self._append(dict(stop, op="stopping"))
+        entry["stop"] = stop
+
+    def stopped(self, connector_id):
+        entry = self.entries.pop(connector_id, None)
+        self.last_checkpoint.pop(connector_id, None)
+        if entry is None:
+            return
+        self._append({"op": "stopped", "connector_id": connector_id, "transaction_id": entry["transaction_id"]})
+        try:
+            if os.path.getsize(self.path) > COMPACT_BYTES:
+                self.compact()
+        except OSError:
+            pass
+
+    def compact(self):
+        """Atomically rewrite the journal with one start (+ meter/stopping) line per open transaction."""
+        lines = []
+        for connector_id, entry in self.entries.items():
+            start = {key: value for key, value in entry.items() if key not in ("energy", "stop")}
+            lines.append(dict(start, op="start"))
+            lines.append({"op": "meter", "connector_id": connector_id, "transaction_id": entry["transaction_id"],
+                          "energy": entry["energy"], "timestamp": entry["timestamp"]})
+            if "stop" in entry:
+                lines.append(dict(entry["stop"], op="stopping"))
+        temp_file = f"{self.path}.tmp"
+        try:
+            with open(temp_file, 'w') as file:
+                file.writelines(json.dumps(line, separators=(',', ':')) + "\n" for line in lines)
+                file.flush()
+                os.fsync(file.fileno())
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            os.replace(temp_file, self.path)
+            self._fsync_dir()
+        except OSError as e:
+            logging.error(f"Failed to compact transaction journal {self.path}: {e}")
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def benchmark(transactions=200, checkpoints=60):
+    """Cost of journaling against rewriting the whole state file on every change."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = TransactionJournal(os.path.join(directory, JOURNAL_FILE))
+        started = time.perf_counter()
+        writes = 0
+        for transaction_id in range(transactions):
+            journal.started(1, transaction_id, "TAG", 0, "2024-01-01T00:00:00")
+            for checkpoint in range(checkpoints):
+                journal.meter(1, checkpoint * 100, now=time.time() + (checkpoint + 1) * METER_CHECKPOINT_INTERVAL)
+            journal.stopping(1, checkpoints * 100, "2024-01-01T01:00:00", "Local")
+            journal.stopped(1)
+            writes += checkpoints + 3
+        elapsed = time.perf_counter() - started
+        line = json.dumps({"op": "meter", "connector_id": 1, "transaction_id": 1001, "energy": 12345, "timestamp": time.time()},
+                          separators=(',', ':'))
+        print(f"journal: {writes} fsync'd appends in {elapsed:.2f}s ({elapsed / writes * 1e3:.2f} ms each), "
+              f"{len(line) + 1} bytes per checkpoint")
+
+        config_file = os.path.join(directory, "config.json")
+        with open("config.json", 'r') as file:
+            config = json.load(file)
+        started = time.perf_counter()
+        rounds = 200
+        for index in range(rounds):
+            config["active_transactions"] = {"1": {"transaction_id": index, "energy": index}}
+            with open(config_file + ".tmp", 'w') as file:
+                json.dump(config, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(config_file + ".tmp", config_file)
+        elapsed = time.perf_counter() - started
+        print(f"config.json rewrite: {elapsed / rounds * 1e3:.2f} ms each, {os.path.getsize(config_file)} bytes per write")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,38 +1,44 @@
 import os
 import json
-import subprocess
-from flask import Flask, request, render_template, flash, redirect, url_for # type: ignore
+from flask import Flask, request, render_template, flash, redirect, url_for, Response, stream_with_context, jsonify # type: ignore
+import queue
 import threading
-import pigpio # type: ignore
 import time
 
 import logging
+from live_status import LiveStatusHub, format_sse
+from network_jobs import NetworkJobRunner
+import nm_profiles
+import hal
+from session_store import PAGE_SIZE, SessionStore
+from smart_charging import parse_time
+from timeseries_store import TimeSeriesStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
 # Constants
 CHARGER_DETAILS_FILE = 'charger.json'
-HOTSPOT_ACTIVE = False  # Global variable to track hotspot state
+HOTSPOT_SSID = 'Joulepoint-Charger-Hotspot'
+HOTSPOT_PASSWORD = 'raspberry'
+SSE_KEEPALIVE_INTERVAL = 15  # Seconds between SSE comments on an idle stream
+WEBSERVER_THREADS = 8  # Worker threads for the WSGI server; each SSE viewer holds one
+SSE_MAX_STREAMS = WEBSERVER_THREADS - 3  # Open streams allowed at once, so pages and API calls keep workers
+DASHBOARD_POLL_INTERVAL = 5  # Seconds between /dashboard/state polls for a viewer refused a stream
 
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+live_status_hub = LiveStatusHub()
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+network_jobs = NetworkJobRunner()
+session_store = SessionStore()  # Read-only here; main.py appends the sessions
+meter_history = TimeSeriesStore()  # Read-only here; main.py records the samples
 
-# Setup for Raspberry Pi GPIO
-def is_raspberry_pi():
-    try:
-        with open('/proc/device-tree/model', 'r') as file:
-            return 'Raspberry Pi' in file.read()
-    except FileNotFoundError:
-        return False
-
-pi = pigpio.pi() if is_raspberry_pi() and pigpio.pi().connected else None
+# Setup for the provisioning button GPIO
 EMERGENCY_STOP_PIN = 5
-
-if pi:
-    pi.set_mode(EMERGENCY_STOP_PIN, pigpio.INPUT)
-    pi.set_pull_up_down(EMERGENCY_STOP_PIN, pigpio.PUD_DOWN)
+BUTTON_GLITCH_FILTER_US = 50000  # Level must be stable for 50 ms before pigpio reports an edge
+LONG_PRESS_SECONDS = 3  # Held at least this long, the provisioning button starts the hotspot
 
 # Utility functions
 def load_json_file(file_path):
@@ -45,111 +51,75 @@ def save_json_file(file_path, data):
     with open(file_path, 'w') as file:
         json.dump(data, file, indent=4)
 
-def disconnect_existing_connections():
-    try:
-        subprocess.run(['nmcli', 'device', 'disconnect', 'wlan0'], check=True)
-        print("Disconnected all connections on wlan0 successfully.")
+def create_hotspot():
+    # Reuses the saved hotspot profile; NetworkManager drops the station connection itself
+    if nm_profiles.switch_to_hotspot(HOTSPOT_SSID, HOTSPOT_PASSWORD):
+        print("Hotspot active.")
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to disconnect wlan0: {e}")
-        return False
+    print("Failed to create hotspot.")
+    return False
 
 
-def create_hotspot():
-    global HOTSPOT_ACTIVE
-    if not HOTSPOT_ACTIVE:
-        if disconnect_existing_connections():  # Ensure we're disconnected before trying to create a hotspot
-            try:
-                subprocess.run(['nmcli', 'device', 'wifi', 'hotspot', 'ifname', 'wlan0', 'con-name', 'Joulepoint-Charger-Hotspot', 'ssid', 'Joulepoint-Charger-Hotspot', 'password', 'raspberry'], check=True)
-                print("Hotspot created successfully.")
-                HOTSPOT_ACTIVE = True
-                return True
-            except subprocess.CalledProcessError as e:
-                print(f"Failed to create hotspot: {e}")
-        else:
-            print("Failed to disconnect existing connections, cannot create hotspot.")
-    else:
-        print("Hotspot already active.")
+def close_hotspot():
+    if nm_profiles.deactivate(nm_profiles.HOTSPOT_PROFILE_NAME):
+        print("Hotspot closed or not active.")
+        return True
+    print("Failed to close hotspot.")
     return False
 
 
-# def close_hotspot():
-#     # Check if the hotspot is currently active
-#     try:
-#         result = subprocess.run(['nmcli', 'con', 'show', '--active'], capture_output=True, text=True)
-#         if 'Joulepoint-Charger-Hotspot' not in result.stdout:
-#             print("No hotspot is currently active.")
-#             return True  # Return True since there is no active hotspot to close
+def connect_to_wifi(ssid, password, cancel_event=None):
+    try:
+        # Brings up the saved station profile; the hotspot (if any) is replaced in the same step
+        if nm_profiles.switch_to_station(ssid, password, cancel_event=cancel_event):
+            print("Connected successfully to WiFi network.")
+            return True
+    except Exception as e:
+        print("An unexpected error occurred:", str(e))
+    return False
 
-#         # If active, try to bring it down
-#         subprocess.run(['nmcli', 'con', 'down', 'Joulepoint-Charger-Hotspot'], check=True)
-#         print("Hotspot closed successfully.")
-#         return True  # Return True upon successful closure
 
-#     except subprocess.CalledProcessError as e:
-#         print(f"Failed to close hotspot: {e}")
-#         return False  # Return False if the command failed
+# Network jobs, run one at a time by network_jobs
+def apply_wifi_settings(ssid, password, cancel_event=None):
+    if connect_to_wifi(ssid, password, cancel_event=cancel_event):
+        print('WiFi settings updated and connected successfully!')
+        return True
+    print('Failed to connect to WiFi.')
+    return False
 
-#     except Exception as e:
-#         print('Unexpected error when closing hotspot:', e)
-#         return False  # Return False if an unexpected error occurs
 
-#     return True  # Ensuring that the function returns True by default if no conditions are met
+def start_hotspot(cancel_event=None):
+    return create_hotspot()
 
-def close_hotspot():
-    global HOTSPOT_ACTIVE
-    if HOTSPOT_ACTIVE:
-        try:
-            subprocess.run(['nmcli', 'con', 'down', 'Joulepoint-Charger-Hotspot'], check=True)
-            print("Hotspot closed successfully.")
-            HOTSPOT_ACTIVE = False
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to close hotspot: {e}")
-            return False
-    else:
-        print("No hotspot is currently active.")
-        return True
 
+def leave_hotspot(cancel_event=None):
+    charger_details = load_json_file(CHARGER_DETAILS_FILE)
+    return apply_wifi_settings(charger_details.get('wifi_ssid'), charger_details.get('wifi_password'), cancel_event=cancel_event)
 
-def connect_to_wifi(ssid, password):
-    try:
-        # Ensure that the wlan0 interface is managed and up
-        subprocess.run(['nmcli', 'device', 'set', 'wlan0', 'managed', 'yes'], check=True)
-        subprocess.run(['ip', 'link', 'set', 'wlan0', 'up'], check=True)
 
-        # Force a WiFi rescan to ensure fresh network data
-        subprocess.run(['nmcli', 'device', 'wifi', 'rescan'], check=True)
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
 
-        # Disconnect any existing connection on wlan0 to avoid conflicts
-        subprocess.run(['nmcli', 'device', 'disconnect', 'wlan0'], check=True)
-        print("Disconnected wlan0 successfully.")
 
-        # Retry connecting to the WiFi network a few times if necessary
-        for attempt in range(3):
-            try:
-                result = subprocess.run(
-                    ['nmcli', 'device', 'wifi', 'connect', ssid, 'password', password],
-                    check=True, capture_output=True, text=True)
-                print("Connected successfully to WiFi network.")
-                print("Output:", result.stdout)
-                return True
-            except subprocess.CalledProcessError as e:
-                print(f"Attempt {attempt + 1}: Failed to connect, retrying...")
-                time.sleep(5)  # Wait for 5 seconds before retrying
-
-    except subprocess.CalledProcessError as e:
-        print("Failed to execute nmcli command:", str(e))
-        print("Error output:", e.stderr)
-
-    except subprocess.TimeoutExpired:
-        print("Error: Connection attempt timed out.")
+def time_arg(name):
+    """Query-string time as epoch seconds, given as OCPP dateTime or epoch seconds; None if absent, ValueError if malformed."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return parse_time(value)
 
-    except Exception as e:
-        print("An unexpected error occurred:", str(e))
 
-    return False
+def session_filters():
+    """SessionStore filters from the query string. ValueError if malformed."""
+    def int_arg(name):
+        value = request.args.get(name)
+        return int(value) if value else None
 
+    return {'since': time_arg('from'), 'until': time_arg('to'), 'transaction_id': int_arg('transaction_id'),
+            'connector_id': int_arg('connector'), 'id_tag': request.args.get('id_tag') or None}
 
 
 # Flask Routes
@@ -169,51 +139,232 @@ def index():
             'charger_id': charger_id
         })
 
-        # Update network connection
-        if close_hotspot():
-            if connect_to_wifi(ssid, password):
-                print('WiFi settings updated and connected successfully!')
-            else:
-                print('Failed to connect to WiFi.')
+        # Update network connection in the background and answer right away
+        job = network_jobs.submit('apply_wifi_settings', apply_wifi_settings, ssid, password)
+        if wants_json():
+            return jsonify(job.to_dict()), 202
+        return redirect(url_for('index', job=job.id))
+
+    charger_details = load_json_file(CHARGER_DETAILS_FILE)
+    return render_template('index.html', charger_details=charger_details, job_id=request.args.get('job'))
+
+
+@app.route('/network/status')
+def network_status():
+    try:
+        mode = nm_profiles.current_mode()
+    except Exception as e:
+        mode = None
+        logging.error(f"Could not query NetworkManager state: {e}")
+    return jsonify({"mode": mode, "last_switch": nm_profiles.last_switch})
+
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify(network_jobs.list())
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = network_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if network_jobs.get(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"cancelled": network_jobs.cancel(job_id), "job": network_jobs.get(job_id)})
+
+
+def event_stream(generate, on_close=None):
+    """
+    Serve generate() as Server-Sent Events in one of SSE_MAX_STREAMS slots.
+    Each open stream holds a WSGI worker thread, so once every slot is taken
+    the request is answered with 503 instead of starving the other routes.
+    """
+    if not sse_slots.acquire(blocking=False):
+        if on_close:
+            on_close()
+        return jsonify({"error": "Too many open streams"}), 503, {'Retry-After': str(SSE_KEEPALIVE_INTERVAL)}
+
+    def close():
+        sse_slots.release()
+        if on_close:
+            on_close()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(close)  # Runs once the server closes the response, even if nothing was sent
+    return response
+
+
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    job = network_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def generate():
+        current = job
+        yield format_sse('job', current)
+        while current is not None and current['status'] not in ('succeeded', 'failed', 'cancelled'):
+            updated = network_jobs.wait_for_update(job_id, current, SSE_KEEPALIVE_INTERVAL)
+            if updated == current:
+                yield ': keepalive\n\n'
+                continue
+            current = updated
+            if current is not None:
+                yield format_sse('job', current)
+
+    return event_stream(generate)
+
+
+@app.route('/sessions')
+def sessions():
+    try:
+        filters = session_filters()
+        cursor = int(request.args.get('cursor') or 0)
+        limit = int(request.args.get('limit') or PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": f"Bad query parameter: {e}"}), 400
+    page, next_cursor = session_store.query(cursor=cursor, limit=limit, **filters)
+    return jsonify({"sessions": page, "next_cursor": next_cursor})
+
+
+@app.route('/sessions/export.<fmt>')
+def export_sessions(fmt):
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "Unknown export format"}), 404
+    try:
+        filters = session_filters()
+    except ValueError as e:
+        return jsonify({"error": f"Bad query parameter: {e}"}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(session_store.export(fmt, **filters)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=charging_sessions.{fmt}',
+                             'X-Accel-Buffering': 'no'})
+
+
+@app.route('/meter_history/<int:connector_id>')
+def meter_history_export(connector_id):
+    try:
+        until = time_arg('to') or time.time()
+        since = time_arg('from') or until - 3600
+    except ValueError as e:
+        return jsonify({"error": f"Bad query parameter: {e}"}), 400
+
+    def generate():
+        for row in meter_history.query(connector_id, since, until):
+            yield json.dumps(row) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+
+@app.route('/dashboard')
+def dashboard():
+    return render_template('dashboard.html', poll_interval=DASHBOARD_POLL_INTERVAL)
+
+
+@app.route('/dashboard/state')
+def dashboard_state():
+    return jsonify(live_status_hub.snapshot())
+
+
+@app.route('/dashboard/stream')
+def dashboard_stream():
+    subscriber = live_status_hub.subscribe()
+
+    def generate():
+        while True:
+            try:
+                event, data = subscriber.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                yield format_sse(event, data)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+
+    return event_stream(generate, on_close=lambda: live_status_hub.unsubscribe(subscriber))
+
+
+# Provisioning button
+class ProvisioningButton:
+    """
+    Edge-triggered handling of the provisioning button on EMERGENCY_STOP_PIN.
+    pigpio filters contact bounce in the daemon and calls back only on edges,
+    so nothing runs while the button is idle.
+
+    A press is classified when the button is released, from the edge ticks:
+    held for LONG_PRESS_SECONDS or more it starts the hotspot (what holding the
+    button did before), shorter it leaves the hotspot and reconnects to the
+    saved WiFi network (what releasing it did).
+    """
+
+    PRESSED = 0  # Level read while the button is held
+
+    def __init__(self, button_input, long_press_seconds=LONG_PRESS_SECONDS, on_short_press=None, on_long_press=None):
+        self.input = button_input
+        self.long_press_seconds = long_press_seconds
+        self.on_short_press = on_short_press
+        self.on_long_press = on_long_press
+        self.last_level = None
+        self.pressed_tick = None
+        self.callback = None
+
+    def start(self):
+        self.last_level = self.input.read()  # Only changes act, as before
+        self.callback = self.input.watch(self._on_edge, BUTTON_GLITCH_FILTER_US)
+        return self
+
+    def stop(self):
+        if self.callback is not None:
+            self.callback.cancel()
+            self.callback = None
+
+    def _on_edge(self, level, tick):
+        if level not in (0, 1) or level == self.last_level:
+            return  # Watchdog ticks and repeated levels
+        self.last_level = level
+        if level == self.PRESSED:
+            self.pressed_tick = tick
+            return
+        if self.pressed_tick is None:
+            return  # Held since before start(); its length is unknown
+        held = ((tick - self.pressed_tick) & 0xFFFFFFFF) / 1e6  # Ticks are µs and wrap at 2**32
+        self.pressed_tick = None
+        if held >= self.long_press_seconds:
+            logging.info(f"Provisioning button long press ({held:.1f}s).")
+            if self.on_long_press:
+                self.on_long_press()
         else:
-            print('Hotspot was not closed; cannot connect to WiFi.')
+            logging.info(f"Provisioning button short press ({held:.1f}s).")
+            if self.on_short_press:
+                self.on_short_press()
 
-        return redirect(url_for('index'))
 
-    charger_details = load_json_file(CHARGER_DETAILS_FILE)
-    return render_template('index.html', charger_details=charger_details)
-
-
-# Button monitoring function
-def monitor_emergency_button():
-    global HOTSPOT_ACTIVE
-    last_state = pi.read(EMERGENCY_STOP_PIN) if pi else 1
-    debounce_time = 0.1  # 100 milliseconds
-
-    while True:
-        current_state = pi.read(EMERGENCY_STOP_PIN) if pi else 1
-        time.sleep(0.01)  # Short sleep to reduce CPU load
-
-        # Read again after a short delay to confirm the state
-        confirmed_state = pi.read(EMERGENCY_STOP_PIN) if pi else 1
-        if confirmed_state == current_state and current_state != last_state:
-            if current_state == 0:  # Assuming 0 is pressed state
-                print('HOTSPOT ON current_state', current_state, 'last_state', last_state, 'EMERGENCY_STOP_PIN', EMERGENCY_STOP_PIN)
-                create_hotspot()
-            elif current_state == 1:  # Assuming 1 is released state
-                print('HOTSPOT OFF current_state', current_state, 'last_state', last_state, 'EMERGENCY_STOP_PIN', EMERGENCY_STOP_PIN)
-                close_hotspot()
-                charger_details = load_json_file(CHARGER_DETAILS_FILE)
-                if connect_to_wifi(charger_details['wifi_ssid'], charger_details['wifi_password']):
-                    print('WiFi settings updated and connected successfully!')
-                else:
-                    print('Failed to connect to WiFi.')
-                print('WiFi settings updated and connected successfully!', charger_details)
-            last_state = current_state  # Update last_state only after handling the change
-            time.sleep(debounce_time)  # Debounce delay
+provisioning_button = None
+
+def start_provisioning_button():
+    global provisioning_button
+    provisioning_button = ProvisioningButton(
+        hal.create_input(EMERGENCY_STOP_PIN, pull='down'),
+        on_short_press=lambda: network_jobs.submit('leave_hotspot', leave_hotspot),
+        on_long_press=lambda: network_jobs.submit('start_hotspot', start_hotspot),
+    ).start()
+    return provisioning_button
 
 
 if __name__ == '__main__':
-    if pi:
-        threading.Thread(target=monitor_emergency_button, daemon=True).start()
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    live_status_hub.start()
+    network_jobs.start()
+    try:
+        start_provisioning_button()
+    except RuntimeError as e:
+        logging.error(f"Provisioning button unavailable: {e}")
+    try:
+        from waitress import serve # type: ignore
+        serve(app, host='0.0.0.0', port=5000, threads=WEBSERVER_THREADS)
+    except ImportError:
+        logging.warning("waitress is not installed, falling back to the Flask development server.")
+        app.run(host='0.0.0.0', port=5000, threaded=True, use_reloader=False)